@@ -1,8 +1,37 @@
 import asyncio
+import argparse
 import logging 
+import multiprocessing
+import os
+import time
 from typing import Optional 
-from core import DataClient, OrderManager, Client
-from core import ORDER_TYPE_DAY, SIDE_BUY, SIDE_SELL
+import numpy as np
+from core import DataClient, OrderManager, Client, SystemMonitoring, SharedPositionTable, OrderStateStore, RiskManager
+from core import MarketClock, TradingHoursScheduler
+from core import configure_logging, install_uvloop, DEFAULT_LOG_RATE_LIMITS
+from tickstore import TickRecorder, HistoricalDataClient
+from core import ORDER_TYPE_DAY, SIDE_BUY, SIDE_SELL, PRIORITY_HIGH, STAGE_STRATEGY_DECISION, STAGE_FILL_TO_TAKE_PROFIT
+from core import ORDER_CLASS_BRACKET, ORDER_CLASS_OTO, HELD
+
+strategy_logger = logging.getLogger("MarketMaker")
+
+
+def bracket_params(side: str, price: float, take_profit_margin: float, stop_loss_margin: Optional[float] = None) -> dict:
+    """insert_order keyword arguments attaching a take-profit exit, and a stop-loss if stop_loss_margin is given,
+    to an entry at price. The broker holds the exits and releases them the moment the entry fills."""
+    sign = 1 if side == SIDE_BUY else -1
+    params = {"order_class": ORDER_CLASS_OTO, "take_profit": round(float(price * (1 + sign * take_profit_margin)), 2)}
+    if stop_loss_margin is not None and not np.isnan(stop_loss_margin):
+        params["order_class"] = ORDER_CLASS_BRACKET
+        params["stop_loss"] = round(float(price * (1 - sign * stop_loss_margin)), 2)
+    return params
+
+
+def resting_exit_ids(dataclient: DataClient, symbol: str, pos_qty: float) -> set:
+    """Live orders that reduce the position in symbol and are not entries themselves, i.e. released exit legs."""
+    exit_side = SIDE_SELL if pos_qty > 0 else SIDE_BUY
+    return {state.order_id for state in dataclient.get_live_orders(symbol, side=exit_side) if state.leg_ids is None and state.status != HELD}
+
 
 class MarketMaker:
     def __init__(self, dataclient: DataClient, 
@@ -11,7 +40,12 @@ class MarketMaker:
                  margins: Optional[float] = 0.0, 
                  max_position: Optional[int] = None,
                  trader_loop_sleep_time: int = 30, 
-                 tp_loop_sleep_time: int = 10):
+                 tp_loop_sleep_time: int = 10,
+                 requote_threshold: Optional[float] = None,
+                 volatility_multiplier: float = 0.0,
+                 market_clock: Optional[MarketClock] = None,
+                 use_bracket_orders: bool = False,
+                 stop_loss_margin: Optional[float] = None):
         self._dataclient: DataClient = dataclient
         self._ordermanager: OrderManager = ordermanager
         self._symbol: Optional[str] = symbol
@@ -21,30 +55,75 @@ class MarketMaker:
         self._sell_price: Optional[float] = None
         self._trader_loop_sleep_time: int = trader_loop_sleep_time
         self._tp_loop_sleep_time: int = tp_loop_sleep_time
+        # Relative mid move that triggers a requote. None keeps the fixed-sleep polling loops.
+        self._requote_threshold: Optional[float] = requote_threshold
+        self._last_quoted_mid: Optional[float] = None
+        self._open_order_ids: list = []
+        # Kept across cycles so orders of a cycle that raised are still cancelled by the next one
+        self._quote_order_ids: list = []
+        self._take_profit_order_ids: list = []
+        # Widen the quoted margin by this many per-update mid volatilities
+        self._volatility_multiplier: float = volatility_multiplier
+        # When set, the loops cancel their orders and sleep while the market is closed
+        self._market_clock: Optional[MarketClock] = market_clock
+        # Attach the take-profit (and stop-loss) to each entry at the broker instead of running _take_profit
+        self._use_bracket_orders: bool = use_bracket_orders
+        self._stop_loss_margin: Optional[float] = stop_loss_margin
+        # Set once the loops run and, when event-driven, have subscribed to the DataClient
+        self._started = asyncio.Event()
+
+    async def wait_started(self) -> None:
+        await self._started.wait()
+
+    def _entry_params(self, side: str, price: float) -> dict:
+        return bracket_params(side, price, self._margins, self._stop_loss_margin) if self._use_bracket_orders else {}
+
+    def _quote_margin(self) -> float:
+        if self._volatility_multiplier == 0.0:
+            return self._margins
+        return self._margins + self._volatility_multiplier * self._dataclient.get_signals(self._symbol).volatility
+
+    def _record_decision_latency(self) -> None:
+        received_ns = self._dataclient.get_last_quote_received_ns(self._symbol)
+        if received_ns is not None:
+            SystemMonitoring.record_latency(STAGE_STRATEGY_DECISION, time.monotonic_ns() - received_ns)
+
+    async def _wait_for_market(self) -> None:
+        """Cancel this symbol's resting orders and sleep until the next open if the market is closed."""
+        if self._market_clock is None or self._market_clock.is_open():
+            return
+        order_ids = self._quote_order_ids + self._take_profit_order_ids + self._open_order_ids
+        self._quote_order_ids, self._take_profit_order_ids, self._open_order_ids = [], [], []
+        self._last_quoted_mid = None
+        if order_ids:
+            await self._ordermanager.batch_cancel_orders(order_ids)
+        strategy_logger.info("Market closed, %s waits for the open", self._symbol)
+        await self._market_clock.wait_until_open()
 
     async def _get_fill_price(self):
         position_object = await self._dataclient.get_position_object_by_symbol(self._symbol)
         if position_object is not None:
             return float(position_object['avg_entry_price'])
         else:
-            logging.warning(f"No position found for {self._symbol}")
+            strategy_logger.warning("No position found for %s", self._symbol)
             return None # Return None if no position is found
         
     async def _trader(self):
         while True:
-            Order_ID_trader = []
+            await self._wait_for_market()
             pos_qty = self._dataclient.get_position_by_symbol(self._symbol)
 
             price = self._dataclient.get_last_mid_price(self._symbol)  
 
-            if price is None:
-                logging.error(f"No price info available for symbol {self._symbol}. Skipping this cycle.")
+            if price is None or self._dataclient.is_stale(self._symbol):
+                strategy_logger.error("No fresh price info available for symbol %s. Skipping this cycle.", self._symbol)
                 await asyncio.sleep(20)  # Sleep before retrying
                 continue
 
-            logging.info(f"midprice of {self._symbol} is {price}")
-            self._buy_price = round(price - price * self._margins, 2)
-            self._sell_price = round(price + price * self._margins, 2)
+            strategy_logger.info("midprice of %s is %s", self._symbol, price)
+            margin = self._quote_margin()
+            self._buy_price = round(price - price * margin, 2)
+            self._sell_price = round(price + price * margin, 2)
 
             # try:
             #     if pos_qty == 0:
@@ -71,7 +150,7 @@ class MarketMaker:
 
             try:
                 if pos_qty == 0:
-                    logging.info(f"{self._symbol} has {pos_qty} Net Position, inserting buy limit order at {self._buy_price} and sell limit order at {self._sell_price}")
+                    strategy_logger.info("%s has %s Net Position, inserting buy limit order at %s and sell limit order at %s", self._symbol, pos_qty, self._buy_price, self._sell_price)
                     
                     # Use asyncio.gather to submit both orders concurrently
                     long_order, short_order = await asyncio.gather(
@@ -80,41 +159,44 @@ class MarketMaker:
                             price=self._buy_price, 
                             quantity=self._max_position, 
                             side=SIDE_BUY, 
-                            order_type=ORDER_TYPE_DAY
+                            order_type=ORDER_TYPE_DAY,
+                            **self._entry_params(SIDE_BUY, self._buy_price)
                         ),
                         self._ordermanager.insert_order(
                             symbol=self._symbol, 
                             price=self._sell_price, 
                             quantity=self._max_position, 
                             side=SIDE_SELL, 
-                            order_type=ORDER_TYPE_DAY
+                            order_type=ORDER_TYPE_DAY,
+                            **self._entry_params(SIDE_SELL, self._sell_price)
                         )
                     )
 
                     # Check the results of both orders
                     if long_order and long_order.success:
-                        Order_ID_trader.append(long_order.order_id)
+                        self._quote_order_ids.append(long_order.order_id)
                     if short_order and short_order.success:
-                        Order_ID_trader.append(short_order.order_id)
+                        self._quote_order_ids.append(short_order.order_id)
 
             except Exception as e:
-                logging.error(f"Error in placing orders: {e}")
+                strategy_logger.error("Error in placing orders: %s", e)
 
 
             await asyncio.sleep(self._trader_loop_sleep_time)  
 
 
-            for order in Order_ID_trader:
-                try:
-                    await self._ordermanager.cancel_order(order)
-                except Exception as e:
-                    logging.error(f"Error cancelling order {order}: {e}")
+            order_ids, self._quote_order_ids = self._quote_order_ids, []
+            try:
+                await self._ordermanager.batch_cancel_orders(order_ids)
+            except Exception as e:
+                strategy_logger.error("Error cancelling orders %s: %s", order_ids, e)
+                self._quote_order_ids.extend(order_ids)
         
 
     async def _take_profit(self):
         while True:
+            await self._wait_for_market()
             pos_qty = self._dataclient.get_position_by_symbol(self._symbol)
-            Order_ID_TP = []
             
             try:
                 if pos_qty != 0:  # Only execute logic if there is a position
@@ -123,19 +205,19 @@ class MarketMaker:
                     
                     # Ensure valid PnL calculation
                     if fill_price is None or mid_price is None:
-                        logging.warning(f"No valid fill price or PnL for {self._symbol}. Skipping take-profit for this cycle.")
+                        strategy_logger.warning("No valid fill price or PnL for %s. Skipping take-profit for this cycle.", self._symbol)
                         await asyncio.sleep(self._tp_loop_sleep_time)
                         continue
 
                     # Calculate PnL
                     pnl = (mid_price / fill_price - 1) if pos_qty > 0 else (1 - mid_price / fill_price)
-                    logging.info(f"PnL of {self._symbol} is {pnl}. Mid price is {mid_price} and fill price of {'long' if pos_qty > 0 else 'short'} position is {fill_price}")
+                    strategy_logger.info("PnL of %s is %s. Mid price is %s and fill price of %s position is %s", self._symbol, pnl, mid_price, 'long' if pos_qty > 0 else 'short', fill_price)
 
                     # Calculate take-profit price
                     take_profit_price = fill_price * (1 + self._margins) if pos_qty > 0 else fill_price * (1 - self._margins)
                     take_profit_price = round(take_profit_price, 2)
                     side = SIDE_SELL if pos_qty > 0 else SIDE_BUY
-                    logging.info(f"Inserting {'sell' if pos_qty > 0 else 'buy'} take-profit order at {take_profit_price} for {self._symbol}. Fill Price was {fill_price}")
+                    strategy_logger.info("Inserting %s take-profit order at %s for %s. Fill Price was %s", 'sell' if pos_qty > 0 else 'buy', take_profit_price, self._symbol, fill_price)
 
                     # Place take-profit order
                     tp_order = await self._ordermanager.insert_order(
@@ -143,55 +225,494 @@ class MarketMaker:
                         price=take_profit_price, 
                         quantity=abs(pos_qty), 
                         side=side, 
-                        order_type=ORDER_TYPE_DAY
+                        order_type=ORDER_TYPE_DAY,
+                        priority=PRIORITY_HIGH
                     )
                     if tp_order and tp_order.success:
-                        Order_ID_TP.append(tp_order.order_id)
+                        self._take_profit_order_ids.append(tp_order.order_id)
             
             except Exception as e:
-                logging.error(f"Error in placing take-profit orders: {e}")
+                strategy_logger.error("Error in placing take-profit orders: %s", e)
 
             await asyncio.sleep(self._tp_loop_sleep_time)
 
-            for order in Order_ID_TP:
+            order_ids, self._take_profit_order_ids = self._take_profit_order_ids, []
+            try:
+                await self._ordermanager.batch_cancel_orders(order_ids)
+            except Exception as e:
+                strategy_logger.error("Error cancelling take-profit orders %s: %s", order_ids, e)
+                self._take_profit_order_ids.extend(order_ids)
+
+
+    def _needs_requote(self, mid_price: float, fill: bool) -> bool:
+        if fill or self._last_quoted_mid is None:
+            return True
+        return abs(mid_price - self._last_quoted_mid) > self._last_quoted_mid * self._requote_threshold
+
+    async def _insert_quotes(self, mid_price: float) -> list:
+        margin = self._quote_margin()
+        self._buy_price = round(mid_price - mid_price * margin, 2)
+        self._sell_price = round(mid_price + mid_price * margin, 2)
+        strategy_logger.info("%s is flat, inserting buy limit order at %s and sell limit order at %s", self._symbol, self._buy_price, self._sell_price)
+        self._record_decision_latency()
+        long_order, short_order = await asyncio.gather(
+            self._ordermanager.insert_order(symbol=self._symbol, price=self._buy_price, quantity=self._max_position, side=SIDE_BUY, order_type=ORDER_TYPE_DAY,
+                                            **self._entry_params(SIDE_BUY, self._buy_price)),
+            self._ordermanager.insert_order(symbol=self._symbol, price=self._sell_price, quantity=self._max_position, side=SIDE_SELL, order_type=ORDER_TYPE_DAY,
+                                            **self._entry_params(SIDE_SELL, self._sell_price))
+        )
+        return [order.order_id for order in (long_order, short_order) if order and order.success]
+
+    async def _insert_take_profit(self, pos_qty: float) -> list:
+        fill_price = await self._get_fill_price()
+        if fill_price is None:
+            return []
+        take_profit_price = fill_price * (1 + self._margins) if pos_qty > 0 else fill_price * (1 - self._margins)
+        take_profit_price = round(take_profit_price, 2)
+        side = SIDE_SELL if pos_qty > 0 else SIDE_BUY
+        strategy_logger.info("Inserting %s take-profit order at %s for %s. Fill Price was %s", side, take_profit_price, self._symbol, fill_price)
+        self._record_decision_latency()
+        tp_order = await self._ordermanager.insert_order(symbol=self._symbol, price=take_profit_price, quantity=abs(pos_qty), side=side, order_type=ORDER_TYPE_DAY,
+                                                       priority=PRIORITY_HIGH)
+        fill_received_ns = self._dataclient.get_last_fill_received_ns(self._symbol)
+        if tp_order and tp_order.success and fill_received_ns is not None:
+            SystemMonitoring.record_latency(STAGE_FILL_TO_TAKE_PROFIT, time.monotonic_ns() - fill_received_ns)
+        return [tp_order.order_id] if tp_order and tp_order.success else []
+
+    async def _pull_quotes(self) -> None:
+        """Cancel resting orders while market data is stale, and requote from scratch once it is fresh again."""
+        self._last_quoted_mid = None
+        if self._open_order_ids:
+            order_ids, self._open_order_ids = self._open_order_ids, []
+            strategy_logger.warning("Market data for %s is stale, cancelling %s orders", self._symbol, len(order_ids))
+            try:
+                await self._ordermanager.batch_cancel_orders(order_ids)
+            except Exception as e:
+                strategy_logger.error("Error cancelling orders %s: %s", order_ids, e)
+
+    async def _requote_on_update(self):
+        """Event-driven replacement for _trader and _take_profit: act only when the mid moves past
+        requote_threshold or a fill arrives, instead of waking on a fixed sleep."""
+        subscription = self._dataclient.subscribe(self._symbol)
+        self._started.set()
+        # Adopt orders left resting by a previous run (see OrderManager.sync_open_orders) so the first requote cancels them
+        self._open_order_ids = [state.order_id for state in self._dataclient.get_live_orders(self._symbol)]
+        try:
+            while True:
+                fill = await subscription.wait()
+                await self._wait_for_market()
+                if self._dataclient.is_stale(self._symbol):
+                    await self._pull_quotes()
+                    continue
+                mid_price = self._dataclient.get_last_mid_price(self._symbol)
+                if mid_price is None or not self._needs_requote(mid_price, fill):
+                    continue
                 try:
-                    await self._ordermanager.cancel_order(order)
+                    pos_qty = self._dataclient.get_position_by_symbol(self._symbol)
+                    # With bracket orders the exit released by the fill already rests at the broker, keep it
+                    keep = resting_exit_ids(self._dataclient, self._symbol, pos_qty) if self._use_bracket_orders and pos_qty != 0 else set()
+                    order_ids = [order_id for order_id in self._open_order_ids if order_id not in keep]
+                    self._open_order_ids = list(keep)
+                    if order_ids:
+                        await self._ordermanager.batch_cancel_orders(order_ids)
+                    if pos_qty == 0:
+                        self._open_order_ids = await self._insert_quotes(mid_price)
+                    elif not keep:
+                        self._open_order_ids = await self._insert_take_profit(pos_qty)
+                    self._last_quoted_mid = mid_price
                 except Exception as e:
-                    logging.error(f"Error cancelling take-profit order {order}: {e}")
-
+                    strategy_logger.error("Error requoting %s: %s", self._symbol, e)
+        finally:
+            self._dataclient.unsubscribe(subscription)
 
     async def main(self) -> None:     
-        await asyncio.gather(self._trader(), self._take_profit())
+        if self._requote_threshold is not None:
+            loops = [self._requote_on_update]
+        else:
+            loops = [self._trader] if self._use_bracket_orders else [self._trader, self._take_profit]
+            self._started.set()  # the polling loops do not subscribe
+        # Named per symbol, so SystemMonitoring can tell which loop stalled the event loop
+        await asyncio.gather(*(asyncio.create_task(loop(), name=f"MarketMaker.{loop.__name__}[{self._symbol}]") for loop in loops))
 
     
-async def MarketMakerBasic():
-    i = DataClient(symbols={"AAPL","AMZN","TSLA","NVDA","META", "GOOGL","QCOM","MSFT","NFLX"})
+class MarketMakerEngine:
+    """All symbols in one coroutine. Per-symbol config and state live in numpy arrays indexed by symbol
+    position; each wake-up requotes every dirty symbol in one vectorized pass and sends the resulting
+    cancels and inserts as batches, so adding symbols adds rows rather than coroutines."""
+    def __init__(self, dataclient: DataClient, ordermanager: OrderManager, symbol_configs: dict, default_params: Optional[dict] = None):
+        self._dataclient: DataClient = dataclient
+        self._ordermanager: OrderManager = ordermanager
+        self._symbols: list = list(symbol_configs)
+        self._index: dict = {symbol: position for position, symbol in enumerate(self._symbols)}
+        default_params = default_params or {}
+        configs = [{**default_params, **symbol_configs[symbol]} for symbol in self._symbols]
+        self._margins = np.array([config.get("margins", 0.0) for config in configs], dtype=np.float64)
+        self._max_position = np.array([config.get("max_position") or 0 for config in configs], dtype=np.float64)
+        self._requote_threshold = np.array([config.get("requote_threshold") or 0.0 for config in configs], dtype=np.float64)
+        self._volatility_multiplier = np.array([config.get("volatility_multiplier", 0.0) for config in configs], dtype=np.float64)
+        self._use_bracket_orders = np.array([config.get("use_bracket_orders", False) for config in configs], dtype=bool)
+        self._stop_loss_margin = np.array([config.get("stop_loss_margin") or np.nan for config in configs], dtype=np.float64)
+        self._last_quoted_mid = np.full(len(self._symbols), np.nan)
+        self._open_order_ids: list = [[] for _ in self._symbols]
+        # Set by pause() outside trading hours, wake-ups are ignored until resume()
+        self._paused: bool = False
+        self._subscription = None
+
+    def get_symbols(self) -> list:
+        return self._symbols
+
+    def get_open_order_ids(self, symbol: str) -> list:
+        return self._open_order_ids[self._index[symbol]]
+
+    def _select(self, dirty: set, filled: set):
+        """Indices and mids of the dirty symbols whose mid moved past their threshold or that were filled."""
+        indices = np.fromiter((self._index[symbol] for symbol in dirty if symbol in self._index), dtype=np.intp)
+        mids = np.array([self._dataclient.get_last_mid_price(self._symbols[index]) or np.nan for index in indices], dtype=np.float64)
+        fills = np.array([self._symbols[index] in filled for index in indices], dtype=bool)
+        last = self._last_quoted_mid[indices]
+        with np.errstate(invalid="ignore"):
+            moved = np.abs(mids - last) > last * self._requote_threshold[indices]
+        selected = ~np.isnan(mids) & (fills | np.isnan(last) | moved)
+        return indices[selected], mids[selected]
+
+    async def _pull_quotes(self, symbols: list, reason: str = "market data is stale") -> None:
+        """Cancel the resting orders of symbols, they are requoted from scratch on their next update."""
+        cancel_ids = []
+        for symbol in symbols:
+            index = self._index[symbol]
+            self._last_quoted_mid[index] = np.nan
+            cancel_ids.extend(self._open_order_ids[index])
+            if self._use_bracket_orders[index]:
+                # Exits released by a filled entry are not tracked as open ids, cancel them with their parent
+                cancel_ids.extend(leg.order_id for order_id in self._open_order_ids[index]
+                                  for leg in self._dataclient.get_order_store().get_legs(order_id) if leg.status != HELD and leg.order_id not in cancel_ids)
+            self._open_order_ids[index] = []
+        if cancel_ids:
+            strategy_logger.warning("Pulling quotes of %s (%s), cancelling %s orders", sorted(symbols), reason, len(cancel_ids))
+            await self._ordermanager.batch_cancel_orders(cancel_ids)
+
+    async def _requote(self, dirty: set, filled: set) -> None:
+        stale = [symbol for symbol in dirty if symbol in self._index and self._dataclient.is_stale(symbol)]
+        if stale:
+            await self._pull_quotes(stale)
+            dirty = dirty.difference(stale)
+        indices, mids = self._select(dirty, filled)
+        if len(indices) == 0:
+            return
+        volatility = np.array([self._dataclient.get_signals(self._symbols[index]).volatility for index in indices], dtype=np.float64)
+        margins = self._margins[indices] + self._volatility_multiplier[indices] * volatility
+        buy_prices = np.round(mids - mids * margins, 2)
+        sell_prices = np.round(mids + mids * margins, 2)
+
+        positions = [self._dataclient.get_position_by_symbol(self._symbols[index]) for index in indices]
+        cancel_ids = []
+        for index, pos_qty in zip(indices, positions):
+            # With bracket orders the exit released by the fill already rests at the broker, keep it
+            keep = resting_exit_ids(self._dataclient, self._symbols[index], pos_qty) if self._use_bracket_orders[index] and pos_qty != 0 else set()
+            cancel_ids.extend(order_id for order_id in self._open_order_ids[index] if order_id not in keep)
+            self._open_order_ids[index] = list(keep)
+        if cancel_ids:
+            await self._ordermanager.batch_cancel_orders(cancel_ids)
+
+        orders, owners = [], []
+        for position, index in enumerate(indices):
+            symbol = self._symbols[index]
+            pos_qty = positions[position]
+            if pos_qty == 0:
+                quantity = int(self._max_position[index])
+                buy_price, sell_price = float(buy_prices[position]), float(sell_prices[position])
+                buy_order = {"symbol": symbol, "price": buy_price, "quantity": quantity, "side": SIDE_BUY, "order_type": ORDER_TYPE_DAY}
+                sell_order = {"symbol": symbol, "price": sell_price, "quantity": quantity, "side": SIDE_SELL, "order_type": ORDER_TYPE_DAY}
+                if self._use_bracket_orders[index]:
+                    buy_order.update(bracket_params(SIDE_BUY, buy_price, self._margins[index], self._stop_loss_margin[index]))
+                    sell_order.update(bracket_params(SIDE_SELL, sell_price, self._margins[index], self._stop_loss_margin[index]))
+                orders += [buy_order, sell_order]
+                owners += [index, index]
+            elif not self._open_order_ids[index]:
+                position_object = await self._dataclient.get_position_object_by_symbol(symbol)
+                if position_object is None:
+                    strategy_logger.warning("No position found for %s", symbol)
+                    continue
+                fill_price = float(position_object['avg_entry_price'])
+                take_profit_price = fill_price * (1 + self._margins[index]) if pos_qty > 0 else fill_price * (1 - self._margins[index])
+                orders.append({"symbol": symbol, "price": round(float(take_profit_price), 2), "quantity": abs(pos_qty),
+                               "side": SIDE_SELL if pos_qty > 0 else SIDE_BUY, "order_type": ORDER_TYPE_DAY, "priority": PRIORITY_HIGH})
+                owners.append(index)
+            received_ns = self._dataclient.get_last_quote_received_ns(symbol)
+            if received_ns is not None:
+                SystemMonitoring.record_latency(STAGE_STRATEGY_DECISION, time.monotonic_ns() - received_ns)
+
+        strategy_logger.info("Requoting %s symbols with %s orders after cancelling %s", len(indices), len(orders), len(cancel_ids))
+        responses = await self._ordermanager.batch_insert_orders(orders)
+        for index, response in zip(owners, responses):
+            if response and response.success:
+                self._open_order_ids[index].append(response.order_id)
+        self._last_quoted_mid[indices] = mids
+
+    def is_paused(self) -> bool:
+        return self._paused
+
+    async def pause(self) -> None:
+        """Stop quoting and cancel every resting order, e.g. when the market closes."""
+        self._paused = True
+        await self._pull_quotes(self._symbols, reason="paused")
+
+    def resume(self) -> None:
+        """Quote again, starting with a full pass over every symbol."""
+        self._paused = False
+        if self._subscription is not None:
+            for symbol in self._symbols:
+                self._subscription.notify(symbol)
+
+    async def flatten(self) -> None:
+        """Pause, then close the positions of this engine's symbols with market orders."""
+        await self.pause()
+        symbols = [symbol for symbol in self._symbols if self._dataclient.get_position_by_symbol(symbol) != 0]
+        if symbols:
+            strategy_logger.info("Flattening positions in %s", symbols)
+            await asyncio.gather(*(self._ordermanager.close_position(symbol) for symbol in symbols))
+
+    async def main(self) -> None:
+        subscription = self._subscription = self._dataclient.subscribe_many(self._symbols)
+        # Adopt orders left resting by a previous run (see OrderManager.sync_open_orders) so the first requote cancels them
+        for index, symbol in enumerate(self._symbols):
+            self._open_order_ids[index] = [state.order_id for state in self._dataclient.get_live_orders(symbol)]
+        # Quotes that arrived before the engine started produced no notification, so begin with a full pass
+        for symbol in self._symbols:
+            subscription.notify(symbol)
+        try:
+            while True:
+                dirty, filled = await subscription.wait()
+                if self._paused:
+                    continue
+                try:
+                    await self._requote(dirty, filled)
+                    if self._paused:
+                        # Paused while this requote was in flight, its inserts must not be left resting
+                        await self._pull_quotes(self._symbols, reason="paused")
+                except Exception as e:
+                    strategy_logger.error("Error requoting %s: %s", sorted(dirty), e)
+        finally:
+            self._subscription = None
+            self._dataclient.unsubscribe(subscription)
+
+
+SYMBOL_CONFIGS = {
+    "AAPL": {"margins": 0.002, "max_position": 5},
+    "AMZN": {"margins": 0.002, "max_position": 6},
+    "TSLA": {"margins": 0.002, "max_position": 5},
+    "NVDA": {"margins": 0.002, "max_position": 9},
+    "META": {"margins": 0.002, "max_position": 2},
+    "GOOGL": {"margins": 0.002, "max_position": 7},
+    "QCOM": {"margins": 0.002, "max_position": 5},
+    "MSFT": {"margins": 0.002, "max_position": 2},
+    "NFLX": {"margins": 0.002, "max_position": 1},
+}
+DEFAULT_STRATEGY_PARAMS = {"trader_loop_sleep_time": 15, "tp_loop_sleep_time": 5, "requote_threshold": 0.001,
+                           "use_bracket_orders": False, "stop_loss_margin": None}
+
+
+async def _bootstrap_orders(o: OrderManager, reset_account: bool, symbols: list) -> None:
+    if reset_account:
+        # close_all_positions cancels open orders too, the explicit cancel also covers symbols without a position
+        await asyncio.gather(o.cancel_all_orders(), o.close_all_positions())
+    else:
+        await o.sync_open_orders(symbols=symbols)
+
+
+async def run_market_makers(symbol_configs: dict, reset_account: bool = True, shared_table: Optional[SharedPositionTable] = None,
+                            record_root: Optional[str] = None, ready_timeout: float = 10.0, trading_hours: bool = True,
+                            calendar_cache: Optional[str] = None, flatten_before: float = 300.0, raw_stream: bool = False,
+                            metrics_port: Optional[int] = None):
+    """Bootstrap concurrently (session warmup, account reset or open-order snapshot, positions snapshot, stream
+    connection, market calendar) and start quoting once every symbol has its first quote, or after ready_timeout
+    at the latest. With trading_hours, quoting and the stream are paused while the market is closed and
+    positions are flattened flatten_before seconds ahead of the close. raw_stream decodes market data with
+    RawMarketDataStream instead of the SDK stream. The event loop monitor always runs, metrics_port serves its
+    metrics (see SystemMonitoring.metrics_text)."""
+    started = time.perf_counter()
+    order_store = OrderStateStore()
+    risk_manager = RiskManager(order_store=order_store)
+    recorder = TickRecorder(record_root) if record_root is not None else None
+    i = DataClient(symbols=set(symbol_configs), order_store=order_store, shared_table=shared_table, risk_manager=risk_manager,
+                   recorder=recorder, raw_stream=raw_stream)
+    if record_root is not None:
+        # Seed histories and signals from what previous runs recorded before any live data arrives
+        i.warmup_from_history(HistoricalDataClient(record_root))
+    o = OrderManager(order_store=order_store, risk_manager=risk_manager)
+    symbols = sorted(symbol_configs)
+    # Sharded workers share the account, each only adopts the open orders of its own symbols
+    i.register_resync_callback(lambda: o.sync_open_orders(symbols=symbols))
+    engine = MarketMakerEngine(dataclient=i, ordermanager=o, symbol_configs=symbol_configs, default_params=DEFAULT_STRATEGY_PARAMS)
+    clock = MarketClock(cache_path=calendar_cache) if trading_hours else None
+
+    async def on_open():
+        i.resume()
+        engine.resume()
+
+    async def on_close():
+        await engine.pause()
+        i.pause()
+
+    SystemMonitoring.start_loop_monitor()
+    metrics_runner = await SystemMonitoring.start_metrics_server(metrics_port) if metrics_port is not None else None
+    stream_task = asyncio.create_task(i.start(), name="DataClient.start")
+    # Scraped summaries must not lose their counts every minute, so only reset the window when nothing scrapes it
+    asyncio.create_task(SystemMonitoring.log_latency_summary(interval=60, reset=metrics_port is None), name="SystemMonitoring.log_latency_summary")
+    bootstrap = [o.start(), _bootstrap_orders(o, reset_account, symbols), i.wait_ready(timeout=ready_timeout)]
+    if clock is not None:
+        bootstrap.append(clock.load())
+    await asyncio.gather(*bootstrap)
+    if reset_account:
+        # The positions snapshot raced the close, its fills may have landed before trade_updates were subscribed
+        await i.reconcile_positions()
+    strategy_logger.info("Bootstrap complete in %.0f ms", (time.perf_counter() - started) * 1000)
+    scheduler_task = None
+    if clock is not None:
+        scheduler = TradingHoursScheduler(clock, on_open=on_open, on_close=on_close, on_flatten=engine.flatten, flatten_before=flatten_before)
+        await scheduler.update()  # pause before the engine's first pass if the market is closed
+        scheduler_task = asyncio.create_task(scheduler.run(), name="TradingHoursScheduler.run")
+    try:
+        await asyncio.create_task(engine.main(), name=f"MarketMakerEngine.main[{','.join(symbols)}]")
+    finally:
+        if scheduler_task is not None:
+            scheduler_task.cancel()
+        stream_task.cancel()
+        SystemMonitoring.stop_loop_monitor()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        if recorder is not None:
+            recorder.stop()
+
+
+async def MarketMakerBasic(record_root: Optional[str] = None, trading_hours: bool = True, calendar_cache: Optional[str] = None,
+                           raw_stream: bool = False, metrics_port: Optional[int] = None):
+    await run_market_makers(SYMBOL_CONFIGS, record_root=record_root, trading_hours=trading_hours, calendar_cache=calendar_cache,
+                            raw_stream=raw_stream, metrics_port=metrics_port)
+
+
+def partition_symbols(symbol_configs: dict, nr_shards: int) -> list:
+    """Split symbol_configs round-robin over nr_shards, returns one symbol_configs dict per non-empty shard."""
+    shards = [{} for _ in range(nr_shards)]
+    for position, symbol in enumerate(sorted(symbol_configs)):
+        shards[position % nr_shards][symbol] = symbol_configs[symbol]
+    return [shard for shard in shards if shard]
+
+
+async def _reset_account():
     o = OrderManager()
-    await asyncio.sleep(5)  
-
-    AAPL = MarketMaker(dataclient=i, ordermanager=o, symbol="AAPL", margins=0.002, max_position=5, trader_loop_sleep_time = 15, tp_loop_sleep_time= 5)
-    AMZN = MarketMaker(dataclient=i, ordermanager=o, symbol="AMZN", margins=0.002, max_position=6 , trader_loop_sleep_time = 15, tp_loop_sleep_time= 5)
-    TSLA = MarketMaker(dataclient=i, ordermanager=o, symbol="TSLA", margins=0.002, max_position=5, trader_loop_sleep_time = 15, tp_loop_sleep_time= 5)
-    NVDA = MarketMaker(dataclient=i, ordermanager=o, symbol="NVDA", margins=0.002, max_position=9, trader_loop_sleep_time = 15, tp_loop_sleep_time= 5)
-    META = MarketMaker(dataclient=i, ordermanager=o, symbol="META", margins=0.002, max_position=2, trader_loop_sleep_time = 15, tp_loop_sleep_time= 5)
-    GOOGL = MarketMaker(dataclient=i, ordermanager=o, symbol="GOOGL", margins=0.002, max_position=7, trader_loop_sleep_time = 15, tp_loop_sleep_time= 5)
-    QCOM = MarketMaker(dataclient=i, ordermanager=o, symbol="QCOM", margins=0.002, max_position=5, trader_loop_sleep_time = 15, tp_loop_sleep_time= 5)
-    MSFT = MarketMaker(dataclient=i, ordermanager=o, symbol="MSFT", margins=0.002, max_position=2, trader_loop_sleep_time = 15, tp_loop_sleep_time= 5)
-    NFLX = MarketMaker(dataclient=i, ordermanager=o, symbol="NFLX", margins=0.002, max_position=1, trader_loop_sleep_time = 15, tp_loop_sleep_time= 5)
-
-    asyncio.create_task(i.start())
-    await o.start()  
-
-    await asyncio.sleep(2)  
+    await o.start(nr_warm_connections=0)
     await o.cancel_all_orders()
     await o.close_all_positions()
-    await asyncio.sleep(2) 
-    await asyncio.gather(AAPL.main(), AMZN.main(),TSLA.main(), NVDA.main(), META.main(), GOOGL.main(), QCOM.main(), MSFT.main(), NFLX.main())
-
-loop = asyncio.get_event_loop()
-try:
-    loop.run_until_complete(MarketMakerBasic())
-except KeyboardInterrupt:
-    logging.info('Stopped (KeyboardInterrupt)')
-finally:
-    loop.run_until_complete(Client.close_session()) 
\ No newline at end of file
+    await Client.close_session()
+
+
+async def _run_shard(shard_configs: dict, shared_table: SharedPositionTable, record_root: Optional[str] = None, trading_hours: bool = True,
+                     calendar_cache: Optional[str] = None, raw_stream: bool = False, metrics_port: Optional[int] = None):
+    try:
+        await run_market_makers(shard_configs, reset_account=False, shared_table=shared_table, record_root=record_root,
+                                trading_hours=trading_hours, calendar_cache=calendar_cache, raw_stream=raw_stream, metrics_port=metrics_port)
+    finally:
+        await Client.close_session()
+
+
+def _shard_worker(shard_configs: dict, table_name: str, table_symbols: list, rate_per_minute: int, record_root: Optional[str] = None,
+                  trading_hours: bool = True, calendar_cache: Optional[str] = None, raw_stream: bool = False,
+                  metrics_port: Optional[int] = None, use_uvloop: bool = False):
+    """Entry point of a worker process: its own event loop, DataClient, OrderManager and connection pool."""
+    configure_logging(rate_limits=DEFAULT_LOG_RATE_LIMITS, skip_caller_info=True)
+    if use_uvloop:
+        install_uvloop()
+    Client.configure_rate_limit(rate_per_minute=rate_per_minute)
+    shared_table = SharedPositionTable.attach(table_name, table_symbols)
+    try:
+        asyncio.run(_run_shard(shard_configs, shared_table, record_root, trading_hours, calendar_cache, raw_stream, metrics_port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        shared_table.close()
+
+
+def MarketMakerSharded(symbol_configs: dict = SYMBOL_CONFIGS, nr_workers: Optional[int] = None, account_rate_per_minute: int = 200,
+                       restart_delay: float = 5.0, report_interval: float = 60.0, record_root: Optional[str] = None, trading_hours: bool = True,
+                       calendar_cache: Optional[str] = None, raw_stream: bool = False, metrics_port: Optional[int] = None,
+                       use_uvloop: bool = False):
+    """Supervisor: partition the symbols over worker processes, restart any worker that dies and log the
+    portfolio-wide view from the shared position table. The account rate limit is split evenly between workers.
+    Workers trade disjoint symbols, so they can all record into the same record_root. With metrics_port, the
+    worker of the k-th shard serves its metrics on metrics_port + k."""
+    nr_workers = min(nr_workers or os.cpu_count() or 1, len(symbol_configs))
+    shards = partition_symbols(symbol_configs, nr_workers)
+    asyncio.run(_reset_account())  # account-wide, so once here rather than in every worker
+
+    table = SharedPositionTable.create(sorted(symbol_configs))
+    context = multiprocessing.get_context("spawn")
+    rate_per_minute = max(1, account_rate_per_minute // len(shards))
+
+    def start_worker(shard):
+        port = metrics_port + shards.index(shard) if metrics_port is not None else None
+        args = (shard, table.get_name(), table.get_symbols(), rate_per_minute, record_root, trading_hours, calendar_cache, raw_stream,
+                port, use_uvloop)
+        process = context.Process(target=_shard_worker, args=args, name=f"MarketMaker[{','.join(shard)}]", daemon=True)
+        process.start()
+        strategy_logger.info("Started worker %s for %s", process.pid, sorted(shard))
+        return process
+
+    processes = [start_worker(shard) for shard in shards]
+    last_report = time.monotonic()
+    try:
+        while True:
+            time.sleep(1)
+            for index, process in enumerate(processes):
+                if not process.is_alive():
+                    strategy_logger.error("Worker %s for %s exited with code %s, restarting in %ss", process.pid, sorted(shards[index]),
+                                          process.exitcode, restart_delay)
+                    time.sleep(restart_delay)
+                    processes[index] = start_worker(shards[index])
+            if time.monotonic() - last_report >= report_interval:
+                last_report = time.monotonic()
+                strategy_logger.info("Portfolio: gross exposure %.2f, net exposure %.2f, open orders %s", table.gross_exposure(),
+                                     table.net_exposure(), table.total_open_orders())
+    except KeyboardInterrupt:
+        strategy_logger.info('Stopped (KeyboardInterrupt)')
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.join(timeout=5)
+        table.close()
+        table.unlink()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the market maker.")
+    parser.add_argument("--workers", type=int, default=0, help="Shard the symbols over this many worker processes (0 runs in-process)")
+    parser.add_argument("--record", default=None, help="Record quotes, trades, bars and trade_updates under this directory")
+    parser.add_argument("--json-logs", action="store_true", help="Write logs as one JSON object per line")
+    parser.add_argument("--calendar-cache", default="market_calendar.json", help="Cache file for the market calendar")
+    parser.add_argument("--ignore-trading-hours", action="store_true", help="Quote regardless of the market being open")
+    parser.add_argument("--raw-stream", action="store_true", help="Decode market data frames directly instead of through the SDK")
+    parser.add_argument("--base-url", default=None, help="Trading API base URL, e.g. a local broker_sim")
+    parser.add_argument("--data-url", default=None, help="Market data API base URL")
+    parser.add_argument("--data-stream-url", default=None, help="Market data websocket base URL")
+    parser.add_argument("--metrics-port", type=int, default=None, help="Serve Prometheus metrics on this port (workers use the following ports)")
+    parser.add_argument("--uvloop", action="store_true", help="Run the event loop on uvloop if it is installed")
+    args = parser.parse_args()
+    configure_logging(json_format=args.json_logs, rate_limits=DEFAULT_LOG_RATE_LIMITS, skip_caller_info=True)
+    if args.uvloop:
+        install_uvloop()
+    Client.configure_endpoints(base_url=args.base_url, data_url=args.data_url, data_stream_url=args.data_stream_url)
+    if args.workers > 0:
+        MarketMakerSharded(nr_workers=args.workers, record_root=args.record, trading_hours=not args.ignore_trading_hours,
+                           calendar_cache=args.calendar_cache, raw_stream=args.raw_stream, metrics_port=args.metrics_port,
+                           use_uvloop=args.uvloop)
+    else:
+        loop = asyncio.get_event_loop()
+        try:
+            loop.run_until_complete(MarketMakerBasic(record_root=args.record, trading_hours=not args.ignore_trading_hours,
+                                                     calendar_cache=args.calendar_cache, raw_stream=args.raw_stream,
+                                                     metrics_port=args.metrics_port))
+        except KeyboardInterrupt:
+            strategy_logger.info('Stopped (KeyboardInterrupt)')
+        finally:
+            loop.run_until_complete(Client.close_session()) 
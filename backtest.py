@@ -0,0 +1,453 @@
+import asyncio
+import argparse
+import itertools
+import logging
+import time
+from collections import defaultdict
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from core import DataClient, OrderManager, OrderStateStore, configure_logging
+from core import QuoteRecord, TradeRecord, BarRecord, TradeUpdateRecord
+from core import InsertOrderResponse, CancelOrderResponse, CancelAllOrdersResponse, ClosePositionResponse, ModifyOrderResponse
+from core import NEW, FILL, PARTIAL_FILL, CANCELED, REPLACED, HELD, SIDE_BUY, SIDE_SELL, ORDER_TYPE_LIMIT, ORDER_TYPE_IOC, PRIORITY_NORMAL
+from core import ORDER_CLASS_OCO
+from MarketMaker import MarketMaker
+
+QUOTE_COLUMNS = ["timestamp", "symbol", "bid_price", "bid_size", "ask_price", "ask_size"]
+TRADE_COLUMNS = ["timestamp", "symbol", "price", "size"]
+BAR_COLUMNS = ["timestamp", "symbol", "open", "high", "low", "close", "volume"]
+
+KIND_QUOTE = 0
+KIND_TRADE = 1
+KIND_BAR = 2
+
+
+def load_ticks(path: str, columns: list) -> dict:
+    """Load recorded ticks from CSV or Parquet into numpy columns, timestamps as int64 ns since epoch."""
+    frame = pd.read_parquet(path, columns=columns) if path.endswith((".parquet", ".pq")) else pd.read_csv(path, usecols=columns)
+    data = {column: frame[column].to_numpy() for column in columns if column not in ("timestamp", "symbol")}
+    data["timestamp"] = pd.to_datetime(frame["timestamp"], utc=True, format="ISO8601").dt.as_unit("ns").astype(np.int64).to_numpy()
+    data["symbol"] = frame["symbol"].astype(str).to_numpy()
+    return data
+
+
+class MatchingEngine:
+    """Simulated exchange for one account: matches limit orders against the replayed top of book and tracks positions.
+    Fills happen at the touch for marketable orders, and at the limit for resting orders the market trades through.
+    Fill size is capped by the displayed size at the touch, so large orders partially fill.
+    Bracket and OTO exit legs are held until their entry fills completely; the legs of a bracket, and an OCO order and
+    its stop, cancel each other when one of them fills. Stop legs trigger when the touch reaches the stop price and
+    then fill at the touch like a market order."""
+
+    def __init__(self, size_multiplier: float = 1.0):
+        self._size_multiplier = size_multiplier
+        self._order_ids = itertools.count(1)
+        self._last_quote = {}
+        self._resting = defaultdict(dict)
+        self._orders = {}
+        self._oco_groups = {}  # order id -> ids of the orders it cancels when filled
+        self._positions = defaultdict(float)
+        self._avg_entry_price = defaultdict(float)
+        self._realized_pnl = defaultdict(float)
+        self.nr_fills = 0
+
+    def _new_order(self, symbol: str, qty: float, side: str, limit_price: Optional[float], time_in_force: str, status: str,
+                   client_order_id: Optional[str] = None, order_type: str = ORDER_TYPE_LIMIT, stop_price: Optional[float] = None) -> dict:
+        order = {"id": f"sim-{next(self._order_ids)}", "client_order_id": client_order_id, "symbol": symbol, "side": side, "qty": qty,
+                 "filled_qty": 0.0, "filled_avg_price": None, "limit_price": limit_price, "stop_price": stop_price, "type": order_type,
+                 "time_in_force": time_in_force, "status": status}
+        self._orders[order["id"]] = order
+        return order
+
+    def _add_legs(self, order: dict, order_class: str, take_profit: Optional[float], stop_loss: Optional[float]) -> None:
+        exit_side = SIDE_SELL if order["side"] == SIDE_BUY else SIDE_BUY
+        order["order_class"] = order_class
+        if order_class == ORDER_CLASS_OCO:
+            # The order itself is the take-profit, its stop leg is live from the start
+            order["limit_price"] = take_profit if take_profit is not None else order["limit_price"]
+            stop = self._new_order(order["symbol"], order["qty"], order["side"], None, order["time_in_force"], NEW, order_type="stop",
+                                   stop_price=stop_loss)
+            order["legs"] = [stop]
+            self._resting[order["symbol"]][stop["id"]] = stop
+            self._oco_groups[order["id"]], self._oco_groups[stop["id"]] = [stop["id"]], [order["id"]]
+            return
+        legs = []
+        if take_profit is not None:
+            legs.append(self._new_order(order["symbol"], order["qty"], exit_side, take_profit, order["time_in_force"], HELD))
+        if stop_loss is not None:
+            legs.append(self._new_order(order["symbol"], order["qty"], exit_side, None, order["time_in_force"], HELD, order_type="stop",
+                                        stop_price=stop_loss))
+        for leg in legs:
+            leg["order_class"] = order_class
+            self._oco_groups[leg["id"]] = [other["id"] for other in legs if other is not leg]
+        order["legs"] = legs
+
+    def _update(self, event: str, order: dict, **kwargs) -> TradeUpdateRecord:
+        snapshot = dict(order)
+        if order.get("legs"):
+            snapshot["legs"] = [dict(leg) for leg in order["legs"]]
+        return TradeUpdateRecord(event, snapshot, **kwargs)
+
+    def submit(self, symbol: str, qty: float, side: str, limit_price: float, time_in_force: str, timestamp: int,
+               client_order_id: Optional[str] = None, order_class: Optional[str] = None, take_profit: Optional[float] = None,
+               stop_loss: Optional[float] = None) -> list:
+        """Accept a new order and return the trade updates it produces."""
+        order = self._new_order(symbol, qty, side, limit_price, time_in_force, NEW, client_order_id=client_order_id)
+        if order_class is not None:
+            self._add_legs(order, order_class, take_profit, stop_loss)
+            limit_price = order["limit_price"]
+        updates = [self._update(NEW, order, timestamp=timestamp)]
+        quote = self._last_quote.get(symbol)
+        if quote is not None:
+            touch_price, touch_size = (quote.ask_price, quote.ask_size) if side == SIDE_BUY else (quote.bid_price, quote.bid_size)
+            if touch_price > 0 and (limit_price >= touch_price if side == SIDE_BUY else limit_price <= touch_price):
+                updates.extend(self._fill(order, touch_price, min(qty, touch_size * self._size_multiplier), timestamp))
+        if order["filled_qty"] < qty:
+            if time_in_force == ORDER_TYPE_IOC:
+                updates.append(self._close(order, CANCELED, timestamp))
+            else:
+                self._resting[symbol][order["id"]] = order
+        return updates
+
+    def cancel(self, order_id: str, timestamp: int) -> list:
+        """Cancel a resting order, with its held legs or the orders it is one-cancels-other with. Empty if not resting."""
+        order = self._orders.get(order_id)
+        if order is None or order["id"] not in self._resting[order["symbol"]]:
+            return []
+        del self._resting[order["symbol"]][order_id]
+        updates = [self._close(order, CANCELED, timestamp)]
+        updates += [self._close(leg, CANCELED, timestamp) for leg in order.get("legs") or () if leg["status"] == HELD]
+        return updates + self._cancel_oco(order_id, timestamp)
+
+    def _cancel_oco(self, order_id: str, timestamp: int) -> list:
+        updates = []
+        for other_id in self._oco_groups.pop(order_id, ()):
+            other = self._orders[other_id]
+            self._oco_groups.pop(other_id, None)
+            if self._resting[other["symbol"]].pop(other_id, None) is not None:
+                updates.append(self._close(other, CANCELED, timestamp))
+        return updates
+
+    def replace(self, order_id: str, timestamp: int, qty: Optional[float] = None, limit_price: Optional[float] = None,
+                time_in_force: Optional[str] = None, client_order_id: Optional[str] = None) -> list:
+        order = self._orders.get(order_id)
+        if order is None or order_id not in self._resting[order["symbol"]]:
+            return []
+        del self._resting[order["symbol"]][order_id]
+        updates = [self._close(order, REPLACED, timestamp)]
+        updates += self.submit(order["symbol"], qty if qty is not None else order["qty"] - order["filled_qty"], order["side"],
+                               limit_price if limit_price is not None else order["limit_price"],
+                               time_in_force or order["time_in_force"], timestamp, client_order_id=client_order_id)
+        return updates
+
+    def on_quote(self, quote) -> list:
+        self._last_quote[quote.symbol] = quote
+        resting = self._resting.get(quote.symbol)
+        if not resting:
+            return []
+        updates = []
+        for order in list(resting.values()):
+            if order["id"] not in resting:
+                continue  # cancelled by an OCO fill earlier in this loop
+            side_buy = order["side"] == SIDE_BUY
+            touch_price, touch_size = (quote.ask_price, quote.ask_size) if side_buy else (quote.bid_price, quote.bid_size)
+            if order["type"] == "stop":
+                marketable = touch_price >= order["stop_price"] if side_buy else touch_price <= order["stop_price"]
+            else:
+                marketable = order["limit_price"] >= touch_price if side_buy else order["limit_price"] <= touch_price
+            if touch_price > 0 and marketable:
+                qty = min(order["qty"] - order["filled_qty"], touch_size * self._size_multiplier)
+                updates.extend(self._fill(order, touch_price, qty, quote.timestamp))
+        return updates
+
+    def on_trade(self, trade) -> list:
+        resting = self._resting.get(trade.symbol)
+        if not resting:
+            return []
+        updates = []
+        for order in list(resting.values()):
+            if order["id"] not in resting or order["type"] == "stop":
+                continue
+            if (trade.price < order["limit_price"]) if order["side"] == SIDE_BUY else (trade.price > order["limit_price"]):
+                qty = min(order["qty"] - order["filled_qty"], trade.size)
+                updates.extend(self._fill(order, order["limit_price"], qty, trade.timestamp))
+        return updates
+
+    def _fill(self, order: dict, price: float, qty: float, timestamp: int) -> list:
+        """The fill's trade update, followed by those of legs it releases or orders it cancels. Empty for a zero quantity,
+        e.g. against a touch or trade of size 0."""
+        if qty <= 0:
+            return []
+        symbol = order["symbol"]
+        filled = order["filled_qty"]
+        order["filled_avg_price"] = ((order["filled_avg_price"] or 0.0) * filled + price * qty) / (filled + qty)
+        order["filled_qty"] = filled + qty
+        self._apply_fill(symbol, qty if order["side"] == SIDE_BUY else -qty, price)
+        self.nr_fills += 1
+        event = FILL if order["filled_qty"] >= order["qty"] else PARTIAL_FILL
+        order["status"] = event
+        updates = [self._update(event, order, price=price, qty=qty, position_qty=self._positions[symbol], timestamp=timestamp)]
+        if event == FILL:
+            self._resting[symbol].pop(order["id"], None)
+            for leg in order.get("legs") or ():
+                if leg["status"] == HELD:
+                    leg["status"] = NEW
+                    self._resting[symbol][leg["id"]] = leg
+                    updates.append(self._update(NEW, leg, timestamp=timestamp))
+            updates += self._cancel_oco(order["id"], timestamp)
+        return updates
+
+    def _close(self, order: dict, event: str, timestamp: int) -> TradeUpdateRecord:
+        order["status"] = event
+        return self._update(event, order, position_qty=self._positions[order["symbol"]], timestamp=timestamp)
+
+    def _apply_fill(self, symbol: str, signed_qty: float, price: float) -> None:
+        position = self._positions[symbol]
+        if position == 0 or (position > 0) == (signed_qty > 0):
+            self._avg_entry_price[symbol] = (self._avg_entry_price[symbol] * abs(position) + price * abs(signed_qty)) / (abs(position) + abs(signed_qty))
+        else:
+            closed = min(abs(position), abs(signed_qty))
+            self._realized_pnl[symbol] += closed * (price - self._avg_entry_price[symbol]) * (1 if position > 0 else -1)
+            if abs(signed_qty) > abs(position):
+                self._avg_entry_price[symbol] = price
+        self._positions[symbol] = position + signed_qty
+        if self._positions[symbol] == 0:
+            self._avg_entry_price[symbol] = 0.0
+
+    def get_position(self, symbol: str) -> float:
+        return self._positions.get(symbol, 0.0)
+
+    def get_positions(self) -> dict:
+        """{symbol: (qty, avg_entry_price)} of every non-flat position."""
+        return {symbol: (qty, self._avg_entry_price[symbol]) for symbol, qty in self._positions.items() if qty != 0}
+
+    def get_last_quote(self, symbol: str):
+        return self._last_quote.get(symbol)
+
+    def get_order(self, order_id: str) -> Optional[dict]:
+        return self._orders.get(order_id)
+
+    def get_orders(self) -> list:
+        return list(self._orders.values())
+
+    def get_open_order_ids(self) -> list:
+        return [order_id for resting in self._resting.values() for order_id in resting]
+
+    def get_results(self) -> dict:
+        results = {}
+        for symbol in set(self._positions) | set(self._realized_pnl):
+            quote = self._last_quote.get(symbol)
+            mark = (quote.bid_price + quote.ask_price) * 0.5 if quote is not None else self._avg_entry_price[symbol]
+            unrealized = self._positions[symbol] * (mark - self._avg_entry_price[symbol])
+            results[symbol] = {"position": self._positions[symbol], "realized_pnl": self._realized_pnl[symbol], "unrealized_pnl": unrealized}
+        return results
+
+
+class SimulatedOrderManager(OrderManager):
+    """OrderManager backed by a MatchingEngine. Trade updates are delivered straight into DataClient.on_trade_update,
+    so strategies see the same fill/partial_fill/canceled lifecycle as on the live stream."""
+
+    def __init__(self, dataclient: DataClient, matching_engine: Optional[MatchingEngine] = None, order_store: Optional[OrderStateStore] = None):
+        super().__init__(order_store=order_store if order_store is not None else dataclient.get_order_store())
+        self._dataclient = dataclient
+        self._matching_engine = matching_engine if matching_engine is not None else MatchingEngine()
+        self._clock_ns = 0
+
+    def get_matching_engine(self) -> MatchingEngine:
+        return self._matching_engine
+
+    def set_clock(self, timestamp: int) -> None:
+        self._clock_ns = timestamp
+
+    async def deliver(self, updates: list) -> None:
+        for update in updates:
+            await self._dataclient.on_trade_update(update)
+
+    async def start(self, nr_warm_connections: int = 0):
+        pass
+
+    async def insert_order(self, symbol: str, price: float, quantity: int, side: str, order_type: str, priority: int = PRIORITY_NORMAL,
+                           client_order_id: Optional[str] = None, order_class: Optional[str] = None, take_profit: Optional[float] = None,
+                           stop_loss: Optional[float] = None, stop_limit: Optional[float] = None):
+        # Mirrors OrderManager.insert_order: simple orders are IOC limits, order classes rest with order_type as time in force
+        client_order_id = client_order_id if client_order_id is not None else self.next_client_order_id()
+        time_in_force = ORDER_TYPE_IOC if order_class is None else order_type
+        updates = self._matching_engine.submit(symbol, float(quantity), side, price, time_in_force, self._clock_ns, client_order_id=client_order_id,
+                                               order_class=order_class, take_profit=take_profit, stop_loss=stop_loss)
+        order_id = updates[0].order["id"]
+        order_state = self._order_store.on_submitted(updates[0].order)
+        await self.deliver(updates)
+        return InsertOrderResponse(success=True, order_id=order_id, error=None, client_order_id=client_order_id, leg_ids=order_state.leg_ids)
+
+    async def cancel_order(self, order_id: str):
+        updates = self._matching_engine.cancel(order_id, self._clock_ns)
+        if not updates:
+            return CancelOrderResponse(success=False, error="Order no longer cancelable")
+        await self.deliver(updates)
+        return CancelOrderResponse(success=True)
+
+    async def cancel_all_orders(self):
+        order_ids = self._matching_engine.get_open_order_ids()
+        responses = [await self.cancel_order(order_id) for order_id in order_ids]
+        return CancelAllOrdersResponse(success=True, order_statuses={order_id: 200 if response.success else 500 for order_id, response in zip(order_ids, responses)})
+
+    async def replace_order(self, order_id: str, qty: Optional[int] = None, limit_price: Optional[float] = None,
+                            time_in_force: Optional[str] = None, client_order_id: Optional[str] = None):
+        updates = self._matching_engine.replace(order_id, self._clock_ns, qty=qty, limit_price=limit_price, time_in_force=time_in_force,
+                                                client_order_id=client_order_id)
+        if not updates:
+            return ModifyOrderResponse(success=False, replaced_order_id=order_id, error="Order no longer replaceable")
+        new_order = updates[1].order
+        self._order_store.on_submitted(new_order)
+        await self.deliver(updates)
+        return ModifyOrderResponse(success=True, order_id=new_order["id"], replaced_order_id=order_id)
+
+    async def close_position(self, symbol: str, qty: float = None, percentage: float = None):
+        position = self._matching_engine.get_position(symbol)
+        quote = self._dataclient.get_last_quote(symbol)
+        if position == 0 or quote is None:
+            return ClosePositionResponse(symbol=symbol, success=False, status=404, error="No position or no quote")
+        close_qty = qty if qty is not None else abs(position) * (percentage / 100 if percentage is not None else 1.0)
+        side = SIDE_SELL if position > 0 else SIDE_BUY
+        # Cross the whole book: a close is a market order
+        price = float("inf") if side == SIDE_BUY else 0.0
+        await self.insert_order(symbol, price, close_qty, side, ORDER_TYPE_IOC)
+        return ClosePositionResponse(symbol=symbol, success=True, status=200)
+
+    async def close_all_positions(self, cancel_orders: bool = True):
+        if cancel_orders:
+            await self.cancel_all_orders()
+        return [await self.close_position(symbol) for symbol in list(self._matching_engine._positions) if self._matching_engine.get_position(symbol) != 0]
+
+
+class ReplayEngine:
+    """Feeds recorded quotes, trades and bars into DataClient's handlers in timestamp order.
+    speed=None replays as fast as possible, otherwise wall-clock gaps are divided by speed.
+    Whenever an event wakes a subscribed strategy the loop is yielded yields_per_event times so it can react before the next tick."""
+
+    def __init__(self, dataclient: DataClient, order_manager: Optional[SimulatedOrderManager] = None,
+                 quotes: Optional[dict] = None, trades: Optional[dict] = None, bars: Optional[dict] = None,
+                 speed: Optional[float] = None, yields_per_event: int = 3):
+        self._dataclient = dataclient
+        self._order_manager = order_manager
+        self._sources = {KIND_QUOTE: quotes, KIND_TRADE: trades, KIND_BAR: bars}
+        self._speed = speed
+        self._yields_per_event = yields_per_event
+
+    def _merged_order(self):
+        """Kind and row index of every event, stably sorted by timestamp."""
+        timestamps, kinds, rows = [], [], []
+        for kind, source in self._sources.items():
+            if source is None:
+                continue
+            count = len(source["timestamp"])
+            timestamps.append(source["timestamp"])
+            kinds.append(np.full(count, kind, dtype=np.int8))
+            rows.append(np.arange(count))
+        if not timestamps:
+            return np.empty(0, dtype=np.int8), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        timestamps, kinds, rows = np.concatenate(timestamps), np.concatenate(kinds), np.concatenate(rows)
+        order = np.argsort(timestamps, kind="stable")
+        return kinds[order], rows[order], timestamps[order]
+
+    async def _yield(self, nr_notifications: int) -> int:
+        current = self._dataclient.get_notification_count()
+        if current != nr_notifications:
+            for _ in range(self._yields_per_event):
+                await asyncio.sleep(0)
+        return current
+
+    async def run(self) -> dict:
+        kinds, rows, timestamps = self._merged_order()
+        quotes, trades, bars = self._sources[KIND_QUOTE], self._sources[KIND_TRADE], self._sources[KIND_BAR]
+        # Plain Python lists index faster than numpy scalars in the per-event loop
+        columns = {kind: {name: values.tolist() for name, values in source.items()} for kind, source in self._sources.items() if source is not None}
+        matching_engine = self._order_manager.get_matching_engine() if self._order_manager is not None else None
+        started = time.perf_counter()
+        first_ts = int(timestamps[0]) if len(timestamps) else 0
+        nr_notifications = self._dataclient.get_notification_count()
+        for kind, row, timestamp in zip(kinds.tolist(), rows.tolist(), timestamps.tolist()):
+            if self._speed is not None:
+                delay = (timestamp - first_ts) / 1e9 / self._speed - (time.perf_counter() - started)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            if self._order_manager is not None:
+                self._order_manager.set_clock(timestamp)
+            if kind == KIND_QUOTE:
+                c = columns[KIND_QUOTE]
+                quote = QuoteRecord(c["symbol"][row], c["bid_price"][row], c["bid_size"][row], c["ask_price"][row], c["ask_size"][row], timestamp)
+                await self._dataclient.on_quote(quote)
+                if matching_engine is not None:
+                    await self._order_manager.deliver(matching_engine.on_quote(quote))
+                nr_notifications = await self._yield(nr_notifications)
+            elif kind == KIND_TRADE:
+                c = columns[KIND_TRADE]
+                trade = TradeRecord(c["symbol"][row], c["price"][row], c["size"][row], timestamp)
+                await self._dataclient.on_trade(trade)
+                if matching_engine is not None:
+                    fills = matching_engine.on_trade(trade)
+                    if fills:
+                        await self._order_manager.deliver(fills)
+                        nr_notifications = await self._yield(nr_notifications)
+            else:
+                c = columns[KIND_BAR]
+                await self._dataclient.on_bar(BarRecord(c["symbol"][row], c["open"][row], c["high"][row], c["low"][row], c["close"][row], c["volume"][row], timestamp))
+        elapsed = time.perf_counter() - started
+        return {"events": len(kinds), "elapsed_s": elapsed, "events_per_s": len(kinds) / elapsed if elapsed > 0 else 0.0,
+                "fills": matching_engine.nr_fills if matching_engine is not None else 0,
+                "positions": matching_engine.get_results() if matching_engine is not None else {}}
+
+
+async def run_backtest(quotes: Optional[dict] = None, trades: Optional[dict] = None, bars: Optional[dict] = None,
+                       strategy_params: Optional[dict] = None, speed: Optional[float] = None) -> dict:
+    """Replay the recorded data through one event-driven MarketMaker per symbol in strategy_params ({symbol: MarketMaker kwargs})."""
+    strategy_params = strategy_params or {}
+    dataclient = DataClient(symbols=set(strategy_params))
+    order_manager = SimulatedOrderManager(dataclient)
+    strategies = [MarketMaker(dataclient=dataclient, ordermanager=order_manager, symbol=symbol, **{"requote_threshold": 0.0, **params})
+                  for symbol, params in strategy_params.items()]
+    tasks = [asyncio.create_task(strategy.main()) for strategy in strategies]
+    # Let strategies subscribe before the first tick, a strategy that fails on startup stops the wait
+    started = asyncio.ensure_future(asyncio.gather(*(strategy.wait_started() for strategy in strategies)))
+    await asyncio.wait([started, *tasks], return_when=asyncio.FIRST_COMPLETED)
+    started.cancel()
+    try:
+        results = await ReplayEngine(dataclient, order_manager, quotes=quotes, trades=trades, bars=bars, speed=speed).run()
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    return results
+
+
+async def sweep(quotes: dict, symbol: str, margins_grid: list, max_position_grid: list, trades: Optional[dict] = None) -> list:
+    """Run one backtest per (margins, max_position) combination over the same loaded data."""
+    results = []
+    for margins, max_position in itertools.product(margins_grid, max_position_grid):
+        result = await run_backtest(quotes=quotes, trades=trades, strategy_params={symbol: {"margins": margins, "max_position": max_position}})
+        pnl = result["positions"].get(symbol, {})
+        logging.info(f"margins={margins} max_position={max_position}: {result['events']} events at {result['events_per_s']:.0f}/s, "
+                     f"{result['fills']} fills, realized {pnl.get('realized_pnl', 0.0):.2f}, unrealized {pnl.get('unrealized_pnl', 0.0):.2f}")
+        results.append({"margins": margins, "max_position": max_position, **result})
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay recorded ticks through MarketMaker against a simulated broker.")
+    parser.add_argument("--quotes", required=True, help="CSV or Parquet file with columns " + ",".join(QUOTE_COLUMNS))
+    parser.add_argument("--trades", help="CSV or Parquet file with columns " + ",".join(TRADE_COLUMNS))
+    parser.add_argument("--symbol", required=True)
+    parser.add_argument("--margins", type=float, nargs="+", default=[0.002])
+    parser.add_argument("--max-position", type=int, nargs="+", default=[5])
+    args = parser.parse_args()
+    # Per-order strategy logs are far too chatty at replay speed
+    configure_logging(level=logging.WARNING)
+    loaded_quotes = load_ticks(args.quotes, QUOTE_COLUMNS)
+    loaded_trades = load_ticks(args.trades, TRADE_COLUMNS) if args.trades else None
+    for result in asyncio.run(sweep(loaded_quotes, args.symbol, args.margins, args.max_position, trades=loaded_trades)):
+        pnl = result["positions"].get(args.symbol, {})
+        print(f"margins={result['margins']} max_position={result['max_position']} events={result['events']} events_per_s={result['events_per_s']:.0f} "
+              f"fills={result['fills']} realized_pnl={pnl.get('realized_pnl', 0.0):.2f} unrealized_pnl={pnl.get('unrealized_pnl', 0.0):.2f}")
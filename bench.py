@@ -0,0 +1,297 @@
+import asyncio
+import argparse
+import gc
+import json
+import logging
+import sys
+import time
+import tracemalloc
+from typing import Optional
+
+import aiohttp
+import numpy as np
+from aiohttp import web
+
+from core import DataClient, OrderManager, OrderStateStore, RiskManager, Client, SystemMonitoring, configure_logging
+from core import QuoteRecord, TradeRecord, BarRecord, TradeUpdateRecord
+from core import NEW, FILL, SIDE_BUY, SIDE_SELL, ORDER_TYPE_DAY
+
+BENCH_SYMBOLS = ["AAPL", "AMZN", "TSLA", "NVDA", "META", "GOOGL", "QCOM", "MSFT", "NFLX", "AMD"]
+
+
+def make_quotes(n: int, symbols: list = BENCH_SYMBOLS, seed: int = 1) -> list:
+    """Quotes walking a random mid per symbol, about half of them move the rounded mid."""
+    rng = np.random.default_rng(seed)
+    steps = rng.integers(-1, 2, size=n) * 0.01
+    sizes = rng.integers(1, 10, size=(n, 2)).tolist()
+    mids = {symbol: 100.0 + 10 * position for position, symbol in enumerate(symbols)}
+    timestamp = time.time_ns()
+    quotes = []
+    for k in range(n):
+        symbol = symbols[k % len(symbols)]
+        mid = mids[symbol] = round(mids[symbol] + steps[k], 2)
+        quotes.append(QuoteRecord(symbol, mid - 0.01, sizes[k][0], mid + 0.01, sizes[k][1], timestamp + k * 1000))
+    return quotes
+
+
+def make_trades(n: int, symbols: list = BENCH_SYMBOLS, seed: int = 2) -> list:
+    rng = np.random.default_rng(seed)
+    prices = (100.0 + rng.normal(0, 0.05, size=n)).round(2).tolist()
+    sizes = rng.integers(1, 500, size=n).tolist()
+    timestamp = time.time_ns()
+    return [TradeRecord(symbols[k % len(symbols)], prices[k], sizes[k], timestamp + k * 1000) for k in range(n)]
+
+
+def make_bars(n: int, symbols: list = BENCH_SYMBOLS) -> list:
+    timestamp = time.time_ns()
+    return [BarRecord(symbols[k % len(symbols)], 100.0, 100.1, 99.9, 100.05, 1000, timestamp + k * 60_000_000_000) for k in range(n)]
+
+
+def make_trade_updates(n: int, symbols: list = BENCH_SYMBOLS) -> list:
+    """Pairs of new and fill updates, fills alternate sides so positions stay bounded."""
+    updates = []
+    for k in range(n // 2):
+        symbol = symbols[k % len(symbols)]
+        side = SIDE_BUY if (k // len(symbols)) % 2 == 0 else SIDE_SELL
+        order = {"id": f"bench-{k}", "client_order_id": f"bench-client-{k}", "symbol": symbol, "side": side, "qty": "1",
+                 "filled_qty": "0", "limit_price": "100.0", "status": "new"}
+        updates.append(TradeUpdateRecord(NEW, order))
+        filled = dict(order, filled_qty="1", filled_avg_price="100.0", status="filled")
+        updates.append(TradeUpdateRecord(FILL, filled, price=100.0, qty=1.0, timestamp=time.time_ns()))
+    return updates
+
+
+def summarize(latencies_ns: np.ndarray, elapsed_s: float, allocations: Optional[dict] = None) -> dict:
+    result = {"events": int(len(latencies_ns)),
+              "events_per_s": len(latencies_ns) / elapsed_s if elapsed_s > 0 else 0.0,
+              "p50_us": float(np.percentile(latencies_ns, 50)) / 1000,
+              "p99_us": float(np.percentile(latencies_ns, 99)) / 1000,
+              "max_us": float(latencies_ns.max()) / 1000}
+    if allocations is not None:
+        result.update(allocations)
+    return result
+
+
+async def measure_allocations(handler, events: list) -> dict:
+    """Replay events under tracemalloc. Reports blocks still allocated afterwards and the peak of traced memory,
+    both per event. Python keeps no count of short-lived allocations, the peak is the closest proxy."""
+    gc.collect()
+    tracemalloc.start()
+    blocks_before = sys.getallocatedblocks()
+    current_before, _ = tracemalloc.get_traced_memory()
+    tracemalloc.reset_peak()
+    for event in events:
+        await handler(event)
+    _, peak = tracemalloc.get_traced_memory()
+    blocks_after = sys.getallocatedblocks()
+    tracemalloc.stop()
+    return {"retained_blocks_per_event": (blocks_after - blocks_before) / len(events),
+            "peak_bytes_per_event": (peak - current_before) / len(events)}
+
+
+async def bench_handler(handler, events: list, warmup: int = 1000, allocation_events: int = 10000) -> dict:
+    """Per-event latency and throughput of awaiting handler(event) for every event, then an allocation pass."""
+    for event in events[:warmup]:
+        await handler(event)
+    latencies = np.empty(len(events), dtype=np.int64)
+    clock = time.perf_counter_ns
+    started = clock()
+    for k, event in enumerate(events):
+        before = clock()
+        await handler(event)
+        latencies[k] = clock() - before
+    elapsed_s = (clock() - started) / 1e9
+    allocations = await measure_allocations(handler, events[:allocation_events])
+    return summarize(latencies, elapsed_s, allocations)
+
+
+async def bench_handlers(n: int) -> dict:
+    SystemMonitoring.latency_enabled = True
+    results = {}
+    scenarios = [("on_quote", "on_quote", make_quotes(n)), ("on_trade", "on_trade", make_trades(n)),
+                 ("on_bar", "on_bar", make_bars(n)), ("on_trade_update", "on_trade_update", make_trade_updates(n))]
+    for name, method, events in scenarios:
+        order_store = OrderStateStore()
+        dataclient = DataClient(symbols=set(BENCH_SYMBOLS), order_store=order_store, risk_manager=RiskManager(order_store=order_store))
+        # A subscriber per symbol so notification cost is included, as in a live run
+        for symbol in BENCH_SYMBOLS:
+            dataclient.subscribe(symbol)
+        results[name] = await bench_handler(getattr(dataclient, method), events)
+    return results
+
+
+class RestStub:
+    """Local stand-in for the order endpoints of the REST API, answers immediately with Alpaca-shaped bodies."""
+
+    def __init__(self):
+        self._runner: Optional[web.AppRunner] = None
+        self._nr_orders = 0
+        self.url: Optional[str] = None
+
+    async def _post_order(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        self._nr_orders += 1
+        return web.json_response({"id": f"stub-{self._nr_orders}", "client_order_id": body.get("client_order_id"), "symbol": body["symbol"],
+                                  "side": body["side"], "qty": str(body["qty"]), "filled_qty": "0", "limit_price": str(body["limit_price"]),
+                                  "type": body["type"], "time_in_force": body["time_in_force"], "status": "accepted"})
+
+    async def _delete_order(self, request: web.Request) -> web.Response:
+        return web.Response(status=204)
+
+    async def start(self) -> None:
+        app = web.Application()
+        app.router.add_post("/v2/orders", self._post_order)
+        app.router.add_delete("/v2/orders/{order_id}", self._delete_order)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://127.0.0.1:{port}"
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+
+async def bench_order_path(n: int, concurrency: int = 8) -> dict:
+    """insert_order and cancel_order against the stub, next to a bare aiohttp POST to the same stub. The overhead
+    OrderManager adds on top of the network is the median difference over back-to-back pairs of the two, taken
+    in alternating order after a shared warmup so neither side runs colder. The rate limiter is opened up for the run."""
+    stub = RestStub()
+    await stub.start()
+    Client.configure_rate_limit(rate_per_minute=10_000_000, burst=10_000)
+    await Client.start_session()
+    order_store = OrderStateStore()
+    # Limits out of the way: the stub leaves every order open, the checks themselves still run
+    risk_manager = RiskManager(order_store=order_store, max_symbol_notional=1e12, max_gross_notional=1e12, max_net_notional=1e12,
+                               max_open_orders=10**9, max_open_orders_per_symbol=10**9)
+    risk_manager.update_mid("AAPL", 100.0)
+    order_manager = OrderManager(order_store=order_store, risk_manager=risk_manager, base_url=stub.url)
+    params = {"symbol": "AAPL", "qty": 1, "side": SIDE_BUY, "type": "limit", "limit_price": 100.0, "time_in_force": "ioc"}
+
+    async def raw_post(_):
+        async with Client.session.post(order_manager._order_url, json=params) as result:
+            await result.read()
+
+    async def insert(_):
+        await order_manager.insert_order("AAPL", 100.0, 1, SIDE_BUY, ORDER_TYPE_DAY)
+
+    async def cancel(k):
+        await order_manager.cancel_order(f"stub-{k}")
+
+    results = {}
+    try:
+        for name, handler in (("raw_post", raw_post), ("insert_order", insert), ("cancel_order", cancel)):
+            results[name] = await bench_handler(handler, list(range(n)), warmup=min(200, n), allocation_events=min(2000, n))
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def bounded_insert(_):
+            async with semaphore:
+                await insert(_)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(bounded_insert(k) for k in range(n)))
+        elapsed_s = time.perf_counter() - started
+        results[f"insert_order_x{concurrency}"] = {"events": n, "events_per_s": n / elapsed_s}
+        results["insert_overhead_p50_us"] = await paired_overhead_us(raw_post, insert, n, warmup=min(200, n))
+    finally:
+        await Client.close_session()
+        await stub.stop()
+    return results
+
+
+async def paired_overhead_us(baseline, handler, n: int, warmup: int = 200) -> float:
+    """Median of handler minus baseline latency over n back-to-back pairs, alternating which of the two runs first."""
+    for k in range(warmup):
+        await baseline(k)
+        await handler(k)
+    differences = np.empty(n)
+    for k in range(n):
+        first, second = (baseline, handler) if k % 2 == 0 else (handler, baseline)
+        started = time.perf_counter_ns()
+        await first(k)
+        middle = time.perf_counter_ns()
+        await second(k)
+        finished = time.perf_counter_ns()
+        first_ns, second_ns = middle - started, finished - middle
+        differences[k] = second_ns - first_ns if first is baseline else first_ns - second_ns
+    return float(np.median(differences)) / 1000
+
+
+def flatten(results: dict, prefix: str = "") -> dict:
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{prefix}{key}."))
+        else:
+            flat[f"{prefix}{key}"] = value
+    return flat
+
+
+# Metrics gated by compare, max latency and derived overheads are printed but too noisy to fail a run on
+GATED_METRICS = ("events_per_s", "p50_us", "p99_us", "peak_bytes_per_event", "retained_blocks_per_event")
+
+
+def compare(baseline: dict, current: dict, threshold: float = 0.10) -> list:
+    """Gated metrics that got worse by more than threshold: lower throughput, or higher latency and allocations."""
+    regressions = []
+    base, cur = flatten(baseline), flatten(current)
+    for key in sorted(set(base) & set(cur)):
+        if key.endswith(".events"):
+            continue
+        change = (cur[key] - base[key]) / abs(base[key]) if base[key] else 0.0
+        worse = -change if key.endswith("events_per_s") else change
+        # Retained blocks hover around zero, only a whole block more per event counts
+        if key.endswith("retained_blocks_per_event"):
+            worse = threshold + 1 if cur[key] - base[key] >= 1 else 0.0
+        regressed = key.rsplit(".", 1)[-1] in GATED_METRICS and worse > threshold
+        print(f"{key:55s} {base[key]:14.2f} {cur[key]:14.2f} {change * 100:+7.1f}%{'  REGRESSION' if regressed else ''}")
+        if regressed:
+            regressions.append(key)
+    return regressions
+
+
+def report(results: dict) -> None:
+    for section, entries in results.items():
+        if section == "meta":
+            continue
+        for name, result in entries.items():
+            if not isinstance(result, dict):
+                print(f"{section}.{name}: {result:.2f}")
+                continue
+            print(f"{section}.{name}: " + " ".join(f"{key}={value:.2f}" if isinstance(value, float) else f"{key}={value}"
+                                                   for key, value in result.items()))
+
+
+async def run(nr_events: int, nr_orders: int, concurrency: int) -> dict:
+    return {"meta": {"python": sys.version.split()[0], "numpy": np.__version__, "aiohttp": aiohttp.__version__,
+                     "nr_events": nr_events, "nr_orders": nr_orders, "timestamp": time.time()},
+            "handlers": await bench_handlers(nr_events),
+            "order_path": await bench_order_path(nr_orders, concurrency)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the DataClient handlers and the OrderManager request path.")
+    parser.add_argument("--events", type=int, default=100_000, help="Synthetic events per handler")
+    parser.add_argument("--orders", type=int, default=2_000, help="Requests per order path scenario")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--save", help="Write results as JSON to this file")
+    parser.add_argument("--compare", help="Compare against results saved earlier with --save, exit 1 on regressions")
+    parser.add_argument("--threshold", type=float, default=0.10, help="Relative change counted as a regression")
+    args = parser.parse_args()
+    # Handlers log fills and order acks at INFO, keep that out of the measurement
+    configure_logging(level=logging.WARNING)
+    results = asyncio.run(run(args.events, args.orders, args.concurrency))
+    report(results)
+    if args.save:
+        with open(args.save, "w") as file:
+            json.dump(results, file, indent=2)
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        baseline.pop("meta", None)
+        regressions = compare(baseline, {key: value for key, value in results.items() if key != "meta"}, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} regressions: {', '.join(regressions)}")
+            sys.exit(1)
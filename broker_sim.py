@@ -0,0 +1,578 @@
+import asyncio
+import argparse
+import functools
+import logging
+import math
+import random
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+import msgpack
+import numpy as np
+from aiohttp import web, WSMsgType
+
+from backtest import MatchingEngine
+from core import OrderManager, OrderStateStore, Client, QuoteRecord, configure_logging, rfc3339_ns, _json_dumps, _json_loads
+from core import ORDER_STATUS_TO_EVENT, TERMINAL_EVENTS, ALL_SIDES, ALL_ORDER_CLASSES, ORDER_CLASS_OCO
+from core import SIDE_BUY, SIDE_SELL, ORDER_TYPE_LIMIT, ORDER_TYPE_IOC, ORDER_TYPE_DAY, ORDER_TYPE_GTC
+
+sim_logger = logging.getLogger("broker_sim")
+
+EVENT_TO_ORDER_STATUS = {event: status for status, event in ORDER_STATUS_TO_EVENT.items()}
+ORDER_TYPE_MARKET = "market"
+TIME_IN_FORCES = [ORDER_TYPE_DAY, ORDER_TYPE_GTC, ORDER_TYPE_IOC, "fok", "opg", "cls"]
+
+
+@functools.lru_cache(maxsize=4)
+def _rfc3339_seconds(seconds: int) -> str:
+    return f"{datetime.fromtimestamp(seconds, tz=timezone.utc):%Y-%m-%dT%H:%M:%S}"
+
+
+def rfc3339(timestamp: int) -> str:
+    """RFC 3339 string with all nine digits of a ns since epoch timestamp, as the broker sends them."""
+    seconds, nanos = divmod(timestamp, 1_000_000_000)
+    return f"{_rfc3339_seconds(seconds)}.{nanos:09d}Z"
+
+
+def _price(value) -> Optional[str]:
+    return None if value is None else str(value)
+
+
+class BrokerSimulator:
+    """Local stand-in for the broker: the order, position, clock and calendar endpoints of the trading API, latest
+    quotes from the market data API, the trade_updates websocket and a market data websocket, all on one aiohttp
+    server. Orders are matched by backtest.MatchingEngine against random-walk quotes generated for every symbol
+    subscribed to (or given up front), so fills, partial fills and bracket legs behave as in a backtest.
+    Failure modes are injected per REST request: latency (plus uniform jitter) before every response, a reject_rate
+    share of order submissions refused with 403, a throttle_rate share of requests answered 429, and with
+    rate_per_minute a fixed-window limit reported in the X-RateLimit headers. stream_latency delays trade_updates.
+    Partial fills come from fills being capped by the quoted size times size_multiplier. Stop-limit legs are
+    matched as stop orders."""
+
+    def __init__(self, symbols=(), start_price: float = 100.0, spread: float = 0.02, quote_size: int = 100, quote_interval: float = 0.05,
+                 volatility: float = 0.0002, latency: float = 0.0, jitter: float = 0.0, stream_latency: float = 0.0, reject_rate: float = 0.0,
+                 throttle_rate: float = 0.0, rate_per_minute: Optional[int] = None, size_multiplier: float = 1.0, seed: Optional[int] = None):
+        self._engine = MatchingEngine(size_multiplier=size_multiplier)
+        self._random = random.Random(seed)
+        self._start_price = start_price
+        self._spread = spread
+        self._quote_size = quote_size
+        self._quote_interval = quote_interval
+        self._volatility = volatility
+        self._latency = latency
+        self._jitter = jitter
+        self._stream_latency = stream_latency
+        self._reject_rate = reject_rate
+        self._throttle_rate = throttle_rate
+        self._rate_per_minute = rate_per_minute
+        self._window_start = 0.0
+        self._window_count = 0
+        self._mids = {}
+        self._submitted_ns = {}
+        self._by_client_order_id = {}
+        self._trading_sockets = set()
+        self._data_sockets = {}  # websocket -> (use_msgpack, subscribed symbols)
+        self._updates = asyncio.Queue()
+        self._tasks = []
+        self._runner: Optional[web.AppRunner] = None
+        self._counts = defaultdict(int)
+        self.url: Optional[str] = None
+        for symbol in symbols:
+            self._add_symbol(symbol)
+
+    def get_matching_engine(self) -> MatchingEngine:
+        return self._engine
+
+    def get_counts(self) -> dict:
+        """Requests, orders, rejects, 429s, fills and trade_updates sent so far."""
+        return {**self._counts, "fills": self._engine.nr_fills}
+
+    def _add_symbol(self, symbol: str) -> None:
+        if symbol not in self._mids:
+            self._mids[symbol] = self._start_price
+            self._tick(symbol, time.time_ns())
+
+    # Quotes
+
+    def _tick(self, symbol: str, timestamp: int) -> QuoteRecord:
+        mid = self._mids[symbol] = round(self._mids[symbol] * math.exp(self._random.gauss(0.0, self._volatility)), 2)
+        half_spread = round(self._spread / 2, 2)
+        quote = QuoteRecord(symbol, round(mid - half_spread, 2), self._random.randint(1, self._quote_size), round(mid + half_spread, 2),
+                            self._random.randint(1, self._quote_size), timestamp)
+        self._publish(self._engine.on_quote(quote))
+        return quote
+
+    async def _generate_quotes(self) -> None:
+        while True:
+            await asyncio.sleep(self._quote_interval)
+            timestamp = time.time_ns()
+            quotes = [self._tick(symbol, timestamp) for symbol in list(self._mids)]
+            for ws, (use_msgpack, symbols) in list(self._data_sockets.items()):
+                items = [self._quote_item(quote, use_msgpack) for quote in quotes if quote.symbol in symbols]
+                if items:
+                    await self._send_data(ws, use_msgpack, items)
+
+    def _quote_item(self, quote: QuoteRecord, use_msgpack: bool) -> dict:
+        timestamp = msgpack.Timestamp.from_unix_nano(quote.timestamp) if use_msgpack else rfc3339(quote.timestamp)
+        return {"T": "q", "S": quote.symbol, "bp": quote.bid_price, "bs": quote.bid_size, "ap": quote.ask_price, "as": quote.ask_size,
+                "t": timestamp, "c": ["R"], "z": "C"}
+
+    # Trade updates
+
+    def _publish(self, updates: list) -> None:
+        if updates:
+            self._updates.put_nowait((time.monotonic() + self._stream_latency, updates))
+
+    async def _send_trade_updates(self) -> None:
+        """Single sender so trade_updates go out in the order they happened, stream_latency after it."""
+        while True:
+            due, updates = await self._updates.get()
+            delay = due - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self._counts["trade_updates"] += len(updates)
+            if not self._trading_sockets:
+                continue
+            for update in updates:
+                data = {"event": update.event, "order": self._order_json(update.order), "timestamp": rfc3339(update.timestamp or time.time_ns())}
+                for key in ("price", "qty", "position_qty"):
+                    value = getattr(update, key)
+                    if value is not None:
+                        data[key] = str(value)
+                message = _json_dumps({"stream": "trade_updates", "data": data})
+                for ws in list(self._trading_sockets):
+                    try:
+                        await ws.send_str(message)
+                    except ConnectionError:
+                        self._trading_sockets.discard(ws)
+
+    def _order_json(self, order: dict) -> dict:
+        """Order as the REST API renders it: decimal fields as strings and the REST spelling of statuses."""
+        body = {key: value for key, value in order.items() if key != "legs"}
+        body["status"] = EVENT_TO_ORDER_STATUS.get(order["status"], order["status"])
+        for key in ("qty", "filled_qty", "limit_price", "stop_price", "filled_avg_price"):
+            body[key] = _price(order.get(key))
+        body["submitted_at"] = rfc3339(self._submitted_ns.get(order["id"], 0))
+        body.setdefault("order_class", "")
+        body["legs"] = [self._order_json(leg) for leg in order["legs"]] if order.get("legs") else None
+        return body
+
+    # REST helpers
+
+    @staticmethod
+    def _error(status: int, code: int, message: str) -> web.Response:
+        return web.json_response({"code": code, "message": message}, status=status, dumps=_json_dumps)
+
+    @staticmethod
+    def _json(body, status: int = 200) -> web.Response:
+        return web.json_response(body, status=status, dumps=_json_dumps)
+
+    @web.middleware
+    async def _middleware(self, request: web.Request, handler) -> web.StreamResponse:
+        if request.headers.get("Upgrade", "").lower() == "websocket":
+            return await handler(request)
+        self._counts["requests"] += 1
+        if self._latency > 0 or self._jitter > 0:
+            await asyncio.sleep(self._latency + self._random.uniform(0.0, self._jitter))
+        headers = {}
+        if self._rate_per_minute is not None:
+            now = time.time()
+            if now - self._window_start >= 60.0:
+                self._window_start, self._window_count = now, 0
+            self._window_count += 1
+            headers = {"X-RateLimit-Limit": str(self._rate_per_minute), "X-RateLimit-Remaining": str(max(self._rate_per_minute - self._window_count, 0)),
+                       "X-RateLimit-Reset": str(int(self._window_start + 60.0))}
+            if self._window_count > self._rate_per_minute:
+                self._counts["throttled"] += 1
+                response = self._error(429, 42910000, "rate limit exceeded")
+                response.headers.update(headers)
+                return response
+        if self._throttle_rate > 0 and self._random.random() < self._throttle_rate:
+            self._counts["throttled"] += 1
+            return self._error(429, 42910000, "rate limit exceeded")
+        response = await handler(request)
+        response.headers.update(headers)
+        return response
+
+    def _find_order(self, order_id: str) -> Optional[dict]:
+        return self._engine.get_order(order_id)
+
+    def _submit(self, symbol: str, qty: float, side: str, order_type: str, time_in_force: str, limit_price: Optional[float] = None,
+                client_order_id: Optional[str] = None, order_class: Optional[str] = None, take_profit: Optional[float] = None,
+                stop_loss: Optional[float] = None) -> dict:
+        """Submit to the matching engine, publish the trade_updates and return the order as accepted."""
+        self._add_symbol(symbol)
+        timestamp = time.time_ns()
+        if order_type == ORDER_TYPE_MARKET:
+            # A market order crosses the whole book
+            limit_price = math.inf if side == SIDE_BUY else 0.0
+        updates = self._engine.submit(symbol, qty, side, limit_price, time_in_force, timestamp, client_order_id=client_order_id,
+                                      order_class=order_class, take_profit=take_profit, stop_loss=stop_loss)
+        order = self._engine.get_order(updates[0].order["id"])
+        if order_type == ORDER_TYPE_MARKET:
+            for target in [order] + [update.order for update in updates if update.order["id"] == order["id"]]:
+                target.update(type=ORDER_TYPE_MARKET, limit_price=None)
+        for submitted in [order] + (order.get("legs") or []):
+            self._submitted_ns[submitted["id"]] = timestamp
+        if client_order_id is not None:
+            self._by_client_order_id[client_order_id] = order["id"]
+        self._counts["orders"] += 1
+        self._publish(updates)
+        return updates[0].order
+
+    # Orders
+
+    async def _post_order(self, request: web.Request) -> web.Response:
+        try:
+            body = await request.json(loads=_json_loads)
+            symbol, side, order_type = body["symbol"], body["side"], body.get("type", ORDER_TYPE_LIMIT)
+            qty = float(body["qty"])
+            time_in_force = body.get("time_in_force", ORDER_TYPE_DAY)
+            limit_price = float(body["limit_price"]) if body.get("limit_price") is not None else None
+            order_class = body.get("order_class") or None
+            take_profit = float(body["take_profit"]["limit_price"]) if body.get("take_profit") else None
+            stop_loss = float(body["stop_loss"]["stop_price"]) if body.get("stop_loss") else None
+        except (KeyError, TypeError, ValueError) as e:
+            return self._error(422, 40010000, f"invalid order request: {e}")
+        if side not in ALL_SIDES or qty <= 0 or time_in_force not in TIME_IN_FORCES:
+            return self._error(422, 40010000, "invalid side, qty or time_in_force")
+        if order_type not in (ORDER_TYPE_LIMIT, ORDER_TYPE_MARKET) or (order_type == ORDER_TYPE_LIMIT and limit_price is None and order_class != ORDER_CLASS_OCO):
+            return self._error(422, 40010000, "limit orders require limit_price")
+        if order_class is not None:
+            if order_class not in ALL_ORDER_CLASSES or time_in_force not in (ORDER_TYPE_DAY, ORDER_TYPE_GTC) or (take_profit is None and stop_loss is None):
+                return self._error(422, 40010000, "invalid order_class, legs or time_in_force for an order class")
+        client_order_id = body.get("client_order_id")
+        if client_order_id is not None and client_order_id in self._by_client_order_id:
+            return self._error(422, 40010001, "client_order_id must be unique")
+        if self._reject_rate > 0 and self._random.random() < self._reject_rate:
+            self._counts["rejected"] += 1
+            return self._error(403, 40310000, "insufficient buying power")
+        order = self._submit(symbol, qty, side, order_type, time_in_force, limit_price, client_order_id, order_class, take_profit, stop_loss)
+        return self._json(self._order_json(order))
+
+    async def _get_orders(self, request: web.Request) -> web.Response:
+        query = request.query
+        status = query.get("status", "open")
+        limit = min(int(query.get("limit", 50)), 500)
+        symbols = set(query["symbols"].split(",")) if query.get("symbols") else None
+        after = rfc3339_ns(query["after"]) if query.get("after") else None
+        until = rfc3339_ns(query["until"]) if query.get("until") else None
+        nested = query.get("nested", "false") == "true"
+        leg_ids = {leg["id"] for order in self._engine.get_orders() for leg in order.get("legs") or ()} if nested else set()
+        orders = []
+        for order in self._engine.get_orders():
+            submitted_ns = self._submitted_ns.get(order["id"], 0)
+            is_open = order["status"] not in TERMINAL_EVENTS
+            if (status == "open" and not is_open) or (status == "closed" and is_open) or order["id"] in leg_ids:
+                continue
+            if (symbols is not None and order["symbol"] not in symbols) or (after is not None and submitted_ns <= after) \
+                    or (until is not None and submitted_ns >= until):
+                continue
+            orders.append((submitted_ns, order))
+        orders.sort(key=lambda item: item[0], reverse=query.get("direction", "desc") == "desc")
+        return self._json([self._order_json(order) if nested else dict(self._order_json(order), legs=None) for _, order in orders[:limit]])
+
+    async def _get_order(self, request: web.Request) -> web.Response:
+        order = self._find_order(request.match_info["order_id"])
+        if order is None:
+            return self._error(404, 40410000, "order not found")
+        return self._json(self._order_json(order))
+
+    async def _get_order_by_client_order_id(self, request: web.Request) -> web.Response:
+        order_id = self._by_client_order_id.get(request.query.get("client_order_id"))
+        if order_id is None:
+            return self._error(404, 40410000, "order not found")
+        return self._json(self._order_json(self._find_order(order_id)))
+
+    async def _delete_order(self, request: web.Request) -> web.Response:
+        order_id = request.match_info["order_id"]
+        if self._find_order(order_id) is None:
+            return self._error(404, 40410000, "order not found")
+        updates = self._engine.cancel(order_id, time.time_ns())
+        if not updates:
+            return self._error(422, 42210000, "order is not cancelable")
+        self._publish(updates)
+        return web.Response(status=204)
+
+    def _cancel_all(self) -> list:
+        statuses = []
+        for order_id in self._engine.get_open_order_ids():
+            updates = self._engine.cancel(order_id, time.time_ns())
+            if updates:  # already gone when an earlier cancel took it along as a leg or OCO sibling
+                self._publish(updates)
+                statuses.append({"id": order_id, "status": 200, "body": self._order_json(updates[0].order)})
+        return statuses
+
+    async def _delete_orders(self, request: web.Request) -> web.Response:
+        return self._json(self._cancel_all(), status=207)
+
+    async def _patch_order(self, request: web.Request) -> web.Response:
+        order_id = request.match_info["order_id"]
+        if self._find_order(order_id) is None:
+            return self._error(404, 40410000, "order not found")
+        body = await request.json(loads=_json_loads)
+        timestamp = time.time_ns()
+        updates = self._engine.replace(order_id, timestamp, qty=float(body["qty"]) if body.get("qty") is not None else None,
+                                       limit_price=float(body["limit_price"]) if body.get("limit_price") is not None else None,
+                                       time_in_force=body.get("time_in_force"), client_order_id=body.get("client_order_id"))
+        if not updates:
+            return self._error(422, 42210000, "order is not replaceable")
+        new_order = updates[1].order
+        self._submitted_ns[new_order["id"]] = timestamp
+        if new_order.get("client_order_id") is not None:
+            self._by_client_order_id[new_order["client_order_id"]] = new_order["id"]
+        self._publish(updates)
+        return self._json(self._order_json(new_order))
+
+    # Positions
+
+    def _position_json(self, symbol: str, qty: float, avg_entry_price: float) -> dict:
+        quote = self._engine.get_last_quote(symbol)
+        price = (quote.bid_price + quote.ask_price) * 0.5 if quote is not None else avg_entry_price
+        return {"symbol": symbol, "qty": str(qty), "side": "long" if qty > 0 else "short", "avg_entry_price": str(avg_entry_price),
+                "current_price": str(price), "market_value": str(qty * price), "unrealized_pl": str(qty * (price - avg_entry_price))}
+
+    async def _get_positions(self, request: web.Request) -> web.Response:
+        return self._json([self._position_json(symbol, qty, price) for symbol, (qty, price) in self._engine.get_positions().items()])
+
+    async def _get_position(self, request: web.Request) -> web.Response:
+        symbol = request.match_info["symbol"]
+        position = self._engine.get_positions().get(symbol)
+        if position is None:
+            return self._error(404, 40410000, "position does not exist")
+        return self._json(self._position_json(symbol, *position))
+
+    def _close(self, symbol: str, qty: Optional[float] = None, percentage: Optional[float] = None) -> Optional[dict]:
+        position = self._engine.get_position(symbol)
+        if position == 0:
+            return None
+        close_qty = qty if qty is not None else abs(position) * (percentage / 100 if percentage is not None else 1.0)
+        return self._submit(symbol, close_qty, SIDE_SELL if position > 0 else SIDE_BUY, ORDER_TYPE_MARKET, ORDER_TYPE_IOC)
+
+    async def _delete_position(self, request: web.Request) -> web.Response:
+        query = request.query
+        order = self._close(request.match_info["symbol"], qty=float(query["qty"]) if "qty" in query else None,
+                            percentage=float(query["percentage"]) if "percentage" in query else None)
+        if order is None:
+            return self._error(404, 40410000, "position does not exist")
+        return self._json(self._order_json(order))
+
+    async def _delete_positions(self, request: web.Request) -> web.Response:
+        # The client sends cancel_orders in the body, the API documents it as a query parameter
+        body = _json_loads(await request.read() or b"{}")
+        if str(request.query.get("cancel_orders", body.get("cancel_orders", False))).lower() == "true":
+            self._cancel_all()
+        statuses = []
+        for symbol in list(self._engine.get_positions()):
+            order = self._close(symbol)
+            statuses.append({"symbol": symbol, "status": 200, "body": self._order_json(order)})
+        return self._json(statuses, status=207)
+
+    # Clock, calendar and market data
+
+    async def _get_clock(self, request: web.Request) -> web.Response:
+        now = datetime.now(timezone.utc)
+        return self._json({"timestamp": now.isoformat(), "is_open": True, "next_open": (now + timedelta(days=1)).isoformat(),
+                           "next_close": (now + timedelta(days=1)).isoformat()})
+
+    async def _get_calendar(self, request: web.Request) -> web.Response:
+        """A session covering every day, the simulator trades around the clock."""
+        start = datetime.fromisoformat(request.query.get("start", datetime.now(timezone.utc).date().isoformat())).date()
+        end = datetime.fromisoformat(request.query["end"]).date() if "end" in request.query else start + timedelta(days=30)
+        days = [(start + timedelta(days=offset)).isoformat() for offset in range((end - start).days + 1)]
+        return self._json([{"date": day, "open": "00:00", "close": "23:59"} for day in days])
+
+    async def _get_latest_quotes(self, request: web.Request) -> web.Response:
+        quotes = {}
+        for symbol in filter(None, request.query.get("symbols", "").split(",")):
+            self._add_symbol(symbol)
+            quote = self._engine.get_last_quote(symbol)
+            quotes[symbol] = {"bp": quote.bid_price, "bs": quote.bid_size, "ap": quote.ask_price, "as": quote.ask_size, "t": rfc3339(quote.timestamp)}
+        return self._json({"quotes": quotes})
+
+    # Websockets
+
+    async def _trading_stream(self, request: web.Request) -> web.WebSocketResponse:
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        try:
+            async for message in ws:
+                if message.type not in (WSMsgType.TEXT, WSMsgType.BINARY):
+                    break
+                action = _json_loads(message.data)
+                if action.get("action") in ("auth", "authenticate"):
+                    await ws.send_str(_json_dumps({"stream": "authorization", "data": {"status": "authorized", "action": "authenticate"}}))
+                elif action.get("action") == "listen":
+                    streams = action.get("data", {}).get("streams", [])
+                    if "trade_updates" in streams:
+                        self._trading_sockets.add(ws)
+                    await ws.send_str(_json_dumps({"stream": "listening", "data": {"streams": streams}}))
+        finally:
+            self._trading_sockets.discard(ws)
+        return ws
+
+    async def _send_data(self, ws: web.WebSocketResponse, use_msgpack: bool, items: list) -> None:
+        try:
+            if use_msgpack:
+                await ws.send_bytes(msgpack.packb(items))
+            else:
+                await ws.send_str(_json_dumps(items))
+        except ConnectionError:
+            self._data_sockets.pop(ws, None)
+
+    async def _data_stream(self, request: web.Request) -> web.WebSocketResponse:
+        """Market data stream in the broker's protocol, msgpack when the client asks for it with its Content-Type."""
+        use_msgpack = request.headers.get("Content-Type") == "application/msgpack"
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        await self._send_data(ws, use_msgpack, [{"T": "success", "msg": "connected"}])
+        symbols = set()
+        try:
+            async for message in ws:
+                if message.type == WSMsgType.BINARY:
+                    action = msgpack.unpackb(message.data)
+                elif message.type == WSMsgType.TEXT:
+                    action = _json_loads(message.data)
+                else:
+                    break
+                if action.get("action") == "auth":
+                    await self._send_data(ws, use_msgpack, [{"T": "success", "msg": "authenticated"}])
+                elif action.get("action") == "subscribe":
+                    symbols.update(action.get("quotes") or ())
+                    for symbol in symbols:
+                        self._add_symbol(symbol)
+                    self._data_sockets[ws] = (use_msgpack, symbols)
+                    await self._send_data(ws, use_msgpack, [{"T": "subscription", "trades": action.get("trades") or [],
+                                                             "quotes": sorted(symbols), "bars": action.get("bars") or []}])
+        finally:
+            self._data_sockets.pop(ws, None)
+        return ws
+
+    def make_app(self) -> web.Application:
+        app = web.Application(middlewares=[self._middleware])
+        app.router.add_post("/v2/orders", self._post_order)
+        app.router.add_get("/v2/orders", self._get_orders)
+        app.router.add_delete("/v2/orders", self._delete_orders)
+        app.router.add_get("/v2/orders:by_client_order_id", self._get_order_by_client_order_id)
+        app.router.add_get("/v2/orders/{order_id}", self._get_order)
+        app.router.add_delete("/v2/orders/{order_id}", self._delete_order)
+        app.router.add_patch("/v2/orders/{order_id}", self._patch_order)
+        app.router.add_get("/v2/positions", self._get_positions)
+        app.router.add_delete("/v2/positions", self._delete_positions)
+        app.router.add_get("/v2/positions/{symbol}", self._get_position)
+        app.router.add_delete("/v2/positions/{symbol}", self._delete_position)
+        app.router.add_get("/v2/clock", self._get_clock)
+        app.router.add_get("/v2/calendar", self._get_calendar)
+        app.router.add_get("/v2/stocks/quotes/latest", self._get_latest_quotes)
+        app.router.add_get("/stream", self._trading_stream)
+        app.router.add_get("/stream/", self._trading_stream)
+        app.router.add_get("/v2/{feed}", self._data_stream)
+        return app
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """Serve on host:port (an ephemeral port with 0) and start the quote generator. Returns the base URL."""
+        self._runner = web.AppRunner(self.make_app(), access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://{host}:{port}"
+        self._tasks = [asyncio.create_task(self._generate_quotes()), asyncio.create_task(self._send_trade_updates())]
+        sim_logger.info("Broker simulator listening on %s", self.url)
+        return self.url
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        for ws in list(self._trading_sockets) + list(self._data_sockets):
+            await ws.close()
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+
+async def load_test(url: str, nr_orders: int, concurrency: int = 64, symbol: str = "AAPL") -> dict:
+    """Orders through OrderManager against a simulator at url, alternating the strategy's two request patterns:
+    marketable IOC inserts, and OTO entries away from the market that rest until cancelled.
+    Reports throughput, insert latency and the outcome counts."""
+    Client.configure_rate_limit(rate_per_minute=10_000_000, burst=10_000)
+    Client.configure_session(limit=concurrency, limit_per_host=concurrency)
+    order_manager = OrderManager(order_store=OrderStateStore(), base_url=url, max_concurrent_requests=concurrency)
+    await order_manager.start(nr_warm_connections=concurrency)
+    latencies = np.zeros(nr_orders, dtype=np.int64)
+    outcomes = defaultdict(int)
+
+    async def round_trip(k: int) -> None:
+        side = SIDE_BUY if k % 4 < 2 else SIDE_SELL
+        sign = 1 if side == SIDE_BUY else -1
+        started = time.perf_counter_ns()
+        if k % 2 == 0:
+            response = await order_manager.insert_order(symbol, round(100.0 + sign * 50.0, 2), 1, side, ORDER_TYPE_DAY)
+        else:
+            price = round(100.0 - sign * 50.0, 2)
+            response = await order_manager.insert_bracket_order(symbol, price, 1, side, take_profit=round(price + sign * 1.0, 2))
+        latencies[k] = time.perf_counter_ns() - started
+        if not response.success:
+            outcomes["insert_" + str(response.error).split(":")[0]] += 1
+            return
+        outcomes["inserted"] += 1
+        if k % 2 == 1:
+            cancel = await order_manager.cancel_order(response.order_id)
+            outcomes["canceled" if cancel.success else "cancel_" + str(cancel.error)] += 1
+
+    started = time.perf_counter()
+    await order_manager._gather_bounded([round_trip(k) for k in range(nr_orders)], concurrency)
+    elapsed = time.perf_counter() - started
+    await Client.close_session()
+    return {"orders": nr_orders, "elapsed_s": elapsed, "orders_per_s": nr_orders / elapsed, "p50_us": float(np.percentile(latencies, 50)) / 1000,
+            "p99_us": float(np.percentile(latencies, 99)) / 1000, "outcomes": dict(outcomes)}
+
+
+async def serve(simulator: BrokerSimulator, host: str, port: int, nr_load_orders: int = 0, concurrency: int = 64,
+                target_url: Optional[str] = None) -> None:
+    if target_url is not None:
+        print(await load_test(target_url, nr_load_orders, concurrency))
+        return
+    url = await simulator.start(host, port)
+    try:
+        if nr_load_orders > 0:
+            print(await load_test(url, nr_load_orders, concurrency))
+            print(simulator.get_counts())
+        else:
+            print(f"Serving on {url}, run the bot with --base-url {url} --data-url {url} --data-stream-url {url.replace('http', 'ws', 1)}")
+            await asyncio.Event().wait()
+    finally:
+        await simulator.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local broker simulator: trading REST API, trade_updates and market data websockets.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--symbols", default="", help="Comma-separated symbols to quote from the start, others are added when requested")
+    parser.add_argument("--quote-interval", type=float, default=0.05, help="Seconds between quotes of each symbol")
+    parser.add_argument("--volatility", type=float, default=0.0002, help="Standard deviation of the log mid change per quote")
+    parser.add_argument("--quote-size", type=int, default=100, help="Largest quoted size, fills are capped by the quoted size")
+    parser.add_argument("--size-multiplier", type=float, default=1.0, help="Share of the quoted size an order can fill against")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every REST response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Uniform random seconds added on top of --latency")
+    parser.add_argument("--stream-latency", type=float, default=0.0, help="Seconds trade_updates are delayed by")
+    parser.add_argument("--reject-rate", type=float, default=0.0, help="Share of order submissions rejected with 403")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Share of REST requests answered with 429")
+    parser.add_argument("--rate-per-minute", type=int, default=None, help="Enforce a per-minute request limit with X-RateLimit headers")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--load", type=int, default=0, help="Instead of serving, send this many orders to the simulator and report")
+    parser.add_argument("--concurrency", type=int, default=64, help="Concurrent round trips with --load")
+    parser.add_argument("--target", default=None, help="With --load, load an already running simulator at this URL instead")
+    args = parser.parse_args()
+    configure_logging(level=logging.WARNING if args.load else logging.INFO)
+    simulator = BrokerSimulator(symbols=filter(None, args.symbols.split(",")), quote_size=args.quote_size, quote_interval=args.quote_interval,
+                                volatility=args.volatility, latency=args.latency, jitter=args.jitter, stream_latency=args.stream_latency,
+                                reject_rate=args.reject_rate, throttle_rate=args.throttle_rate, rate_per_minute=args.rate_per_minute,
+                                size_multiplier=args.size_multiplier, seed=args.seed)
+    try:
+        asyncio.run(serve(simulator, args.host, args.port, args.load, args.concurrency, args.target))
+    except KeyboardInterrupt:
+        pass
@@ -1,14 +1,175 @@
 import asyncio
 import aiohttp
 import logging 
+import logging.handlers
+import atexit
+import queue
 import json
+import os
+import sys
+import threading
 from collections import defaultdict, deque
 from typing import Optional, Set
 import time
-
-from alpaca_trade_api.common import URL
-from alpaca_trade_api.stream import Stream
-logging.basicConfig(level=logging.INFO , format='%(asctime)s - %(levelname)s - %(message)s')
+import math
+import heapq
+import importlib
+import itertools
+import uuid
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone, timedelta
+from zoneinfo import ZoneInfo
+from multiprocessing import shared_memory
+
+import msgpack
+import numpy as np
+
+try:
+    import orjson
+
+    def _json_loads(data):
+        return orjson.loads(data)
+
+    def _json_dumps(obj) -> str:
+        return orjson.dumps(obj).decode()
+except ImportError:
+    _json_loads = json.loads
+    _json_dumps = json.dumps
+
+# Without its C extension msgpack decodes several times slower than orjson parses the same data as JSON
+MSGPACK_ACCELERATED = msgpack.Unpacker.__module__ != "msgpack.fallback"
+
+# alpaca_trade_api (and pandas with it) takes about a third of a second to import, so it is only
+# imported when a live stream is started, see DataClient._run_stream
+
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+# Per-category loggers, so the hot paths can be rate limited or silenced independently
+data_logger = logging.getLogger("core.data")
+order_logger = logging.getLogger("core.orders")
+position_logger = logging.getLogger("core.positions")
+risk_logger = logging.getLogger("core.risk")
+clock_logger = logging.getLogger("core.clock")
+monitor_logger = logging.getLogger("core.monitor")
+DEFAULT_LOG_RATE_LIMITS = {"core.data": 20, "core.orders": 50, "core.positions": 20, "core.monitor": 20, "MarketMaker": 20}
+_STANDARD_RECORD_KEYS = set(logging.makeLogRecord({}).__dict__) | {"message", "asctime"}
+_log_listener: Optional[logging.handlers.QueueListener] = None
+_saved_caller_info: Optional[tuple] = None
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record with ts, level, logger and msg, plus any extra= fields."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {"ts": record.created, "level": record.levelname, "logger": record.name, "msg": record.getMessage()}
+        for key, value in record.__dict__.items():
+            if key not in _STANDARD_RECORD_KEYS:
+                entry[key] = value if isinstance(value, (str, int, float, bool, type(None))) else str(value)
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return _json_dumps(entry)
+
+
+class RateLimitFilter(logging.Filter):
+    """Token bucket per logger: records of a logger whose name starts with a rate_limits key are let through
+    at most that many per second, the rest are dropped before they are queued. WARNING and above always pass.
+    The number dropped is attached to the next record let through as its suppressed attribute."""
+
+    def __init__(self, rate_limits: dict):
+        super().__init__()
+        self._rate_limits = rate_limits
+        self._buckets = {}  # logger name -> [rate, tokens, last refill, dropped], rate None when unlimited
+
+    def _rate(self, name: str) -> Optional[float]:
+        matches = [prefix for prefix in self._rate_limits if name == prefix or name.startswith(prefix + ".")]
+        return self._rate_limits[max(matches, key=len)] if matches else None
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        bucket = self._buckets.get(record.name)
+        if bucket is None:
+            rate = self._rate(record.name)
+            bucket = self._buckets[record.name] = [rate, rate, record.created, 0]
+        rate = bucket[0]
+        if rate is None:
+            return True
+        bucket[1] = min(rate, bucket[1] + (record.created - bucket[2]) * rate)
+        bucket[2] = record.created
+        if bucket[1] < 1.0:
+            bucket[3] += 1
+            return False
+        bucket[1] -= 1.0
+        if bucket[3]:
+            record.suppressed = bucket[3]
+            bucket[3] = 0
+        return True
+
+
+class _LazyQueueHandler(logging.handlers.QueueHandler):
+    # The stock prepare() runs the whole formatter on the calling thread. The listener runs in this process, so only
+    # the message is rendered here, while its arguments cannot change yet, and the formatter runs on the listener thread.
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+def configure_logging(level: int = logging.INFO, use_queue: bool = True, json_format: bool = False,
+                      rate_limits: Optional[dict] = None, stream=None, skip_caller_info: bool = False) -> None:
+    """Set up the root logger. With use_queue, records are only enqueued on the calling thread and a
+    QueueListener thread formats and writes them, so the event loop never blocks on stdout.
+    rate_limits maps logger name prefixes to records per second, see DEFAULT_LOG_RATE_LIMITS.
+    skip_caller_info stops every logger in the process from collecting caller, thread and process info
+    (see "Optimization" in the logging HOWTO), so only set it where no format uses them; shutdown_logging restores it."""
+    global _log_listener, _saved_caller_info
+    shutdown_logging()
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(JsonFormatter() if json_format else logging.Formatter(LOG_FORMAT))
+    root = logging.getLogger()
+    for existing in root.handlers[:]:
+        root.removeHandler(existing)
+    root.setLevel(level)
+    if use_queue:
+        log_queue = queue.SimpleQueue()
+        front = _LazyQueueHandler(log_queue)
+        _log_listener = logging.handlers.QueueListener(log_queue, handler, respect_handler_level=True)
+        _log_listener.start()
+    else:
+        front = handler
+    if skip_caller_info:
+        _saved_caller_info = (logging._srcfile, logging.logThreads, logging.logProcesses, logging.logMultiprocessing)
+        logging._srcfile = None
+        logging.logThreads = False
+        logging.logProcesses = False
+        logging.logMultiprocessing = False
+    if rate_limits:
+        front.addFilter(RateLimitFilter(rate_limits))
+    root.addHandler(front)
+
+
+def shutdown_logging() -> None:
+    """Flush and stop the listener thread started by configure_logging and restore the caller info it skipped."""
+    global _log_listener, _saved_caller_info
+    if _log_listener is not None:
+        _log_listener.stop()
+        _log_listener = None
+    if _saved_caller_info is not None:
+        logging._srcfile, logging.logThreads, logging.logProcesses, logging.logMultiprocessing = _saved_caller_info
+        _saved_caller_info = None
+
+
+atexit.register(shutdown_logging)
+
+
+def install_uvloop() -> bool:
+    """Make new event loops uvloop loops. Call before the loop is created; False if uvloop is not installed."""
+    try:
+        import uvloop
+    except ImportError:
+        monitor_logger.warning("uvloop is not installed, keeping the default asyncio event loop")
+        return False
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    return True
 
 FILL = "fill"
 PARTIAL_FILL = "partial_fill"
@@ -17,6 +178,17 @@ FILL_EVENT = [FILL, PARTIAL_FILL]
 CANCELED = "canceled"
 ORDER_CYLE_END_EVENT = [FILL, CANCELED]
 
+NEW = "new"
+PENDING_NEW = "pending_new"
+EXPIRED = "expired"
+REJECTED = "rejected"
+REPLACED = "replaced"
+DONE_FOR_DAY = "done_for_day"
+HELD = "held"  # status of a bracket or OTO exit leg until its entry fills
+TERMINAL_EVENTS = [FILL, CANCELED, EXPIRED, REJECTED, REPLACED, DONE_FOR_DAY]
+# REST order statuses that differ from the trade_update event names
+ORDER_STATUS_TO_EVENT = {"filled": FILL, "partially_filled": PARTIAL_FILL}
+
 
 SIDE_BUY = 'buy'
 SIDE_SELL = 'sell'
@@ -28,9 +200,499 @@ ORDER_TYPE_DAY  = 'day'
 ORDER_TYPE_GTC  = 'gtc'
 ALL_ORDER_TYPES = [ORDER_TYPE_LIMIT, ORDER_TYPE_IOC,ORDER_TYPE_DAY, ORDER_TYPE_GTC]
 
+# Advanced order classes: exit legs attached to an entry and managed by the broker
+ORDER_CLASS_BRACKET = 'bracket'  # entry with a take-profit and a stop-loss leg, one cancels the other
+ORDER_CLASS_OTO = 'oto'          # entry with one take-profit or stop-loss leg
+ORDER_CLASS_OCO = 'oco'          # exit only: take-profit limit and stop-loss, one cancels the other
+ALL_ORDER_CLASSES = [ORDER_CLASS_BRACKET, ORDER_CLASS_OTO, ORDER_CLASS_OCO]
+
+TRADE_HIST_DTYPE = np.dtype([("timestamp", np.int64), ("price", np.float64), ("size", np.float64)])
+BAR_HIST_DTYPE = np.dtype([("timestamp", np.int64), ("open", np.float64), ("high", np.float64), ("low", np.float64),
+                           ("close", np.float64), ("volume", np.float64)])
+
+SHARED_POSITION_DTYPE = np.dtype([("seq", np.int64), ("position", np.float64), ("avg_entry_price", np.float64),
+                                  ("last_mid", np.float64), ("open_orders", np.int64), ("updated_ns", np.int64)])
+
+# Latency stages recorded by SystemMonitoring
+STAGE_STREAM_RECEIVE = "stream_receive"            # exchange timestamp to on_quote (wall clock, includes clock skew)
+STAGE_QUOTE_HANDLER = "quote_handler"              # time spent inside on_quote
+STAGE_STRATEGY_DECISION = "strategy_decision"      # quote arrival to the strategy handing orders to OrderManager
+STAGE_REST_SEND = "rest_send"                      # Client.request entry to dispatch, i.e. rate limiter queueing
+STAGE_REST_RESPONSE = "rest_response"              # dispatch to response headers
+STAGE_TRADE_UPDATE_ECHO = "trade_update_echo"      # order acknowledged over REST to its first trade_update
+STAGE_FILL_TO_TAKE_PROFIT = "fill_to_take_profit"  # fill trade_update to the take-profit being acknowledged
+STAGE_STREAM_RECOVERY = "stream_recovery"          # stream disconnect or gap detected to resync complete
+STAGE_LOOP_LAG = "loop_lag"                        # event loop probe waking up later than scheduled
+ALL_LATENCY_STAGES = [STAGE_STREAM_RECEIVE, STAGE_QUOTE_HANDLER, STAGE_STRATEGY_DECISION, STAGE_REST_SEND,
+                      STAGE_REST_RESPONSE, STAGE_TRADE_UPDATE_ECHO, STAGE_FILL_TO_TAKE_PROFIT, STAGE_STREAM_RECOVERY,
+                      STAGE_LOOP_LAG]
+
+# REST request priorities, lower is served first
+PRIORITY_HIGH = 0    # cancels, take-profit inserts, position closes
+PRIORITY_NORMAL = 1  # quote inserts and replaces
+PRIORITY_LOW = 2     # position refreshes and other queries
+
 
 ## TODO Finish on_trade_update 
 
+def timestamp_ns(timestamp) -> int:
+    """Nanoseconds since epoch from an int, pandas Timestamp, msgpack Timestamp or datetime."""
+    if isinstance(timestamp, (int, np.integer)):
+        return int(timestamp)
+    if hasattr(timestamp, "value"):
+        return timestamp.value
+    if hasattr(timestamp, "to_unix_nano"):
+        return timestamp.to_unix_nano()
+    return int(timestamp.timestamp() * 1_000_000_000)
+
+
+def rfc3339_ns(text: str) -> int:
+    """Nanoseconds since epoch from an RFC 3339 string, keeping the digits past microseconds that datetime drops."""
+    dot = text.find(".")
+    if dot < 0:
+        return timestamp_ns(datetime.fromisoformat(text))
+    end = dot + 1
+    while end < len(text) and text[end].isdigit():
+        end += 1
+    seconds = datetime.fromisoformat(text[:dot] + text[end:])
+    return int(seconds.timestamp()) * 1_000_000_000 + int(text[dot + 1:end].ljust(9, "0")[:9])
+
+
+def to_rfc3339(timestamp) -> str:
+    """RFC 3339 string for the REST API from an RFC 3339 string, datetime or ns since epoch."""
+    if isinstance(timestamp, str):
+        return timestamp
+    if isinstance(timestamp, datetime):
+        return timestamp.isoformat()
+    return datetime.fromtimestamp(timestamp / 1_000_000_000, tz=timezone.utc).isoformat()
+
+
+def add_order_class_params(params: dict, order_class: str, order_type: str, take_profit: Optional[float] = None,
+                           stop_loss: Optional[float] = None, stop_limit: Optional[float] = None) -> dict:
+    """Turn the request fields of a simple limit order into those of a bracket, OTO or OCO order, in place."""
+    if order_class == ORDER_CLASS_OCO:
+        # An OCO order is its take-profit leg, the limit moves there
+        limit_price = params.pop("limit_price")
+        take_profit = limit_price if take_profit is None else take_profit
+    assert take_profit is not None or stop_loss is not None, "an order class needs a take_profit or stop_loss leg"
+    assert order_class == ORDER_CLASS_OTO or (take_profit is not None and stop_loss is not None), \
+        f"{order_class} orders need both a take_profit and a stop_loss leg"
+    assert order_class != ORDER_CLASS_OTO or (take_profit is None) != (stop_loss is None), "OTO orders take exactly one leg"
+    params["order_class"] = order_class
+    params["time_in_force"] = order_type if order_type in (ORDER_TYPE_DAY, ORDER_TYPE_GTC) else ORDER_TYPE_DAY
+    if take_profit is not None:
+        params["take_profit"] = {"limit_price": take_profit}
+    if stop_loss is not None:
+        params["stop_loss"] = {"stop_price": stop_loss} if stop_limit is None else {"stop_price": stop_loss, "limit_price": stop_limit}
+    return params
+
+
+class RingBuffer:
+    """Preallocated history of fixed-width records. Each record is written twice, capacity apart,
+    so the latest n records are always one contiguous slice and view() never copies."""
+    __slots__ = ("_data", "_capacity", "_head", "_count")
+
+    def __init__(self, dtype: np.dtype, capacity: int):
+        self._data = np.zeros(2 * capacity, dtype=dtype)
+        self._capacity = capacity
+        self._head = 0
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def append(self, record: tuple) -> None:
+        head = self._head
+        self._data[head] = record
+        self._data[head + self._capacity] = record
+        self._head = head + 1 if head + 1 < self._capacity else 0
+        if self._count < self._capacity:
+            self._count += 1
+
+    def view(self, n: Optional[int] = None) -> np.ndarray:
+        """The latest n records (all if None), oldest first, as a read-only view into the buffer."""
+        n = self._count if n is None else min(n, self._count)
+        end = self._head + self._capacity
+        window = self._data[end - n:end]
+        window.flags.writeable = False
+        return window
+
+    def last(self):
+        return self._data[self._head + self._capacity - 1] if self._count else None
+
+
+class SymbolSignals:
+    """Microstructure state for one symbol, every field updated in O(1) per tick."""
+    __slots__ = ("vwap", "volatility", "imbalance", "trade_flow", "_pv_window", "_volume_window", "_window_pos",
+                 "_pv_sum", "_volume_sum", "_variance", "_last_mid", "_last_trade_price", "_last_sign", "_signed_volume", "_volume")
+
+    def __init__(self, vwap_window: int):
+        self.vwap: Optional[float] = None
+        self.volatility: float = 0.0    # EWMA std of mid log returns, per quote update
+        self.imbalance: float = 0.0     # (bid_size - ask_size) / (bid_size + ask_size) at the last quote
+        self.trade_flow: float = 0.0    # EWMA of signed volume over EWMA of volume, in [-1, 1]
+        self._pv_window = [0.0] * vwap_window
+        self._volume_window = [0.0] * vwap_window
+        self._window_pos = 0
+        self._pv_sum = 0.0
+        self._volume_sum = 0.0
+        self._variance = 0.0
+        self._last_mid: Optional[float] = None
+        self._last_trade_price: Optional[float] = None
+        self._last_sign = 0
+        self._signed_volume = 0.0
+        self._volume = 0.0
+
+
+class SignalEngine:
+    """Rolling VWAP over the last vwap_window trades, EWMA realized volatility of the mid, quote imbalance
+    and trade-sign flow per symbol. Updates are O(1) on the tick path and reads never rescan history."""
+
+    def __init__(self, vwap_window: int = 500, volatility_halflife: float = 100, flow_halflife: float = 50):
+        self._vwap_window = vwap_window
+        self._volatility_decay = 0.5 ** (1.0 / volatility_halflife)
+        self._flow_decay = 0.5 ** (1.0 / flow_halflife)
+        self._signals = {}
+
+    def get(self, symbol: str) -> SymbolSignals:
+        signals = self._signals.get(symbol)
+        if signals is None:
+            signals = self._signals[symbol] = SymbolSignals(self._vwap_window)
+        return signals
+
+    def on_quote(self, symbol: str, bid_price: float, bid_size: float, ask_price: float, ask_size: float) -> None:
+        signals = self.get(symbol)
+        total_size = bid_size + ask_size
+        if total_size > 0:
+            signals.imbalance = (bid_size - ask_size) / total_size
+        mid = (bid_price + ask_price) * 0.5
+        last_mid = signals._last_mid
+        if last_mid is not None and mid != last_mid:
+            log_return = math.log(mid / last_mid)
+            signals._variance = self._volatility_decay * signals._variance + (1 - self._volatility_decay) * log_return * log_return
+            signals.volatility = math.sqrt(signals._variance)
+        signals._last_mid = mid
+
+    def on_trade(self, symbol: str, price: float, size: float) -> None:
+        signals = self.get(symbol)
+        pos = signals._window_pos
+        pv = price * size
+        signals._pv_sum += pv - signals._pv_window[pos]
+        signals._volume_sum += size - signals._volume_window[pos]
+        signals._pv_window[pos] = pv
+        signals._volume_window[pos] = size
+        pos += 1
+        if pos == self._vwap_window:
+            # Resum once per window so floating point drift from the running sums never accumulates
+            pos = 0
+            signals._pv_sum = sum(signals._pv_window)
+            signals._volume_sum = sum(signals._volume_window)
+        signals._window_pos = pos
+        if signals._volume_sum > 0:
+            signals.vwap = signals._pv_sum / signals._volume_sum
+
+        # Quote rule against the last mid, tick rule when the trade prints at the mid
+        mid = signals._last_mid
+        if mid is not None and price != mid:
+            sign = 1 if price > mid else -1
+        elif signals._last_trade_price is not None and price != signals._last_trade_price:
+            sign = 1 if price > signals._last_trade_price else -1
+        else:
+            sign = signals._last_sign
+        signals._last_sign = sign
+        signals._last_trade_price = price
+        signals._signed_volume = self._flow_decay * signals._signed_volume + (1 - self._flow_decay) * sign * size
+        signals._volume = self._flow_decay * signals._volume + (1 - self._flow_decay) * size
+        if signals._volume > 0:
+            signals.trade_flow = signals._signed_volume / signals._volume
+
+
+class QuoteSubscription:
+    """Wake-up handle for one strategy on one symbol. Bursts of updates coalesce into a single pending wake-up."""
+    __slots__ = ("symbol", "event", "fill_pending")
+
+    def __init__(self, symbol: str):
+        self.symbol: str = symbol
+        self.event: asyncio.Event = asyncio.Event()
+        self.fill_pending: bool = False
+
+    def notify(self, symbol: str, fill: bool = False) -> None:
+        if fill:
+            self.fill_pending = True
+        self.event.set()
+
+    async def wait(self, timeout: Optional[float] = None) -> bool:
+        """Wait for the next update. Returns True if a fill arrived since the previous wait."""
+        if timeout is None:
+            await self.event.wait()
+        else:
+            try:
+                await asyncio.wait_for(self.event.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        self.event.clear()
+        fill = self.fill_pending
+        self.fill_pending = False
+        return fill
+
+
+class OrderState:
+    """Last known state of one order, built from REST responses and trade_updates."""
+    __slots__ = ("order_id", "client_order_id", "symbol", "side", "qty", "limit_price",
+                 "filled_qty", "filled_avg_price", "status", "last_update", "acknowledged_ns",
+                 "order_class", "parent_id", "leg_ids")
+
+    def __init__(self, order_id: str, symbol: str, side: str):
+        self.order_id: str = order_id
+        self.client_order_id: Optional[str] = None
+        self.symbol: str = symbol
+        self.side: str = side
+        self.qty: float = 0.0
+        self.limit_price: Optional[float] = None
+        self.filled_qty: float = 0.0
+        self.filled_avg_price: Optional[float] = None
+        self.status: str = PENDING_NEW
+        self.last_update = None
+        self.acknowledged_ns: Optional[int] = None  # monotonic time of the REST ack, cleared once the stream echoes the order
+        self.order_class: Optional[str] = None
+        self.parent_id: Optional[str] = None  # set on the exit legs of a bracket, OTO or OCO order
+        self.leg_ids: Optional[list] = None   # set on their parent
+
+    def is_live(self) -> bool:
+        return self.status not in TERMINAL_EVENTS
+
+    def __str__(self):
+        return f"OrderState(order_id={self.order_id}, symbol={self.symbol}, side={self.side}, qty={self.qty}, filled_qty={self.filled_qty}, status={self.status})"
+
+
+class OrderStateStore:
+    """Shadow order book indexed by id, symbol, side and status.
+    Terminal orders are kept for lookups until more than max_terminal_orders have accumulated, then evicted oldest first.
+    Exit legs of bracket, OTO and OCO orders are stored as orders of their own, linked to their parent."""
+
+    def __init__(self, max_terminal_orders: int = 5000):
+        self._max_terminal_orders = max_terminal_orders
+        self._orders = {}
+        self._by_symbol = defaultdict(set)
+        self._by_side = defaultdict(set)
+        self._by_status = defaultdict(set)
+        self._by_client_order_id = {}
+        self._live_by_symbol = defaultdict(set)
+        self._nr_live = 0
+        self._held_by_symbol = defaultdict(set)
+        self._nr_held = 0
+        self._terminal_ids = deque()
+
+    def __len__(self):
+        return len(self._orders)
+
+    def on_submitted(self, order: dict) -> OrderState:
+        """Record an order from a REST response. Does not roll back a status already reported by the stream."""
+        state = self._orders.get(order["id"])
+        status = ORDER_STATUS_TO_EVENT.get(order.get("status"), order.get("status", NEW)) if state is None or state.status == PENDING_NEW else state.status
+        return self._apply(order, status, None)
+
+    def on_trade_update(self, trade_update) -> OrderState:
+        return self._apply(trade_update.order, trade_update.event, trade_update)
+
+    def on_snapshot(self, order: dict) -> OrderState:
+        """Record an order from a REST listing taken to resync, its status overrides the local one unless that is terminal."""
+        return self._apply(order, ORDER_STATUS_TO_EVENT.get(order["status"], order["status"]), None)
+
+    def _apply(self, order: dict, status: str, trade_update) -> OrderState:
+        order_id = order["id"]
+        state = self._orders.get(order_id)
+        if state is None:
+            state = OrderState(order_id, order["symbol"], order["side"])
+            self._orders[order_id] = state
+            self._by_symbol[state.symbol].add(order_id)
+            self._by_side[state.side].add(order_id)
+            self._by_status[state.status].add(order_id)
+            self._live_by_symbol[state.symbol].add(order_id)
+            self._nr_live += 1
+        client_order_id = order.get("client_order_id")
+        if client_order_id is not None and client_order_id != state.client_order_id:
+            if state.client_order_id is not None:
+                self._by_client_order_id.pop(state.client_order_id, None)
+            state.client_order_id = client_order_id
+            self._by_client_order_id[client_order_id] = order_id
+        state.qty = float(order.get("qty") or state.qty)
+        state.filled_qty = float(order.get("filled_qty") or state.filled_qty)
+        if order.get("limit_price") is not None:
+            state.limit_price = float(order["limit_price"])
+        if order.get("filled_avg_price") is not None:
+            state.filled_avg_price = float(order["filled_avg_price"])
+        if trade_update is not None:
+            state.last_update = trade_update
+        if order.get("legs"):
+            self._link_legs(state, order)
+        if not state.is_live() and status not in TERMINAL_EVENTS:
+            # Terminal is final, a live status after it comes from a listing that raced the stream
+            status = state.status
+        if status != state.status:
+            was_live = state.is_live()
+            self._by_status[state.status].discard(order_id)
+            self._by_status[status].add(order_id)
+            if state.status == HELD:
+                self._held_by_symbol[state.symbol].discard(order_id)
+                self._nr_held -= 1
+            elif status == HELD:
+                self._held_by_symbol[state.symbol].add(order_id)
+                self._nr_held += 1
+            state.status = status
+            if was_live and not state.is_live():
+                self._live_by_symbol[state.symbol].discard(order_id)
+                self._nr_live -= 1
+                self._terminal_ids.append(order_id)
+                self._evict()
+        return state
+
+    def _link_legs(self, parent: OrderState, order: dict) -> None:
+        """Adopt the legs embedded in a parent order. A leg's embedded status applies unless the leg is already terminal
+        locally, since its own trade_updates can be newer than the parent message carrying it."""
+        parent.order_class = order.get("order_class") or parent.order_class
+        if parent.leg_ids is None:
+            parent.leg_ids = []
+        for leg in order["legs"]:
+            existing = self._orders.get(leg["id"])
+            status = ORDER_STATUS_TO_EVENT.get(leg["status"], leg["status"])
+            leg_state = self._apply(leg, existing.status if existing is not None and not existing.is_live() else status, None)
+            leg_state.order_class = parent.order_class
+            leg_state.parent_id = parent.order_id
+            if leg_state.order_id not in parent.leg_ids:
+                parent.leg_ids.append(leg_state.order_id)
+
+    def _evict(self) -> None:
+        while len(self._terminal_ids) > self._max_terminal_orders:
+            order_id = self._terminal_ids.popleft()
+            state = self._orders.get(order_id)
+            if state is None or state.is_live():
+                continue
+            del self._orders[order_id]
+            self._by_symbol[state.symbol].discard(order_id)
+            self._by_side[state.side].discard(order_id)
+            self._by_status[state.status].discard(order_id)
+            if state.client_order_id is not None:
+                self._by_client_order_id.pop(state.client_order_id, None)
+
+    def get_order(self, order_id: str) -> Optional[OrderState]:
+        return self._orders.get(order_id)
+
+    def get_order_by_client_order_id(self, client_order_id: str) -> Optional[OrderState]:
+        order_id = self._by_client_order_id.get(client_order_id)
+        return self._orders.get(order_id) if order_id is not None else None
+
+    def get_legs(self, order_id: str) -> list:
+        """Known exit legs of a bracket, OTO or OCO parent."""
+        state = self._orders.get(order_id)
+        if state is None or state.leg_ids is None:
+            return []
+        return [self._orders[leg_id] for leg_id in state.leg_ids if leg_id in self._orders]
+
+    def get_parent(self, order_id: str) -> Optional[OrderState]:
+        state = self._orders.get(order_id)
+        return self._orders.get(state.parent_id) if state is not None and state.parent_id is not None else None
+
+    def get_orders(self, symbol: Optional[str] = None, side: Optional[str] = None, status: Optional[str] = None) -> list:
+        """All known orders matching every given filter."""
+        candidates = [index[key] for index, key in ((self._by_symbol, symbol), (self._by_side, side), (self._by_status, status)) if key is not None]
+        if not candidates:
+            return list(self._orders.values())
+        candidates.sort(key=len)
+        smallest, others = candidates[0], candidates[1:]
+        return [self._orders[order_id] for order_id in smallest if all(order_id in other for other in others)]
+
+    def count_live(self, symbol: Optional[str] = None) -> int:
+        """Working orders. Held exit legs are left out, they cannot fill before their entry does."""
+        if symbol is None:
+            return self._nr_live - self._nr_held
+        live = self._live_by_symbol.get(symbol)
+        held = self._held_by_symbol.get(symbol)
+        return (len(live) if live is not None else 0) - (len(held) if held is not None else 0)
+
+    def get_live_orders(self, symbol: str, side: Optional[str] = None) -> list:
+        orders = (self._orders[order_id] for order_id in self._live_by_symbol.get(symbol, ()))
+        return [state for state in orders if side is None or state.side == side]
+
+
+class QuoteRecord:
+    """Lightweight quote with the attribute names of alpaca_trade_api's Quote entity. Timestamps are ns since epoch."""
+    __slots__ = ("symbol", "bid_price", "bid_size", "ask_price", "ask_size", "timestamp")
+
+    def __init__(self, symbol: str, bid_price: float, bid_size: float, ask_price: float, ask_size: float, timestamp: int):
+        self.symbol = symbol
+        self.bid_price = bid_price
+        self.bid_size = bid_size
+        self.ask_price = ask_price
+        self.ask_size = ask_size
+        self.timestamp = timestamp
+
+
+class TradeRecord:
+    """Lightweight trade with the attribute names of alpaca_trade_api's Trade entity."""
+    __slots__ = ("symbol", "price", "size", "timestamp")
+
+    def __init__(self, symbol: str, price: float, size: float, timestamp: int):
+        self.symbol = symbol
+        self.price = price
+        self.size = size
+        self.timestamp = timestamp
+
+
+class BarRecord:
+    """Lightweight bar with the attribute names of alpaca_trade_api's Bar entity."""
+    __slots__ = ("symbol", "open", "high", "low", "close", "volume", "timestamp")
+
+    def __init__(self, symbol: str, open: float, high: float, low: float, close: float, volume: float, timestamp: int):
+        self.symbol = symbol
+        self.open = open
+        self.high = high
+        self.low = low
+        self.close = close
+        self.volume = volume
+        self.timestamp = timestamp
+
+
+class TradeUpdateRecord:
+    """Lightweight trade_update with the attribute names of alpaca_trade_api's TradeUpdate entity."""
+    __slots__ = ("event", "order", "price", "qty", "position_qty", "timestamp")
+
+    def __init__(self, event: str, order: dict, price: Optional[float] = None, qty: Optional[float] = None,
+                 position_qty: Optional[float] = None, timestamp: Optional[int] = None):
+        self.event = event
+        self.order = order
+        self.price = price
+        self.qty = qty
+        self.position_qty = position_qty
+        self.timestamp = timestamp
+
+
+class MultiSymbolSubscription:
+    """Wake-up handle for one engine over many symbols. Collects the symbols updated, and those filled,
+    since the previous wait, so a burst on any number of symbols costs a single wake-up."""
+    __slots__ = ("symbols", "event", "dirty", "filled")
+
+    def __init__(self, symbols):
+        self.symbols: list = list(symbols)
+        self.event: asyncio.Event = asyncio.Event()
+        self.dirty: set = set()
+        self.filled: set = set()
+
+    def notify(self, symbol: str, fill: bool = False) -> None:
+        self.dirty.add(symbol)
+        if fill:
+            self.filled.add(symbol)
+        self.event.set()
+
+    async def wait(self) -> tuple:
+        """Wait for the next update. Returns (symbols updated, symbols with fills) since the previous wait."""
+        await self.event.wait()
+        self.event.clear()
+        dirty, filled = self.dirty, self.filled
+        self.dirty, self.filled = set(), set()
+        return dirty, filled
+
+
 class Credentials:
     key_id = None
     secret_key = None
@@ -65,13 +727,177 @@ class Credentials:
         return cls.headers
 
 
+class RequestScheduler:
+    """Token bucket shared by all REST calls. Requests that find the bucket empty are queued by priority
+    instead of failing, and the bucket is clamped by the broker's X-RateLimit-* headers and 429 responses."""
+
+    def __init__(self, rate_per_minute: int = 200, burst: int = 20):
+        # The configured rate is a ceiling, sharded workers each get their share of the account limit
+        self._max_rate = rate_per_minute / 60.0
+        self._rate = self._max_rate
+        self._capacity = float(burst)
+        self._tokens = float(burst)
+        self._last_refill = time.monotonic()
+        self._blocked_until = 0.0
+        self._waiters = []
+        self._sequence = itertools.count()
+        self._drain_task = None
+        self._nr_requests = 0
+        self._nr_queued = 0
+        self._nr_throttled = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self._capacity, self._tokens + (now - self._last_refill) * self._rate)
+        self._last_refill = now
+
+    async def acquire(self, priority: int = PRIORITY_NORMAL) -> None:
+        now = time.monotonic()
+        self._refill(now)
+        self._nr_requests += 1
+        if not self._waiters and now >= self._blocked_until and self._tokens >= 1:
+            self._tokens -= 1
+            return
+        self._nr_queued += 1
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._sequence), now, future))
+        if self._drain_task is None or self._drain_task.done():
+            self._drain_task = asyncio.create_task(self._drain(), name="RequestScheduler.drain")
+        await future
+
+    async def _drain(self) -> None:
+        while self._waiters:
+            now = time.monotonic()
+            self._refill(now)
+            if now < self._blocked_until:
+                await asyncio.sleep(self._blocked_until - now)
+                continue
+            if self._tokens < 1:
+                await asyncio.sleep((1 - self._tokens) / self._rate)
+                continue
+            _, _, enqueued_at, future = heapq.heappop(self._waiters)
+            if future.done():  # waiter was cancelled
+                continue
+            self._tokens -= 1
+            wait = now - enqueued_at
+            self._total_wait += wait
+            self._max_wait = max(self._max_wait, wait)
+            future.set_result(None)
+
+    def update_from_response(self, status: int, headers) -> None:
+        """Align the bucket with the broker's view of our remaining budget. X-RateLimit-Limit is account-wide,
+        so it can lower the rate but never raise it past the configured one."""
+        limit = headers.get("X-RateLimit-Limit")
+        remaining = headers.get("X-RateLimit-Remaining")
+        reset = headers.get("X-RateLimit-Reset")
+        if limit is not None:
+            self._rate = min(self._max_rate, int(limit) / 60.0)
+        if remaining is not None:
+            self._tokens = min(self._tokens, float(remaining))
+        if status == 429 or remaining == "0":
+            if status == 429:
+                self._nr_throttled += 1
+                order_logger.warning("Rate limited by broker (429), queueing requests until reset")
+            self._tokens = 0.0
+            delay = float(reset) - time.time() if reset is not None else 1.0 / self._rate
+            self._blocked_until = max(self._blocked_until, time.monotonic() + max(delay, 0.0))
+
+    def get_metrics(self) -> dict:
+        nr_waited = self._nr_queued - len(self._waiters)
+        return {
+            "queue_depth": len(self._waiters),
+            "requests": self._nr_requests,
+            "queued_requests": self._nr_queued,
+            "throttled_responses": self._nr_throttled,
+            "avg_wait_ms": self._total_wait / nr_waited * 1000 if nr_waited > 0 else 0.0,
+            "max_wait_ms": self._max_wait * 1000,
+            "tokens": self._tokens,
+        }
+
+
 class Client:
     session = None
+    scheduler = RequestScheduler()
+    # Same variables as the SDK, so its streams and spawned worker processes follow configure_endpoints
+    base_url = os.environ.get("APCA_API_BASE_URL", "https://paper-api.alpaca.markets")
+    data_url = os.environ.get("APCA_API_DATA_URL", "https://data.alpaca.markets")
+    data_stream_url = os.environ.get("APCA_API_STREAM_URL", "wss://stream.data.alpaca.markets")
+    connector_settings = {"limit": 100, "limit_per_host": 32, "ttl_dns_cache": 300, "keepalive_timeout": 75}
+    connect_timeout = 2.0
+    # Total timeout per request priority, order-critical calls fail fast
+    request_timeouts = {PRIORITY_HIGH: 5.0, PRIORITY_NORMAL: 5.0, PRIORITY_LOW: 15.0}
+
+    @classmethod
+    def configure_session(cls, limit: Optional[int] = None, limit_per_host: Optional[int] = None, ttl_dns_cache: Optional[int] = None,
+                          keepalive_timeout: Optional[float] = None, connect_timeout: Optional[float] = None, request_timeouts: Optional[dict] = None):
+        """Override connector and timeout settings. Takes effect on the next start_session."""
+        for key, value in (("limit", limit), ("limit_per_host", limit_per_host), ("ttl_dns_cache", ttl_dns_cache), ("keepalive_timeout", keepalive_timeout)):
+            if value is not None:
+                cls.connector_settings[key] = value
+        if connect_timeout is not None:
+            cls.connect_timeout = connect_timeout
+        if request_timeouts is not None:
+            cls.request_timeouts.update(request_timeouts)
+
+    @classmethod
+    def configure_endpoints(cls, base_url: Optional[str] = None, data_url: Optional[str] = None, data_stream_url: Optional[str] = None):
+        """Point the trading API, market data API and market data stream elsewhere, e.g. at broker_sim. Applies to
+        components created afterwards, and is exported to the APCA_API_* environment variables for worker processes."""
+        for attribute, variable, value in (("base_url", "APCA_API_BASE_URL", base_url), ("data_url", "APCA_API_DATA_URL", data_url),
+                                           ("data_stream_url", "APCA_API_STREAM_URL", data_stream_url)):
+            if value is not None:
+                setattr(cls, attribute, value.rstrip("/"))
+                os.environ[variable] = getattr(cls, attribute)
 
     @classmethod
     async def start_session(cls):
         if not cls.session:
-            cls.session = aiohttp.ClientSession(headers=Credentials.HEADERS())
+            connector = aiohttp.TCPConnector(use_dns_cache=True, **cls.connector_settings)
+            timeout = aiohttp.ClientTimeout(total=max(cls.request_timeouts.values()), connect=cls.connect_timeout)
+            cls.session = aiohttp.ClientSession(headers=Credentials.HEADERS(), connector=connector, timeout=timeout, json_serialize=_json_dumps)
+
+    @classmethod
+    async def warmup(cls, nr_connections: int = 4, base_url: Optional[str] = None):
+        """Open nr_connections keep-alive connections (DNS, TCP and TLS) before the first order needs them."""
+        await cls.start_session()
+        url = f"{base_url or cls.base_url}/v2/clock"
+
+        async def ping():
+            try:
+                async with cls.request("GET", url, priority=PRIORITY_LOW) as result:
+                    await result.read()
+            except Exception as e:
+                order_logger.warning("Error warming up connection: %s", e)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(ping() for _ in range(nr_connections)))
+        order_logger.info("Warmed up %s connections in %.1f ms", nr_connections, (time.perf_counter() - started) * 1000)
+
+    @classmethod
+    def configure_rate_limit(cls, rate_per_minute: int = 200, burst: int = 20):
+        cls.scheduler = RequestScheduler(rate_per_minute=rate_per_minute, burst=burst)
+
+    @classmethod
+    @asynccontextmanager
+    async def request(cls, method: str, url: str, priority: int = PRIORITY_NORMAL, max_retries: int = 3, **kwargs):
+        """Rate-limited session.request. A 429 response is retried after the scheduler's backoff, up to max_retries times."""
+        if cls.session is None:
+            await cls.start_session()
+        kwargs.setdefault("timeout", aiohttp.ClientTimeout(total=cls.request_timeouts[priority], connect=cls.connect_timeout))
+        started_ns = time.monotonic_ns()
+        for attempt in range(max_retries + 1):
+            await cls.scheduler.acquire(priority)
+            dispatched_ns = time.monotonic_ns()
+            SystemMonitoring.record_latency(STAGE_REST_SEND, dispatched_ns - started_ns)
+            async with cls.session.request(method, url, **kwargs) as result:
+                started_ns = time.monotonic_ns()
+                SystemMonitoring.record_latency(STAGE_REST_RESPONSE, started_ns - dispatched_ns)
+                cls.scheduler.update_from_response(result.status, result.headers)
+                if result.status == 429 and attempt < max_retries:
+                    continue
+                yield result
+                return
 
     @classmethod
     async def close_session(cls):
@@ -79,78 +905,582 @@ class Client:
             await cls.session.close()
             cls.session = None
 
+class RawMarketDataStream:
+    """Market data websocket client that decodes frames straight into QuoteRecord, TradeRecord and BarRecord and
+    calls each batch handler once per frame with all the records of its kind, instead of building an SDK entity
+    and awaiting a handler per message. Frames are msgpack (timestamps decoded as ns) or JSON. One connection per
+    _run_forever call: it returns when the server closes and raises on errors, DataClient's supervisor reconnects.
+    use_msgpack defaults to msgpack only when its C extension is installed (see MSGPACK_ACCELERATED)."""
+
+    def __init__(self, key_id: str, secret_key: str, url: str, symbols, on_quotes=None, on_trades=None, on_bars=None,
+                 use_msgpack: Optional[bool] = None, heartbeat: float = 10.0):
+        self._key_id = key_id
+        self._secret_key = secret_key
+        self._url = url
+        self._symbols = sorted(symbols)
+        self._on_quotes = on_quotes
+        self._on_trades = on_trades
+        self._on_bars = on_bars
+        self._use_msgpack = use_msgpack if use_msgpack is not None else MSGPACK_ACCELERATED
+        self._heartbeat = heartbeat
+        self._ws = None
+        self._should_run = True
+        self._nr_frames = 0
+        self._nr_messages = 0
+
+    def get_counts(self) -> tuple:
+        """(frames, messages) received so far."""
+        return self._nr_frames, self._nr_messages
+
+    def _decode(self, message: aiohttp.WSMessage) -> list:
+        if message.type == aiohttp.WSMsgType.BINARY:
+            return msgpack.unpackb(message.data, timestamp=2)
+        return _json_loads(message.data)
+
+    async def _send(self, ws: aiohttp.ClientWebSocketResponse, payload: dict) -> None:
+        if self._use_msgpack:
+            await ws.send_bytes(msgpack.packb(payload))
+        else:
+            await ws.send_str(_json_dumps(payload))
+
+    async def _expect(self, ws: aiohttp.ClientWebSocketResponse, expected: str) -> None:
+        message = await ws.receive(timeout=10)
+        if message.type not in (aiohttp.WSMsgType.BINARY, aiohttp.WSMsgType.TEXT):
+            raise ConnectionError(f"Stream closed while waiting for {expected}: {message.type.name}")
+        reply = self._decode(message)[0]
+        if reply.get("T") != "success" or reply.get("msg") != expected:
+            raise ConnectionError(f"Stream did not confirm {expected}: {reply}")
+
+    async def _run_forever(self) -> None:
+        headers = {"Content-Type": "application/msgpack"} if self._use_msgpack else None
+        async with aiohttp.ClientSession() as session:
+            async with session.ws_connect(self._url, headers=headers, heartbeat=self._heartbeat, max_msg_size=0) as ws:
+                self._ws = ws
+                if not self._should_run:
+                    return
+                await self._expect(ws, "connected")
+                await self._send(ws, {"action": "auth", "key": self._key_id, "secret": self._secret_key})
+                await self._expect(ws, "authenticated")
+                subscription = {"action": "subscribe"}
+                for kind, handler in (("trades", self._on_trades), ("quotes", self._on_quotes), ("bars", self._on_bars)):
+                    if handler is not None:
+                        subscription[kind] = self._symbols
+                await self._send(ws, subscription)
+                data_logger.info("Raw data stream connected to %s", self._url)
+                await self._consume(ws)
+        self._ws = None
+
+    async def _consume(self, ws: aiohttp.ClientWebSocketResponse) -> None:
+        timestamp = rfc3339_ns if not self._use_msgpack else int
+        async for message in ws:
+            if message.type not in (aiohttp.WSMsgType.BINARY, aiohttp.WSMsgType.TEXT):
+                break
+            items = self._decode(message)
+            self._nr_frames += 1
+            self._nr_messages += len(items)
+            quotes, trades, bars = [], [], []
+            for item in items:
+                kind = item["T"]
+                if kind == "q":
+                    quotes.append(QuoteRecord(item["S"], item["bp"], item["bs"], item["ap"], item["as"], timestamp(item["t"])))
+                elif kind == "t":
+                    trades.append(TradeRecord(item["S"], item["p"], item["s"], timestamp(item["t"])))
+                elif kind == "b":
+                    bars.append(BarRecord(item["S"], item["o"], item["h"], item["l"], item["c"], item["v"], timestamp(item["t"])))
+                elif kind == "subscription":
+                    data_logger.info("Raw data stream subscribed: trades %s, quotes %s, bars %s",
+                                     len(item.get("trades", ())), len(item.get("quotes", ())), len(item.get("bars", ())))
+                elif kind == "error":
+                    raise ConnectionError(f"Stream error {item.get('code')}: {item.get('msg')}")
+            if trades:
+                await self._on_trades(trades)
+            if quotes:
+                await self._on_quotes(quotes)
+            if bars:
+                await self._on_bars(bars)
+        if ws.exception() is not None:
+            raise ws.exception()
+
+    async def stop_ws(self) -> None:
+        self._should_run = False
+        if self._ws is not None:
+            await self._ws.close()
+
+
+class StreamGroup:
+    """Runs several streams as one for DataClient's supervisor: the task ends as soon as any of them ends."""
+
+    def __init__(self, *streams):
+        self._streams = streams
+
+    async def _run_forever(self) -> None:
+        tasks = [asyncio.create_task(stream._run_forever(), name=f"{type(stream).__name__}._run_forever") for stream in self._streams]
+        try:
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                task.result()
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def stop_ws(self) -> None:
+        await asyncio.gather(*(stream.stop_ws() for stream in self._streams))
+
+
 class DataClient(): 
-    def __init__(self, max_nr_trade_history: int = 100, max_nr_bar_history: int = 100, symbols : Optional[Set[str]] = None):   
+    def __init__(self, max_nr_trade_history: int = 10000, max_nr_bar_history: int = 10000, symbols : Optional[Set[str]] = None,
+                 order_store: Optional[OrderStateStore] = None, shared_table: Optional["SharedPositionTable"] = None,
+                 reconcile_interval: float = 300.0, risk_manager: Optional["RiskManager"] = None, recorder=None,
+                 stale_after: float = 30.0, stream_timeout: float = 60.0, reconnect_delay: float = 1.0, max_reconnect_delay: float = 60.0,
+                 raw_stream: bool = False, base_url: Optional[str] = None):   
         self._max_trade_history = max_nr_trade_history
         self._max_bar_history = max_nr_bar_history
         self._symbols = symbols if symbols is not None else set()
-        self._base_url = URL('https://paper-api.alpaca.markets')
+        self._base_url = base_url or Client.base_url
         self._data_feed = "iex"
         self._last_trade_price = {}
-        #self._trade_tick_hist = defaultdict(deque)
-        self._trade_tick_hist = defaultdict(lambda: deque(maxlen=self._max_trade_history))
+        self._trade_tick_hist = defaultdict(lambda: RingBuffer(TRADE_HIST_DTYPE, self._max_trade_history))
         #self._last_quote = defaultdict(deque) ## TODO: modify it to self._last_quote = {}
         self._last_quote = {}
         self._last_mid_price = {}
         self._last_bar = {}
-        #self._bar_hist = defaultdict(deque)
-        self._bar_hist = defaultdict(lambda: deque(maxlen=self._max_bar_history))
-        self._trade_update = defaultdict(dict)
-        self._position_manager = PositionManager()
+        self._bar_hist = defaultdict(lambda: RingBuffer(BAR_HIST_DTYPE, self._max_bar_history))
+        self._order_store = order_store if order_store is not None else OrderStateStore()
+        self._signals = SignalEngine()
+        self._position_manager = PositionManager(base_url=self._base_url)
+        self._subscriptions = defaultdict(list)
+        self._nr_notifications = 0
+        self._shared_table = shared_table
+        self._reconcile_interval = reconcile_interval
+        self._risk_manager = risk_manager
+        self._last_quote_received_ns = {}
+        self._last_fill_received_ns = {}
+        # Optional tickstore.TickRecorder, every handled event is also queued to it for writing to disk
+        self._recorder = recorder
+        # Stream supervision: a symbol without a quote for stale_after seconds is stale, a stream without any
+        # message for stream_timeout seconds is restarted with exponential backoff
+        self._data_url = Client.data_url
+        self._stale_after_ns = int(stale_after * 1_000_000_000)
+        self._stream_timeout_ns = int(stream_timeout * 1_000_000_000)
+        self._stream_check_interval = 1.0
+        self._reconnect_delay = reconnect_delay
+        self._max_reconnect_delay = max_reconnect_delay
+        self._stream = None
+        self._supervising = False
+        self._last_message_ns = 0
+        self._stale_symbols = set()
+        self._needs_resync = False
+        self._resyncing = False
+        self._resync_task = None
+        self._disconnected_ns = None
+        self._resync_callbacks = []
+        # Readiness gate: set once every symbol has had its first quote
+        self._symbols_without_quote = set(self._symbols)
+        self._ready = asyncio.Event()
+        if not self._symbols_without_quote:
+            self._ready.set()
+        self._stream_class = None
+        # Market data over RawMarketDataStream instead of the SDK's entity objects, trade_updates stay on the SDK
+        self._raw_stream = raw_stream
+        self._stream_url = Client.data_stream_url
+        self._trading_stream_class = None
+        # Cleared by pause() outside trading hours, the stream and the reconciliation task wait on it
+        self._stream_enabled = asyncio.Event()
+        self._stream_enabled.set()
+        self._reconcile_task = None
                       
     async def start(self):
-        self._position_manager = await PositionManager.create()
-        stream = Stream(Credentials.KEY_ID(), Credentials.SECRET_KEY(), base_url=self._base_url, data_feed=self._data_feed)
+        if self._recorder is not None:
+            self._recorder.start()
+        # The positions snapshot and the stream connection run concurrently, fills arriving before the
+        # snapshot returns are applied to the same PositionManager and then overwritten by the broker's view
+        await asyncio.gather(self._load_positions(), self._run_stream())
+
+    async def _load_positions(self) -> None:
+        await self._position_manager.get_positions()
+        if self._risk_manager is not None:
+            for symbol, position_info in self._position_manager._positions_by_symbol.items():
+                self._risk_manager.update_position(symbol, position_info["position"])
+        if self._stream_enabled.is_set() and self._reconcile_task is None:
+            self._reconcile_task = asyncio.create_task(self._position_manager.run_reconciliation(self._reconcile_interval, self._push_positions),
+                                                       name="PositionManager.run_reconciliation")
+
+    def pause(self) -> None:
+        """Disconnect the stream and stop position reconciliation, e.g. while the market is closed. Every symbol reads
+        as stale until resume() has reconnected and resynced."""
+        if not self._stream_enabled.is_set():
+            return
+        self._stream_enabled.clear()
+        self._needs_resync = True
+        self._resyncing = True
+        if self._reconcile_task is not None:
+            self._reconcile_task.cancel()
+            self._reconcile_task = None
+        for symbol in self._symbols:
+            self._notify(symbol)
+
+    def resume(self) -> None:
+        """Reconnect the stream and restart reconciliation. The first message on the new connection triggers a resync."""
+        if self._stream_enabled.is_set():
+            return
+        self._stream_enabled.set()
+        if self._reconcile_task is None:
+            self._reconcile_task = asyncio.create_task(self._position_manager.run_reconciliation(self._reconcile_interval, self._push_positions),
+                                                       name="PositionManager.run_reconciliation")
+
+    def is_paused(self) -> bool:
+        return not self._stream_enabled.is_set()
+
+    async def wait_ready(self, timeout: Optional[float] = None) -> bool:
+        """Wait until every symbol has received its first quote. Returns False if timeout expired first."""
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            data_logger.warning("No quote yet for %s after %.1fs", sorted(self._symbols_without_quote), timeout)
+            return False
+
+    def _create_stream(self) -> "Stream":
+        if self._raw_stream:
+            data_stream = RawMarketDataStream(Credentials.KEY_ID(), Credentials.SECRET_KEY(), f"{self._stream_url}/v2/{self._data_feed}",
+                                              self._symbols, on_quotes=self.on_quotes, on_trades=self.on_trades, on_bars=self.on_bars)
+            trading_stream = self._trading_stream_class(Credentials.KEY_ID(), Credentials.SECRET_KEY(), self._base_url)
+            trading_stream.subscribe_trade_updates(self.on_trade_update)
+            return StreamGroup(data_stream, trading_stream)
+        stream = self._stream_class(Credentials.KEY_ID(), Credentials.SECRET_KEY(), base_url=self._base_url, data_stream_url=self._stream_url,
+                                    data_feed=self._data_feed)
         stream.subscribe_trades(self.on_trade, *self._symbols)
         stream.subscribe_quotes(self.on_quote, *self._symbols)
         stream.subscribe_bars(self.on_bar, *self._symbols)
         stream.subscribe_trade_updates(self.on_trade_update) 
-        if asyncio.get_event_loop().is_running():
-            await stream._run_forever()
-        else:
-            await stream.run()
+        return stream
+
+    async def _run_stream(self) -> None:
+        """Run the stream under supervision. When its task dies or it goes silent for stream_timeout, every symbol is
+        marked stale, the stream is torn down and a fresh one started after an exponential backoff. The first message
+        on the new connection triggers a resync before strategies may quote again."""
+        self._supervising = True
+        if self._stream_class is None:
+            # Import in a worker thread so REST warmup and snapshots proceed meanwhile
+            stream_module = await asyncio.to_thread(importlib.import_module, "alpaca_trade_api.stream")
+            self._stream_class = stream_module.Stream
+            self._trading_stream_class = stream_module.TradingStream
+        delay = self._reconnect_delay
+        while True:
+            if not self._stream_enabled.is_set():
+                await self._stream_enabled.wait()
+                data_logger.info("Stream resumed")
+                self._needs_resync = True
+                delay = self._reconnect_delay
+            connected_ns = self._last_message_ns = time.monotonic_ns()
+            self._stream = self._create_stream()
+            task = asyncio.create_task(self._stream._run_forever(), name=f"{type(self._stream).__name__}._run_forever")
+            reason = await self._watch_stream(task)
+            if not self._stream_enabled.is_set():
+                # Paused on purpose: no recovery to measure, the resync runs on the first message after resume()
+                await self._stop_stream(task)
+                self._disconnected_ns = None
+                data_logger.info("Stream paused")
+                continue
+            now = time.monotonic_ns()
+            if self._disconnected_ns is None:
+                self._disconnected_ns = self._last_message_ns  # recovery time counts from the last data received
+            self._needs_resync = True
+            self._resyncing = True
+            for symbol in self._symbols:
+                self._notify(symbol)
+            await self._stop_stream(task)
+            if now - connected_ns > self._max_reconnect_delay * 1_000_000_000:
+                delay = self._reconnect_delay  # the connection was healthy for a while, start the backoff over
+            data_logger.warning("Stream %s, reconnecting in %.1fs", reason, delay)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self._max_reconnect_delay)
+
+    async def _watch_stream(self, task: asyncio.Task) -> str:
+        """Wait until the stream task ends or the stream goes silent, marking quiet symbols stale meanwhile. Returns the reason."""
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=self._stream_check_interval)
+            if not self._stream_enabled.is_set():
+                return "paused"
+            if done:
+                exception = None if task.cancelled() else task.exception()
+                return f"failed: {exception}" if exception is not None else "closed"
+            now = time.monotonic_ns()
+            self._mark_stale_symbols(now)
+            if now - self._last_message_ns > self._stream_timeout_ns:
+                return f"silent for {(now - self._last_message_ns) / 1_000_000_000:.0f}s"
+
+    async def _stop_stream(self, task: asyncio.Task) -> None:
+        if task.done():
+            return
+        try:
+            await asyncio.wait_for(self._stream.stop_ws(), timeout=5)
+            # The SDK polls its stop signal between 5 s receive timeouts and closes the websockets itself
+            await asyncio.wait_for(asyncio.shield(task), timeout=10)
+        except Exception as e:
+            data_logger.warning("Stream did not stop cleanly: %s", e)
+        if not task.done():
+            task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    def _mark_stale_symbols(self, now: int) -> None:
+        for symbol in self._symbols:
+            if symbol not in self._stale_symbols:
+                received_ns = self._last_quote_received_ns.get(symbol)
+                if received_ns is None or now - received_ns > self._stale_after_ns:
+                    self._stale_symbols.add(symbol)
+                    self._notify(symbol)  # wake strategies so they pull their quotes
+
+    def _on_message(self, received_ns: int) -> None:
+        """Stream heartbeat. The first message after a reconnect, or after a silence longer than stale_after (the SDK
+        also reconnects internally, without telling us), starts a resync."""
+        if (self._needs_resync or received_ns - self._last_message_ns > self._stale_after_ns) and self._resync_task is None \
+                and self._stream_enabled.is_set():
+            self._needs_resync = False
+            self._resyncing = True
+            if self._disconnected_ns is None:
+                self._disconnected_ns = self._last_message_ns
+            self._resync_task = asyncio.create_task(self._resync(), name="DataClient._resync")
+        self._last_message_ns = received_ns
+
+    async def _resync(self) -> None:
+        """Refresh positions, last quotes and, through the registered callbacks, open orders over REST in parallel,
+        then wake every strategy so it can quote again."""
+        started_ns = time.monotonic_ns()
+        try:
+            results = await asyncio.gather(self._position_manager.reconcile(), self._refresh_latest_quotes(),
+                                           *(callback() for callback in self._resync_callbacks), return_exceptions=True)
+            for result in results:
+                if isinstance(result, Exception):
+                    data_logger.warning("Resync step failed: %s", result)
+            self._push_positions()
+        finally:
+            # A disconnect during the resync needs another one once the new connection delivers data
+            self._resyncing = self._needs_resync
+            self._resync_task = None
+        finished_ns = time.monotonic_ns()
+        disconnected_ns = self._disconnected_ns if self._disconnected_ns is not None else started_ns
+        self._disconnected_ns = None
+        SystemMonitoring.record_latency(STAGE_STREAM_RECOVERY, finished_ns - disconnected_ns)
+        data_logger.warning("Resynced after stream gap: recovered in %.1f ms, resync took %.1f ms",
+                            (finished_ns - disconnected_ns) / 1e6, (finished_ns - started_ns) / 1e6)
+        for symbol in self._symbols:
+            self._notify(symbol)
+
+    async def _refresh_latest_quotes(self) -> None:
+        """Latest quote of every symbol in one request to the market data API."""
+        if not self._symbols:
+            return
+        params = {"symbols": ",".join(sorted(self._symbols)), "feed": self._data_feed}
+        async with Client.request("GET", f"{self._data_url}/v2/stocks/quotes/latest", priority=PRIORITY_HIGH, params=params) as result:
+            response_body = await result.read()
+            if result.status != 200:
+                data_logger.warning("Failed to get latest quotes (Status %s): %s", result.status, response_body.decode())
+                return
+        received_ns = time.monotonic_ns()
+        for symbol, quote in _json_loads(response_body).get("quotes", {}).items():
+            if not quote.get("ap") or not quote.get("bp"):
+                continue
+            self._last_quote[symbol] = QuoteRecord(symbol, quote["bp"], quote.get("bs", 0), quote["ap"], quote.get("as", 0),
+                                                   timestamp_ns(datetime.fromisoformat(quote["t"])))
+            self._last_quote_received_ns[symbol] = received_ns
+            self._stale_symbols.discard(symbol)
+            self._set_mid_price(symbol, round((quote["ap"] + quote["bp"]) * 0.5, 2))
+
+    def register_resync_callback(self, callback) -> None:
+        """Await callback() as part of every resync after a stream gap, e.g. OrderManager.sync_open_orders."""
+        self._resync_callbacks.append(callback)
+
+    def is_stale(self, symbol: str) -> bool:
+        """True when no quote for symbol arrived within stale_after, or while resyncing after a stream gap.
+        Strategies must not quote a stale symbol."""
+        if self._resyncing:
+            return True
+        received_ns = self._last_quote_received_ns.get(symbol)
+        return received_ns is None or time.monotonic_ns() - received_ns > self._stale_after_ns
+
+    def get_data_age(self, symbol: str) -> Optional[float]:
+        """Seconds since the last quote for symbol arrived."""
+        received_ns = self._last_quote_received_ns.get(symbol)
+        return (time.monotonic_ns() - received_ns) / 1e9 if received_ns is not None else None
     
     async def on_trade(self,trade_tick ) -> None:    
+        if self._supervising:
+            self._on_message(time.monotonic_ns())
+        self._handle_trade(trade_tick)
+
+    async def on_trades(self, trades: list) -> None:
+        """Batch form of on_trade, called by RawMarketDataStream once per frame."""
+        if self._supervising:
+            self._on_message(time.monotonic_ns())
+        for trade_tick in trades:
+            self._handle_trade(trade_tick)
+
+    def _handle_trade(self, trade_tick) -> None:
         symbol = trade_tick.symbol
         self._last_trade_price[symbol] = trade_tick.price
-        _trade_hist_to_update = self._trade_tick_hist[symbol]
-        _trade_hist_to_update.append(trade_tick)
-        #while len(_trade_hist_to_update) > self._max_trade_history:
-        #    _trade_hist_to_update.popleft()
+        self._trade_tick_hist[symbol].append((timestamp_ns(trade_tick.timestamp), trade_tick.price, trade_tick.size))
+        self._signals.on_trade(symbol, trade_tick.price, trade_tick.size)
+        if self._recorder is not None:
+            self._recorder.record_trade(trade_tick)
         #logging.info(trade_tick)
 
     def get_last_trade_price(self, symbol : str) ->  Optional[float]:
         return self._last_trade_price.get(symbol, None)
+
+    def get_trade_hist(self, symbol: str, n: Optional[int] = None) -> Optional[np.ndarray]:
+        """Latest n trades (timestamp, price, size) as a zero-copy structured array view, oldest first."""
+        hist = self._trade_tick_hist.get(symbol, None)
+        return hist.view(n) if hist is not None else None
                                                   
     async def on_quote(self, quote) -> None:
+        received_ns = time.monotonic_ns()
+        if self._supervising:
+            self._on_message(received_ns)
+        self._handle_quote(quote, received_ns)
+
+    async def on_quotes(self, quotes: list) -> None:
+        """Batch form of on_quote, called by RawMarketDataStream once per frame."""
+        received_ns = time.monotonic_ns()
+        if self._supervising:
+            self._on_message(received_ns)
+        for quote in quotes:
+            self._handle_quote(quote, received_ns)
+
+    def _handle_quote(self, quote, received_ns: int) -> None:
         symbol = quote.symbol
+        SystemMonitoring.record_latency(STAGE_STREAM_RECEIVE, time.time_ns() - timestamp_ns(quote.timestamp))
+        self._last_quote_received_ns[symbol] = received_ns
         self._last_quote[symbol] = quote
+        if self._recorder is not None:
+            self._recorder.record_quote(quote)
         if quote.ask_price != 0 and quote.bid_price != 0:
-            midprice = round((quote.ask_price + quote.bid_price) * 0.5 , 2)
-            self._last_mid_price[symbol] = midprice
+            self._signals.on_quote(symbol, quote.bid_price, quote.bid_size, quote.ask_price, quote.ask_size)
+            self._set_mid_price(symbol, round((quote.ask_price + quote.bid_price) * 0.5 , 2))
         else: 
             pass        
+        if symbol in self._stale_symbols:
+            self._stale_symbols.discard(symbol)
+            self._notify(symbol)
+        if self._symbols_without_quote:
+            self._symbols_without_quote.discard(symbol)
+            if not self._symbols_without_quote:
+                self._ready.set()
+        SystemMonitoring.record_latency(STAGE_QUOTE_HANDLER, time.monotonic_ns() - received_ns)
         #logging.info(quote)
       
+    def _set_mid_price(self, symbol: str, midprice: float) -> None:
+        if self._last_mid_price.get(symbol) != midprice:
+            self._last_mid_price[symbol] = midprice
+            self._notify(symbol)
+            if self._shared_table is not None:
+                self._shared_table.publish_mid(symbol, midprice)
+            if self._risk_manager is not None:
+                self._risk_manager.update_mid(symbol, midprice)
+
+    def subscribe(self, symbol: str) -> QuoteSubscription:
+        """Register a strategy for mid price changes and fills on symbol."""
+        subscription = QuoteSubscription(symbol)
+        self._subscriptions[symbol].append(subscription)
+        return subscription
+
+    def subscribe_many(self, symbols) -> MultiSymbolSubscription:
+        """Register one engine for mid price changes and fills on all of symbols."""
+        subscription = MultiSymbolSubscription(symbols)
+        for symbol in subscription.symbols:
+            self._subscriptions[symbol].append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription) -> None:
+        symbols = subscription.symbols if isinstance(subscription, MultiSymbolSubscription) else [subscription.symbol]
+        for symbol in symbols:
+            subscriptions = self._subscriptions.get(symbol, [])
+            if subscription in subscriptions:
+                subscriptions.remove(subscription)
+
+    def _notify(self, symbol: str, fill: bool = False) -> None:
+        for subscription in self._subscriptions.get(symbol, ()):
+            subscription.notify(symbol, fill)
+            self._nr_notifications += 1
+
+    def get_notification_count(self) -> int:
+        """Number of strategy wake-ups issued so far, lets a replay driver skip yielding when nobody was woken."""
+        return self._nr_notifications
+
+    def get_last_quote_received_ns(self, symbol: str) -> Optional[int]:
+        """Monotonic time the last quote for symbol reached on_quote."""
+        return self._last_quote_received_ns.get(symbol, None)
+
+    def get_last_fill_received_ns(self, symbol: str) -> Optional[int]:
+        """Monotonic time the last fill or partial fill for symbol reached on_trade_update."""
+        return self._last_fill_received_ns.get(symbol, None)
+
     def get_last_mid_price(self, symbol : str) ->  Optional[float]:
         return self._last_mid_price.get(symbol, None)
     
     def get_last_quote(self, symbol : str) -> Optional[dict]:
         return self._last_quote.get(symbol, None) 
 
+    def get_signals(self, symbol: str) -> SymbolSignals:
+        """Current vwap, volatility, imbalance and trade_flow for symbol."""
+        return self._signals.get(symbol)
+
     async def on_bar(self, bar) -> None:
+        if self._supervising:
+            self._on_message(time.monotonic_ns())
+        self._handle_bar(bar)
+
+    async def on_bars(self, bars: list) -> None:
+        """Batch form of on_bar, called by RawMarketDataStream once per frame."""
+        if self._supervising:
+            self._on_message(time.monotonic_ns())
+        for bar in bars:
+            self._handle_bar(bar)
+
+    def _handle_bar(self, bar) -> None:
         symbol = bar.symbol
         self._last_bar[symbol] = bar
-        _bar_hist_to_update = self._bar_hist[symbol]
-        _bar_hist_to_update.append(bar)
+        self._bar_hist[symbol].append((timestamp_ns(bar.timestamp), bar.open, bar.high, bar.low, bar.close, bar.volume))
+        if self._recorder is not None:
+            self._recorder.record_bar(bar)
     
     def get_last_bar(self, symbol):
         return self._last_bar.get(symbol, None)
     
-    def get_bar_hist(self, symbol):
-        return self._bar_hist.get(symbol, None)
+    def get_bar_hist(self, symbol, n: Optional[int] = None) -> Optional[np.ndarray]:
+        """Latest n bars (timestamp, open, high, low, close, volume) as a zero-copy structured array view, oldest first."""
+        hist = self._bar_hist.get(symbol, None)
+        return hist.view(n) if hist is not None else None
+
+    def warmup_from_history(self, history: "HistoricalDataClient", before: Optional[int] = None, nr_quotes: int = 1000) -> None:
+        """Refill the trade and bar histories and the signal state from recorded data (tickstore) so a restart
+        does not start from empty buffers. Mid prices are left unset, strategies still wait for a live quote."""
+        for symbol in self._symbols:
+            bars = history.get_last_bars(symbol, self._max_bar_history, before)
+            bar_hist = self._bar_hist[symbol]
+            for record in bars.tolist():
+                bar_hist.append(record)
+            trades = history.get_last_trades(symbol, self._max_trade_history, before)
+            quotes = history.get_last_quotes(symbol, nr_quotes, before)
+            trade_hist = self._trade_tick_hist[symbol]
+            # Interleave by timestamp so trade signs are classified against the mid prevailing at the time
+            events = [(record[0], 1, record) for record in trades.tolist()] + [(record[0], 0, record) for record in quotes.tolist()]
+            events.sort(key=lambda event: (event[0], event[1]))
+            for _, is_trade, record in events:
+                if is_trade:
+                    trade_hist.append(record)
+                    self._signals.on_trade(symbol, record[1], record[2])
+                else:
+                    self._signals.on_quote(symbol, record[1], record[2], record[3], record[4])
+            if len(trades):
+                self._last_trade_price[symbol] = float(trades["price"][-1])
+            data_logger.info("Warmed up %s from history with %s bars, %s trades and %s quotes", symbol, len(bars), len(trades), len(quotes))
 
     async def on_trade_update(self, trade_update) -> None:
+        received_ns = time.monotonic_ns()
+        if self._supervising:
+            self._on_message(received_ns)
         symbol = trade_update.order["symbol"]
         id = trade_update.order["id"]      
         filled_qty = trade_update.order["filled_qty"]
@@ -158,25 +1488,67 @@ class DataClient():
         #logging.info(f"Symbol: {symbol}, ID: {id}, Type of _trade_update[symbol]: {type(self._trade_update[symbol])}")  
         if trade_update.event in FILL_EVENT:   ## TODO order status update : fill, cancel, rejected 
             #print(f"update position for {symbol}")
-            position_qty = float(trade_update.position_qty) 
-            await self._position_manager.update_position(symbol, position_qty)
-        self._trade_update[symbol][id] = trade_update
+            position_qty = float(trade_update.position_qty) if trade_update.position_qty is not None else None
+            position_object = self._position_manager.apply_fill(symbol, side, float(trade_update.qty), float(trade_update.price), position_qty)
+            if self._risk_manager is not None:
+                self._risk_manager.update_position(symbol, position_object["qty"])
+        order_state = self._order_store.on_trade_update(trade_update)
+        if self._recorder is not None:
+            self._recorder.record_trade_update(trade_update)
+        if order_state.acknowledged_ns is not None:
+            SystemMonitoring.record_latency(STAGE_TRADE_UPDATE_ECHO, received_ns - order_state.acknowledged_ns)
+            order_state.acknowledged_ns = None
         #logging.info(trade_update)
         if (trade_update.event == PARTIAL_FILL):
-            logging.info(f"PARTIAL FILL: {side} order for {symbol}, filled {filled_qty}.")
+            data_logger.info("PARTIAL FILL: %s order for %s, filled %s.", side, symbol, filled_qty)
         if (trade_update.event == FILL):
-            logging.info(f"FILL: {side} order for {symbol}, filled {filled_qty}.")
+            data_logger.info("FILL: %s order for %s, filled %s.", side, symbol, filled_qty)
+        if self._shared_table is not None:
+            self._publish_position(symbol)
+        if trade_update.event in FILL_EVENT:
+            self._last_fill_received_ns[symbol] = received_ns
+            self._notify(symbol, fill=True)
 
 
     #def get_trade_update(self, symbol : str, id :str):
     #        return self._trade_update.get(symbol, None)
         
+    async def reconcile_positions(self) -> dict:
+        """Reconcile the PositionManager against the broker now and push the result, see PositionManager.reconcile."""
+        drift = await self._position_manager.reconcile()
+        self._push_positions()
+        return drift
+
+    def _push_positions(self) -> None:
+        """Hand the PositionManager's book to the RiskManager and the shared position table after a reconciliation."""
+        for symbol, position_info in self._position_manager._positions_by_symbol.items():
+            if self._risk_manager is not None:
+                self._risk_manager.update_position(symbol, position_info["position"])
+            if self._shared_table is not None and symbol in self._symbols:
+                self._publish_position(symbol)
+
+    def _publish_position(self, symbol: str) -> None:
+        position_object = self._position_manager._position_objects_by_symbol.get(symbol) or {}
+        self._shared_table.publish_position(symbol, self.get_position_by_symbol(symbol), float(position_object.get("avg_entry_price") or 0.0),
+                                            len(self._order_store.get_live_orders(symbol)))
+
     def get_trade_update(self, symbol: str, id: str = None):
-        symbol_trades = self._trade_update.get(symbol, {})
         if id is None:
-            return symbol_trades  # Return all trade updates for the symbol
+            return {state.order_id: state.last_update for state in self._order_store.get_orders(symbol=symbol)}  # Return all trade updates for the symbol
         else:
-            return symbol_trades.get(id)  # Return a specific trade update for the id
+            state = self._order_store.get_order(id)
+            return state.last_update if state is not None and state.symbol == symbol else None  # Return a specific trade update for the id
+
+    def get_order_store(self) -> OrderStateStore:
+        return self._order_store
+
+    def count_live(self, symbol: Optional[str] = None) -> int:
+        """Working orders on symbol (all symbols if None) from the local order store, no REST call."""
+        return self._order_store.count_live(symbol)
+
+    def get_live_orders(self, symbol: str, side: Optional[str] = None) -> list:
+        """Live orders on symbol from the local order store, no REST call."""
+        return self._order_store.get_live_orders(symbol, side)
 
     
     def get_position_by_symbol(self, symbol) -> float:
@@ -186,12 +1558,21 @@ class DataClient():
         else:
             return 0.0  # Return 0.0 if the symbol is not found
         
+    def get_position_manager(self):
+        return self._position_manager
+
     def get_all_positions(self) -> dict:
         return self._position_manager._positions_by_symbol
     
+    def get_pnl(self, symbol) -> tuple:
+        """(realized, unrealized) PnL for symbol, unrealized marked at the last mid."""
+        mid_price = self.get_last_mid_price(symbol)
+        unrealized = self._position_manager.get_unrealized_pnl(symbol, mid_price) if mid_price is not None else 0.0
+        return self._position_manager.get_realized_pnl(symbol), unrealized
+
     async def get_position_object_by_symbol(self, symbol) -> dict:
-        """Fetch the position object for a specific symbol."""
-        # Check if the position is cached and refresh only if necessary
+        """Position object for a specific symbol, maintained locally from fills."""
+        # Only symbols never seen in a fill or the startup snapshot fall back to the API
         position_object = self._position_manager._position_objects_by_symbol.get(symbol, None)
         if position_object is None:
             # If it's not cached, fetch from the API
@@ -201,12 +1582,15 @@ class DataClient():
 
 
 class PositionManager():
-    def __init__(self):
+    """Positions maintained locally from fill trade_updates (qty, average entry price, realized PnL).
+    REST is only used to seed the book at startup and by the low-cadence reconciliation task."""
+    def __init__(self, base_url: Optional[str] = None):
         #self.session = None 
-        self._pos_url = "https://paper-api.alpaca.markets/v2/positions"
+        self._pos_url = f"{base_url or Client.base_url}/v2/positions"
         self._position_objects_by_symbol = {}
         self._positions_by_symbol = {}
         self._last_update_time = 0
+        self._drift_tolerance = 1e-9
 
     @classmethod
     async def create(cls):
@@ -214,43 +1598,112 @@ class PositionManager():
         await Client.start_session()
         await instance.get_positions()
         return instance
-    
+
+    async def _fetch_positions(self, symbol=None) -> Optional[list]:
+        url = f"{self._pos_url}/{symbol}" if symbol else self._pos_url
+        try:
+            async with Client.request("GET", url, priority=PRIORITY_LOW) as result:
+                response_body = await result.read()
+                if result.status == 200:
+                    response = _json_loads(response_body)
+                    return [response] if symbol else response  # Ensure uniform list format
+                position_logger.warning("Failed to get positions: Status %s, Details: %s", result.status, response_body.decode())
+        except Exception as e:
+            position_logger.warning("Error to get positions: %s", e)
+        return None
+
+    def _set_position_object(self, individual_response: dict) -> None:
+        symbol = individual_response.get("symbol", "Unknown").strip()
+        previous = self._position_objects_by_symbol.get(symbol) or {}
+        position_object = dict(individual_response)
+        position_object["qty"] = float(individual_response.get("qty", 0))
+        position_object["avg_entry_price"] = float(individual_response.get("avg_entry_price") or 0.0)
+        position_object["realized_pnl"] = previous.get("realized_pnl", 0.0)
+        self._position_objects_by_symbol[symbol] = position_object
+        self._positions_by_symbol[symbol] = {"position": position_object["qty"]}
+
     async def get_positions(self, symbol=None, force_refresh=False):
         """Fetch positions from Alpaca API, with optional force refresh."""
         current_time = time.time()
 
         # Check if we need to refresh the positions (e.g., every 60 seconds or if forced)
         if not force_refresh and (current_time - self._last_update_time < 5):
-            logging.info("Using cached positions data")
+            position_logger.debug("Using cached positions data")
             return
 
-        url = f"{self._pos_url}/{symbol}" if symbol else self._pos_url
-        try:
-            async with Client.session.get(url) as result:
-                if result.status == 200:
-                    response = await result.json()
-                    if symbol:
-                        response = [response]  # Ensure uniform list format
-
-                    # Update positions by symbol and position objects
-                    for individual_response in response:
-                        symbol = individual_response.get("symbol", "Unknown").strip()
-                        qty = float(individual_response.get("qty", 0))
-                        self._position_objects_by_symbol[symbol] = individual_response
-                        self._positions_by_symbol[symbol] = {"position": qty}
-
-                    # Update the last time positions were fetched
-                    self._last_update_time = current_time
-                else:
-                    response_text = await result.text()
-                    logging.warning(f"Failed to get positions: Status {result.status}, Details: {response_text}")
-        except Exception as e:
-            logging.warning(f"Error to get positions: {e}")
+        response = await self._fetch_positions(symbol)
+        if response is not None:
+            for individual_response in response:
+                self._set_position_object(individual_response)
+            # Update the last time positions were fetched
+            self._last_update_time = current_time
 
     async def update_position_objects(self):
         """Force update of all position objects from the Alpaca API."""
         await self.get_positions(force_refresh=True)  # Force refresh of positions
 
+    def apply_fill(self, symbol: str, side: str, qty: float, price: float, position_qty: Optional[float] = None) -> dict:
+        """Apply one fill or partial fill to the local book. position_qty, when the broker reports it, is authoritative for qty."""
+        position_object = self._position_objects_by_symbol.get(symbol)
+        if position_object is None:
+            position_object = self._position_objects_by_symbol[symbol] = {"symbol": symbol, "qty": 0.0, "avg_entry_price": 0.0, "realized_pnl": 0.0}
+        position = position_object["qty"]
+        signed_qty = qty if side == SIDE_BUY else -qty
+        if position == 0 or (position > 0) == (signed_qty > 0):
+            position_object["avg_entry_price"] = (position_object["avg_entry_price"] * abs(position) + price * qty) / (abs(position) + qty)
+        else:
+            closed = min(abs(position), qty)
+            position_object["realized_pnl"] += closed * (price - position_object["avg_entry_price"]) * (1 if position > 0 else -1)
+            if qty > abs(position):  # flipped through flat
+                position_object["avg_entry_price"] = price
+        new_position = position + signed_qty
+        if position_qty is not None and abs(position_qty - new_position) > self._drift_tolerance:
+            position_logger.warning("Position drift for %s: local %s, broker reports %s. Using broker qty.", symbol, new_position, position_qty)
+            new_position = position_qty
+        if new_position == 0:
+            position_object["avg_entry_price"] = 0.0
+        position_object["qty"] = new_position
+        self._positions_by_symbol[symbol] = {"position": new_position}
+        return position_object
+
+    def get_unrealized_pnl(self, symbol: str, mark_price: float) -> float:
+        position_object = self._position_objects_by_symbol.get(symbol)
+        if position_object is None or position_object["qty"] == 0:
+            return 0.0
+        return position_object["qty"] * (mark_price - position_object["avg_entry_price"])
+
+    def get_realized_pnl(self, symbol: str) -> float:
+        position_object = self._position_objects_by_symbol.get(symbol)
+        return position_object["realized_pnl"] if position_object is not None else 0.0
+
+    async def reconcile(self) -> dict:
+        """Diff the local book against /v2/positions, log and adopt any drift. Returns {symbol: (local_qty, broker_qty)} for drifted symbols."""
+        response = await self._fetch_positions()
+        if response is None:
+            return {}
+        broker_positions = {individual_response.get("symbol", "Unknown").strip(): individual_response for individual_response in response}
+        drift = {}
+        for symbol in set(broker_positions) | set(self._positions_by_symbol):
+            local_qty = self._positions_by_symbol.get(symbol, {}).get("position", 0.0)
+            broker_qty = float(broker_positions[symbol].get("qty", 0)) if symbol in broker_positions else 0.0
+            if abs(local_qty - broker_qty) > self._drift_tolerance:
+                drift[symbol] = (local_qty, broker_qty)
+                position_logger.warning("Reconciliation drift for %s: local %s, broker %s", symbol, local_qty, broker_qty)
+            if symbol in broker_positions:
+                self._set_position_object(broker_positions[symbol])
+            elif local_qty != 0:
+                self._set_position_object({"symbol": symbol, "qty": 0, "avg_entry_price": 0})
+        self._last_update_time = time.time()
+        return drift
+
+    async def run_reconciliation(self, interval: float = 300.0, on_reconciled=None):
+        """reconcile() every interval seconds, then call on_reconciled() so the adopted positions reach their consumers."""
+        while True:
+            await asyncio.sleep(interval)
+            await self.reconcile()
+            if on_reconciled is not None:
+                on_reconciled()
+
     async def update_position(self, symbol, position_qty):
         # Check if the symbol already exists in the dictionary
         if symbol not in self._positions_by_symbol:
@@ -258,51 +1711,266 @@ class PositionManager():
         self._positions_by_symbol[symbol]["position"] = position_qty
 
 
+class SharedPositionTable:
+    """Per-symbol position, mid and open-order view in shared memory, shared by the worker processes of a sharded
+    deployment. Each row has a single writer (the worker owning the symbol) and is published under a seqlock,
+    so readers in any process get a consistent row without taking a lock."""
+
+    def __init__(self, shm: shared_memory.SharedMemory, symbols: list, owner: bool):
+        self._shm = shm
+        self._owner = owner
+        self._symbols = list(symbols)
+        self._index = {symbol: index for index, symbol in enumerate(self._symbols)}
+        self._rows = np.ndarray((len(self._symbols),), dtype=SHARED_POSITION_DTYPE, buffer=shm.buf)
+        self._seq = self._rows["seq"]
+        self._position = self._rows["position"]
+        self._avg_entry_price = self._rows["avg_entry_price"]
+        self._last_mid = self._rows["last_mid"]
+        self._open_orders = self._rows["open_orders"]
+        self._updated_ns = self._rows["updated_ns"]
+
+    @classmethod
+    def create(cls, symbols: list):
+        shm = shared_memory.SharedMemory(create=True, size=max(1, len(symbols)) * SHARED_POSITION_DTYPE.itemsize)
+        table = cls(shm, symbols, owner=True)
+        table._rows[:] = 0
+        return table
+
+    @classmethod
+    def attach(cls, name: str, symbols: list):
+        return cls(shared_memory.SharedMemory(name=name), symbols, owner=False)
+
+    def get_name(self) -> str:
+        return self._shm.name
+
+    def get_symbols(self) -> list:
+        return list(self._symbols)
+
+    def publish_mid(self, symbol: str, mid: float) -> None:
+        index = self._index.get(symbol)
+        if index is None:
+            return
+        self._seq[index] += 1
+        self._last_mid[index] = mid
+        self._updated_ns[index] = time.time_ns()
+        self._seq[index] += 1
+
+    def publish_position(self, symbol: str, position: float, avg_entry_price: float, open_orders: int) -> None:
+        index = self._index.get(symbol)
+        if index is None:
+            return
+        self._seq[index] += 1
+        self._position[index] = position
+        self._avg_entry_price[index] = avg_entry_price
+        self._open_orders[index] = open_orders
+        self._updated_ns[index] = time.time_ns()
+        self._seq[index] += 1
+
+    def read(self, symbol: str) -> Optional[dict]:
+        index = self._index.get(symbol)
+        if index is None:
+            return None
+        while True:
+            seq = int(self._seq[index])
+            if seq % 2:  # writer in progress
+                continue
+            row = {"position": float(self._position[index]), "avg_entry_price": float(self._avg_entry_price[index]),
+                   "last_mid": float(self._last_mid[index]), "open_orders": int(self._open_orders[index]),
+                   "updated_ns": int(self._updated_ns[index])}
+            if int(self._seq[index]) == seq:
+                return row
+
+    def gross_exposure(self) -> float:
+        return float(np.abs(self._position * self._last_mid).sum())
+
+    def net_exposure(self) -> float:
+        return float((self._position * self._last_mid).sum())
+
+    def total_open_orders(self) -> int:
+        return int(self._open_orders.sum())
+
+    def close(self) -> None:
+        # Drop the numpy views first, SharedMemory refuses to close while they export the buffer
+        self._rows = self._seq = self._position = self._avg_entry_price = self._last_mid = self._open_orders = self._updated_ns = None
+        self._shm.close()
+
+    def unlink(self) -> None:
+        if self._owner:
+            self._shm.unlink()
+
+
 class OrderManager():
-    def __init__(self):
-        self._order_url = "https://paper-api.alpaca.markets/v2/orders"
-        self._pos_url = "https://paper-api.alpaca.markets/v2/positions"
+    def __init__(self, order_store: Optional[OrderStateStore] = None, max_concurrent_requests: int = 8,
+                 risk_manager: Optional["RiskManager"] = None, base_url: Optional[str] = None):
+        self._base_url = base_url or Client.base_url
+        self._order_url = f"{self._base_url}/v2/orders"
+        self._pos_url = f"{self._base_url}/v2/positions"
         self.session = None  # We'll initialize this in an async context
-        #self._submitted_order_by_order_id = defaultdict(dict)
+        self._order_store = order_store if order_store is not None else OrderStateStore()
+        self._max_concurrent_requests = max_concurrent_requests
+        self._risk_manager = risk_manager
+        # client_order_ids are generated locally so an order can be correlated before, or without, the REST response
+        self._client_order_id_prefix = f"mm-{uuid.uuid4().hex[:12]}"
+        self._client_order_ids = itertools.count(1)
+
+    def next_client_order_id(self) -> str:
+        return f"{self._client_order_id_prefix}-{next(self._client_order_ids)}"
            
-    async def start(self):
+    async def start(self, nr_warm_connections: int = 4):
         if not Client.session:
             await Client.start_session()
-
-    async def insert_order(self, symbol: str, price: float, quantity: int, side: str, order_type: str):
+        if nr_warm_connections > 0:
+            await Client.warmup(nr_warm_connections, base_url=self._base_url)
+
+    async def insert_order(self, symbol: str, price: float, quantity: int, side: str, order_type: str, priority: int = PRIORITY_NORMAL,
+                           client_order_id: Optional[str] = None, order_class: Optional[str] = None, take_profit: Optional[float] = None,
+                           stop_loss: Optional[float] = None, stop_limit: Optional[float] = None):
+        """The response carries the client_order_id even on failure, so an order whose response was lost can be
+        looked up with get_order_by_client_order_id.
+        order_class attaches exit legs the broker manages: take_profit is the limit price of the take-profit leg, stop_loss
+        the stop price of the stop-loss leg (stop_limit makes it a stop-limit). Simple orders are sent IOC, order classes
+        are not accepted IOC and use order_type (day or gtc) as time in force. For OCO, price is the take-profit limit."""
         assert side in ALL_SIDES, f"side must be one of {ALL_SIDES}"
         assert order_type in ALL_ORDER_TYPES, f"order_type must be one of {ALL_ORDER_TYPES}"
-        params = {"symbol": symbol,"qty": quantity, "side": side,"type": ORDER_TYPE_LIMIT, "limit_price": price,"time_in_force": ORDER_TYPE_IOC}
-        await Client.start_session()
+        assert order_class is None or order_class in ALL_ORDER_CLASSES, f"order_class must be one of {ALL_ORDER_CLASSES}"
+        if client_order_id is None:
+            client_order_id = self.next_client_order_id()
+        if self._risk_manager is not None:
+            reason = self._risk_manager.check_order(symbol, side, quantity, price)
+            if reason is not None:
+                order_logger.warning("Order rejected by risk check - Symbol : %s, Qty : %s, Side : %s, Price : %s: %s", symbol, quantity, side, price, reason)
+                return InsertOrderResponse(success=False, order_id=None, error=f"Risk check failed: {reason}", client_order_id=client_order_id)
+        params = {"symbol": symbol,"qty": quantity, "side": side,"type": ORDER_TYPE_LIMIT, "limit_price": price,"time_in_force": ORDER_TYPE_IOC,
+                  "client_order_id": client_order_id}
+        if order_class is not None:
+            add_order_class_params(params, order_class, order_type, take_profit, stop_loss, stop_limit)
         try:
-            async with Client.session.post(self._order_url, json=params) as result:
+            async with Client.request("POST", self._order_url, priority=priority, json=params) as result:
             #async with self.session.post(self._order_url, json=params) as result:
-                response_text = await result.text()
+                response_body = await result.read()
                 if result.status == 200:
-                    logging.info(f"Succesful Order Insertion - Symbol : {symbol}, Qty : {quantity}, Side : {side}, Price : {price}")
-                    order_response = await result.json()
+                    order_logger.info("Succesful Order Insertion - Symbol : %s, Qty : %s, Side : %s, Price : %s", symbol, quantity, side, price)
+                    order_response = _json_loads(response_body)
                     #logging.info(f"Successful Order Insertion: {order_response}")
-                    symbol = order_response["symbol"]
                     id = order_response["id"]
-                    #self._submitted_order_by_order_id[symbol][id] = id ## record id instead of order_response
-                    return InsertOrderResponse(success=True, order_id=id, error=None)
+                    known = self._order_store.get_order(id)
+                    echoed = known is not None and known.status != PENDING_NEW
+                    order_state = self._order_store.on_submitted(order_response)
+                    if not echoed:  # time the stream's echo from here
+                        order_state.acknowledged_ns = time.monotonic_ns()
+                    return InsertOrderResponse(success=True, order_id=id, error=None, client_order_id=client_order_id, leg_ids=order_state.leg_ids)
                 else:
-                    logging.warning(f"Order Insertion Error (Status {result.status}): {response_text}")
-                    return InsertOrderResponse(success=False, order_id=None, error= f"Error (Status {result.status}): {response_text}" )
+                    response_text = response_body.decode()
+                    order_logger.warning("Order Insertion Error (Status %s): %s", result.status, response_text)
+                    return InsertOrderResponse(success=False, order_id=None, error= f"Error (Status {result.status}): {response_text}", client_order_id=client_order_id)
                     
         except Exception as e:
-            logging.warning(f"Error inserting order: {e}")
-            return InsertOrderResponse(success=False, order_id=None, error=e)
+            order_logger.warning("Error inserting order: %s", e)
+            return InsertOrderResponse(success=False, order_id=None, error=e, client_order_id=client_order_id)
+
+    async def insert_bracket_order(self, symbol: str, price: float, quantity: int, side: str, take_profit: Optional[float] = None,
+                                   stop_loss: Optional[float] = None, stop_limit: Optional[float] = None, order_type: str = ORDER_TYPE_DAY,
+                                   priority: int = PRIORITY_NORMAL, client_order_id: Optional[str] = None):
+        """Limit entry with its exits attached: a bracket with both take_profit and stop_loss, an OTO with only one."""
+        order_class = ORDER_CLASS_BRACKET if take_profit is not None and stop_loss is not None else ORDER_CLASS_OTO
+        return await self.insert_order(symbol, price, quantity, side, order_type, priority=priority, client_order_id=client_order_id,
+                                       order_class=order_class, take_profit=take_profit, stop_loss=stop_loss, stop_limit=stop_limit)
+
+    async def get_orders(self, status: str = "open", symbols=None, after=None, until=None, limit: Optional[int] = None,
+                         direction: str = "desc", priority: int = PRIORITY_LOW) -> Optional[list]:
+        """Orders from /v2/orders, following pages of up to 500 until limit orders (all if None) have been read.
+        after and until filter on submission time, as RFC 3339 strings, datetimes or ns since epoch. Every order
+        returned is adopted into the order store. Returns None on error."""
+        params = {"status": status, "direction": direction, "nested": "false"}
+        if symbols:
+            params["symbols"] = symbols if isinstance(symbols, str) else ",".join(symbols)
+        if after is not None:
+            params["after"] = to_rfc3339(after)
+        if until is not None:
+            params["until"] = to_rfc3339(until)
+        orders, seen = [], set()
+        while True:
+            page_size = min(500, limit - len(orders)) if limit is not None else 500
+            params["limit"] = page_size
+            try:
+                async with Client.request("GET", self._order_url, priority=priority, params=params) as result:
+                    response_body = await result.read()
+                    if result.status != 200:
+                        order_logger.warning("Failed to get %s orders (Status %s): %s", status, result.status, response_body.decode())
+                        return None
+                    page = _json_loads(response_body)
+            except Exception as e:
+                order_logger.warning("Error getting %s orders: %s", status, e)
+                return None
+            new_orders = [order for order in page if order["id"] not in seen]
+            for order in new_orders:
+                seen.add(order["id"])
+                self._order_store.on_snapshot(order)
+            orders.extend(new_orders)
+            if len(page) < page_size or not new_orders or (limit is not None and len(orders) >= limit):
+                return orders
+            # Both bounds are exclusive and orders can share a submission time (bracket legs share their parent's), so the
+            # next page starts one microsecond back inside the last one and the orders read again are dropped as seen
+            last_ns = rfc3339_ns(page[-1]["submitted_at"])
+            params["until" if direction == "desc" else "after"] = to_rfc3339(last_ns + 1_000 if direction == "desc" else last_ns - 1_000)
+
+    async def get_order(self, order_id: str, priority: int = PRIORITY_LOW) -> Optional[dict]:
+        """One order by id, adopted into the order store. None if unknown or on error."""
+        return (await self._get_one_order(f"{self._order_url}/{order_id}", None, priority))[1]
+
+    async def get_order_by_client_order_id(self, client_order_id: str, priority: int = PRIORITY_LOW) -> Optional[dict]:
+        """One order by client_order_id, adopted into the order store. None if unknown or on error."""
+        return (await self._get_one_order(f"{self._order_url}:by_client_order_id", {"client_order_id": client_order_id}, priority))[1]
+
+    async def _get_one_order(self, url: str, params: Optional[dict], priority: int) -> tuple:
+        """(HTTP status, order), the status is None if the request failed, so callers can tell unknown orders from errors."""
+        try:
+            async with Client.request("GET", url, priority=priority, params=params) as result:
+                response_body = await result.read()
+                if result.status == 200:
+                    order = _json_loads(response_body)
+                    self._order_store.on_snapshot(order)
+                    return result.status, order
+                if result.status != 404:
+                    order_logger.warning("Failed to get order (Status %s): %s", result.status, response_body.decode())
+                return result.status, None
+        except Exception as e:
+            order_logger.warning("Error getting order: %s", e)
+        return None, None
+
+    async def sync_open_orders(self, symbols=None) -> int:
+        """Rebuild the order store from the broker at startup or after a stream gap: adopt every open order on symbols
+        (all if None) and the final status of locally live orders that have closed since. Returns the number of open orders."""
+        open_orders = await self.get_orders("open", symbols=symbols, priority=PRIORITY_HIGH)
+        if open_orders is None:
+            return 0
+        open_ids = {order["id"] for order in open_orders}
+        symbol_filter = None if symbols is None else set(symbols.split(",") if isinstance(symbols, str) else symbols)
+        missing = {state.order_id: state for state in self._order_store.get_orders()
+                   if state.is_live() and state.order_id not in open_ids and (symbol_filter is None or state.symbol in symbol_filter)}
+        if missing:
+            # One page of recently closed orders normally accounts for all of them, the rest are looked up one by one
+            for order in await self.get_orders("closed", symbols=symbols, limit=500, priority=PRIORITY_HIGH) or ():
+                missing.pop(order["id"], None)
+            lookups = await self._gather_bounded([self._get_one_order(f"{self._order_url}/{order_id}", None, PRIORITY_HIGH) for order_id in missing])
+            for state, (http_status, _) in zip(list(missing.values()), lookups):
+                # Only a 404 proves the order is gone, after an error it may still be live at the broker and stays live here
+                if http_status == 404:
+                    order_logger.warning("Order %s is unknown to the broker, marking it canceled", state.order_id)
+                    self._order_store.on_snapshot({"id": state.order_id, "symbol": state.symbol, "side": state.side, "status": CANCELED})
+                elif http_status != 200:
+                    order_logger.warning("Could not look up order %s, keeping it live", state.order_id)
+        return len(open_orders)
 
     async def close_all_positions(self, cancel_orders: bool = True):
         params = {"cancel_orders": cancel_orders}
         responses = []
         try:
-            async with Client.session.delete(self._pos_url, json=params) as result:
-                response_text = await result.text()
+            async with Client.request("DELETE", self._pos_url, priority=PRIORITY_HIGH, json=params) as result:
+                response_body = await result.read()
                 if result.status == 207:  # Handle Multi-Status responses
-                    logging.info("Close All Positions Request Received Multi-Status Response")
-                    response = await result.json()
+                    order_logger.info("Close All Positions Request Received Multi-Status Response")
+                    response = _json_loads(response_body)
 
                     # Process each individual response in the multi-status response
                     for individual_response in response:
@@ -312,19 +1980,19 @@ class OrderManager():
                         #id = individual_response.get("id")
 
                         if status == 200:
-                            logging.info(f"Closed position for {symbol}: {body}")
-                            #self._submitted_order_by_order_id[symbol][id] = individual_response
+                            order_logger.info("Closed position for %s: %s", symbol, body)
                             responses.append(ClosePositionResponse(symbol=symbol, success=True, status=status))
                         else:
-                            logging.warning(f"Failed to close position for {symbol}: Status {status}, Details: {body}")
+                            order_logger.warning("Failed to close position for %s: Status %s, Details: %s", symbol, status, body)
                             responses.append(ClosePositionResponse(symbol=symbol, success=False, status=status, error=body))
 
                 else:
-                    logging.warning(f"Unexpected status {result.status} received: {response_text}")
+                    response_text = response_body.decode()
+                    order_logger.warning("Unexpected status %s received: %s", result.status, response_text)
                     responses.append(ClosePositionResponse(symbol="Unknown", success=False, status=result.status, error=response_text))
 
         except Exception as e:
-            logging.error(f"Error closing all positions: {e}")
+            order_logger.error("Error closing all positions: %s", e)
             responses.append(ClosePositionResponse(symbol="Unknown", success=False, status=500, error=str(e)))
 
         return responses
@@ -366,7 +2034,7 @@ class OrderManager():
     async def close_position(self, symbol: str, qty: float = None, percentage: float = None): ##TODO check close_position method and if pos in pos manager adjust accordingly
         # Check if neither qty nor percentage is provided, implying a full close of the position.
         if qty is None and percentage is None:
-            logging.info(f"Closing full position for {symbol}.")
+            order_logger.info("Closing full position for %s.", symbol)
             
         # Ensure that qty and percentage are not both provided at the same time.
         assert not (qty is not None and percentage is not None), "Specify either qty or percentage, but not both."  ##TODO check this logic
@@ -383,32 +2051,33 @@ class OrderManager():
 
         try:
             # Send the DELETE request to the API.
-            async with Client.session.delete(pos_url_with_symbol, params=params) as result:
-                response_text = await result.text()
+            async with Client.request("DELETE", pos_url_with_symbol, priority=PRIORITY_HIGH, params=params) as result:
+                response_body = await result.read()
 
                 # Check for a successful response.
                 if result.status == 200:
-                    logging.info(f"Closed position for {symbol}.")
-                    order_response = await result.json()
-                    logging.info(f"Order response: {order_response}")
+                    order_logger.info("Closed position for %s.", symbol)
+                    order_response = _json_loads(response_body)
+                    order_logger.info("Order response: %s", order_response)
                     return ClosePositionResponse(symbol=symbol, success=True, status=result.status)
                 else:
-                    logging.warning(f"Failed to close position for {symbol} (Status {result.status}): {response_text}")
+                    response_text = response_body.decode()
+                    order_logger.warning("Failed to close position for %s (Status %s): %s", symbol, result.status, response_text)
                     return ClosePositionResponse(symbol=symbol, success=False, status=result.status, error=response_text)
 
         except Exception as e:
-            logging.error(f"Error closing position for {symbol}: {e}")
+            order_logger.error("Error closing position for %s: %s", symbol, e)
             return ClosePositionResponse(symbol=symbol, success=False, status=500, error=str(e))
 
 
     async def cancel_all_orders(self):
         try:
             # Send DELETE request to cancel all orders
-            async with Client.session.delete(self._order_url) as result:
+            async with Client.request("DELETE", self._order_url, priority=PRIORITY_HIGH) as result:
 
                 if result.status == 207:  # Multi-Status
-                    logging.info("Received multi-status response for canceling all orders.")
-                    order_statuses = await result.json()  # Parse the JSON response
+                    order_logger.info("Received multi-status response for canceling all orders.")
+                    order_statuses = _json_loads(await result.read())  # Parse the JSON response
 
                     # Process each order's cancellation status
                     success = True
@@ -419,19 +2088,19 @@ class OrderManager():
                         order_results[order_id] = status
 
                         if status == 200:
-                            logging.info(f"Order {order_id} successfully canceled.")
+                            order_logger.info("Order %s successfully canceled.", order_id)
                         elif status == 500:
-                            logging.warning(f"Failed to cancel order {order_id}. Status: {status}")
+                            order_logger.warning("Failed to cancel order %s. Status: %s", order_id, status)
                             success = False
 
                     return CancelAllOrdersResponse(success=success, order_statuses=order_results)
 
                 else:
-                    logging.warning(f"Unexpected response status: {result.status}")
+                    order_logger.warning("Unexpected response status: %s", result.status)
                     return CancelAllOrdersResponse(success=False, order_statuses={}, error=f"Unexpected status {result.status}")
 
         except Exception as e:
-            logging.error(f"Error occurred while canceling all orders: {e}")
+            order_logger.error("Error occurred while canceling all orders: %s", e)
             return CancelAllOrdersResponse(success=False, order_statuses={}, error=str(e))
 
     async def cancel_order(self, order_id: str):
@@ -440,43 +2109,106 @@ class OrderManager():
         cancel_url_with_id = f"{self._order_url}/{order_id}"  
         try:
             # Send the DELETE request to cancel the order
-            async with Client.session.delete(cancel_url_with_id) as result:
-                response_text = await result.text()
+            async with Client.request("DELETE", cancel_url_with_id, priority=PRIORITY_HIGH) as result:
+                response_body = await result.read()
 
                 # Check for the success code (204)
                 if result.status == 204:
-                    logging.info(f"Successfully canceled Order ID : {order_id}")
+                    order_logger.info("Successfully canceled Order ID : %s", order_id)
                     return CancelOrderResponse(success=True)
                 elif result.status == 404:
-                    logging.warning(f"Order {order_id} not found: {response_text}")
+                    order_logger.warning("Order %s not found: %s", order_id, response_body.decode())
                     return CancelOrderResponse(success=False, error="Order not found")
                 elif result.status == 422:
-                    logging.warning(f"Order {order_id} is no longer cancelable (Status {result.status}): {response_text}")
+                    order_logger.warning("Order %s is no longer cancelable (Status %s): %s", order_id, result.status, response_body.decode())
                     return CancelOrderResponse(success=False, error="Order no longer cancelable")
                 else:
-                    logging.warning(f"Failed to cancel order {order_id} (Status {result.status}): {response_text}")
+                    order_logger.warning("Failed to cancel order %s (Status %s): %s", order_id, result.status, response_body.decode())
                     return CancelOrderResponse(success=False, error=f"Failed with status {result.status}")
         except Exception as e:
-            logging.warning(f"Error cancelling order {order_id}: {e}")
+            order_logger.warning("Error cancelling order %s: %s", order_id, e)
             return CancelOrderResponse(success=False, error=str(e))
     
 
-    
-    ## TODO Get orders and get order by id
 
-    ## Todo 
-    async def replace_order(self):
-        pass
+    async def replace_order(self, order_id: str, qty: Optional[int] = None, limit_price: Optional[float] = None,
+                            time_in_force: Optional[str] = None, client_order_id: Optional[str] = None):
+        assert order_id is not None, "Order ID must be specified"
+        params = {key: value for key, value in (("qty", qty), ("limit_price", limit_price), ("time_in_force", time_in_force),
+                                                 ("client_order_id", client_order_id)) if value is not None}
+        assert params, "At least one of qty, limit_price, time_in_force or client_order_id must be specified"
+        order_state = self._order_store.get_order(order_id)
+        if self._risk_manager is not None and order_state is not None:
+            reason = self._risk_manager.check_order(order_state.symbol, order_state.side, qty if qty is not None else order_state.qty - order_state.filled_qty,
+                                                    limit_price if limit_price is not None else order_state.limit_price, replacing=True)
+            if reason is not None:
+                order_logger.warning("Replace of order %s rejected by risk check: %s", order_id, reason)
+                return ModifyOrderResponse(success=False, replaced_order_id=order_id, error=f"Risk check failed: {reason}")
+        replace_url_with_id = f"{self._order_url}/{order_id}"
+        try:
+            async with Client.request("PATCH", replace_url_with_id, priority=PRIORITY_NORMAL, json=params) as result:
+                response_body = await result.read()
+                if result.status == 200:
+                    order_response = _json_loads(response_body)
+                    new_id = order_response["id"]
+                    self._order_store.on_submitted(order_response)
+                    order_logger.info("Successfully replaced Order ID : %s with %s (%s)", order_id, new_id, params)
+                    return ModifyOrderResponse(success=True, order_id=new_id, replaced_order_id=order_id)
+                elif result.status == 404:
+                    order_logger.warning("Order %s not found: %s", order_id, response_body.decode())
+                    return ModifyOrderResponse(success=False, replaced_order_id=order_id, error="Order not found")
+                elif result.status == 422:
+                    order_logger.warning("Order %s is no longer replaceable (Status %s): %s", order_id, result.status, response_body.decode())
+                    return ModifyOrderResponse(success=False, replaced_order_id=order_id, error="Order no longer replaceable")
+                else:
+                    order_logger.warning("Failed to replace order %s (Status %s): %s", order_id, result.status, response_body.decode())
+                    return ModifyOrderResponse(success=False, replaced_order_id=order_id, error=f"Failed with status {result.status}")
+        except Exception as e:
+            order_logger.warning("Error replacing order %s: %s", order_id, e)
+            return ModifyOrderResponse(success=False, replaced_order_id=order_id, error=str(e))
+
+    async def _gather_bounded(self, coroutines, max_concurrency: Optional[int] = None) -> list:
+        """Run coroutines concurrently, at most max_concurrency in flight, results in input order."""
+        semaphore = asyncio.Semaphore(max_concurrency or self._max_concurrent_requests)
+
+        async def run(coroutine):
+            async with semaphore:
+                return await coroutine
+
+        return await asyncio.gather(*(run(coroutine) for coroutine in coroutines))
+
+    async def batch_insert_orders(self, orders, max_concurrency: Optional[int] = None) -> list:
+        """orders is an iterable of dicts of insert_order keyword arguments. Returns InsertOrderResponses in order."""
+        return await self._gather_bounded([self.insert_order(**order) for order in orders], max_concurrency)
+
+    async def batch_cancel_orders(self, order_ids, max_concurrency: Optional[int] = None) -> list:
+        return await self._gather_bounded([self.cancel_order(order_id) for order_id in order_ids], max_concurrency)
+
+    async def batch_replace_orders(self, replacements, max_concurrency: Optional[int] = None) -> list:
+        """replacements is an iterable of dicts holding order_id plus the replace_order keyword arguments."""
+        return await self._gather_bounded([self.replace_order(**replacement) for replacement in replacements], max_concurrency)
+
+    async def requote_orders(self, cancel_order_ids=(), replacements=(), max_concurrency: Optional[int] = None):
+        """Run one requote cycle's cancels and replaces together under a single concurrency limit.
+        Returns (list of CancelOrderResponse, list of ModifyOrderResponse)."""
+        cancel_order_ids = list(cancel_order_ids)
+        coroutines = [self.cancel_order(order_id) for order_id in cancel_order_ids]
+        coroutines += [self.replace_order(**replacement) for replacement in replacements]
+        responses = await self._gather_bounded(coroutines, max_concurrency)
+        return responses[:len(cancel_order_ids)], responses[len(cancel_order_ids):]
 
 
 class InsertOrderResponse:
-    def __init__(self, success: bool, order_id: Optional[int], error: Optional[str]):
+    def __init__(self, success: bool, order_id: Optional[int], error: Optional[str], client_order_id: Optional[str] = None,
+                 leg_ids: Optional[list] = None):
         self.success: bool = success
         self.order_id: Optional[int] = order_id
         self.error: Optional[str] = error
+        self.client_order_id: Optional[str] = client_order_id
+        self.leg_ids: Optional[list] = leg_ids
 
     def __str__(self):
-        return f"InsertOrderResponse(success={self.success}, order_id={self.order_id}, error='{self.error}')"
+        return f"InsertOrderResponse(success={self.success}, order_id={self.order_id}, client_order_id={self.client_order_id}, error='{self.error}')"
 
 class ClosePositionResponse:
     def __init__(self, symbol: str, success: bool, status: int, error: Optional[str] = None):
@@ -505,17 +2237,589 @@ class CancelAllOrdersResponse:
     def __str__(self):
         return f"CancelAllOrdersResponse(success={self.success}, order_statuses={self.order_statuses}, error='{self.error}')"
 
-## Todo
 class ModifyOrderResponse:
-    pass
+    def __init__(self, success: bool, order_id: Optional[str] = None, replaced_order_id: Optional[str] = None, error: Optional[str] = None):
+        self.success: bool = success
+        self.order_id: Optional[str] = order_id  # id of the new order created by the replace
+        self.replaced_order_id: Optional[str] = replaced_order_id
+        self.error: Optional[str] = error
+
+    def __str__(self):
+        return f"ModifyOrderResponse(success={self.success}, order_id={self.order_id}, replaced_order_id={self.replaced_order_id}, error='{self.error}')"
 
 
 class RiskManager():
-    pass
+    """Pre-trade gate for every insert and replace: per-symbol notional, portfolio gross and net notional,
+    open order counts, a fat-finger band around the last mid and a kill switch.
+    Positions and mids live in numpy arrays indexed by symbol slot and gross/net notional are maintained
+    incrementally on every update, so a check is a few scalar operations and never rescans positions.
+    Open order counts come from the shared OrderStateStore."""
+
+    def __init__(self, order_store: Optional[OrderStateStore] = None, max_symbol_notional: float = 50_000.0,
+                 max_gross_notional: float = 250_000.0, max_net_notional: float = 100_000.0, max_open_orders: int = 100,
+                 max_open_orders_per_symbol: int = 4, price_band: float = 0.05, capacity: int = 64):
+        self._order_store = order_store if order_store is not None else OrderStateStore()
+        self._max_symbol_notional = max_symbol_notional
+        self._max_gross_notional = max_gross_notional
+        self._max_net_notional = max_net_notional
+        self._max_open_orders = max_open_orders
+        self._max_open_orders_per_symbol = max_open_orders_per_symbol
+        self._price_band = price_band
+        self._index = {}
+        self._position = np.zeros(capacity)
+        self._last_mid = np.zeros(capacity)
+        self._notional = np.zeros(capacity)
+        self._symbol_limit = np.full(capacity, max_symbol_notional)
+        self._gross = 0.0
+        self._net = 0.0
+        self._nr_updates = 0
+        self._kill_switch_reason = None
+
+    def _slot(self, symbol: str) -> int:
+        slot = self._index.get(symbol)
+        if slot is None:
+            slot = self._index[symbol] = len(self._index)
+            if slot == len(self._position):
+                grow = len(self._position)
+                self._position = np.concatenate([self._position, np.zeros(grow)])
+                self._last_mid = np.concatenate([self._last_mid, np.zeros(grow)])
+                self._notional = np.concatenate([self._notional, np.zeros(grow)])
+                self._symbol_limit = np.concatenate([self._symbol_limit, np.full(grow, self._max_symbol_notional)])
+        return slot
+
+    def set_symbol_limit(self, symbol: str, max_notional: float) -> None:
+        self._symbol_limit[self._slot(symbol)] = max_notional
+
+    def _update_notional(self, slot: int) -> None:
+        old = float(self._notional[slot])
+        new = float(self._position[slot] * self._last_mid[slot])
+        self._notional[slot] = new
+        self._gross += abs(new) - abs(old)
+        self._net += new - old
+        self._nr_updates += 1
+        if self._nr_updates % 10_000 == 0:  # resum now and then so the running totals never drift
+            self._gross = float(np.abs(self._notional).sum())
+            self._net = float(self._notional.sum())
+
+    def update_mid(self, symbol: str, mid: float) -> None:
+        slot = self._slot(symbol)
+        self._last_mid[slot] = mid
+        if self._position[slot] != 0:
+            self._update_notional(slot)
+
+    def update_position(self, symbol: str, position: float) -> None:
+        slot = self._slot(symbol)
+        self._position[slot] = position
+        self._update_notional(slot)
+
+    def engage_kill_switch(self, reason: str) -> None:
+        risk_logger.error("Kill switch engaged: %s", reason)
+        self._kill_switch_reason = reason
+
+    def release_kill_switch(self) -> None:
+        risk_logger.warning("Kill switch released")
+        self._kill_switch_reason = None
+
+    def is_killed(self) -> bool:
+        return self._kill_switch_reason is not None
+
+    def get_exposure(self) -> dict:
+        return {"gross_notional": self._gross, "net_notional": self._net, "open_orders": self._order_store.count_live()}
+
+    def check_order(self, symbol: str, side: str, qty: float, price: float, replacing: bool = False) -> Optional[str]:
+        """None if the order passes, otherwise the reason it is rejected. A replace does not add an open order."""
+        if self._kill_switch_reason is not None:
+            return f"kill switch engaged ({self._kill_switch_reason})"
+        slot = self._slot(symbol)
+        mid = float(self._last_mid[slot])
+        if mid > 0 and abs(price - mid) > mid * self._price_band:
+            return f"price {price} outside {self._price_band:.1%} band around mid {mid}"
+        if not replacing:
+            if self._order_store.count_live() >= self._max_open_orders:
+                return f"max open orders ({self._max_open_orders}) reached"
+            if self._order_store.count_live(symbol) >= self._max_open_orders_per_symbol:
+                return f"max open orders for {symbol} ({self._max_open_orders_per_symbol}) reached"
+        position = float(self._position[slot])
+        new_position = position + (qty if side == SIDE_BUY else -qty)
+        if abs(new_position) < abs(position):
+            return None  # risk reducing orders only face the band and order count checks
+        new_notional = new_position * (mid if mid > 0 else price)
+        if abs(new_notional) > self._symbol_limit[slot]:
+            return f"{symbol} notional {abs(new_notional):.0f} over limit {self._symbol_limit[slot]:.0f}"
+        old_notional = float(self._notional[slot])
+        gross = self._gross - abs(old_notional) + abs(new_notional)
+        if gross > self._max_gross_notional:
+            return f"gross notional {gross:.0f} over limit {self._max_gross_notional:.0f}"
+        net = self._net - old_notional + new_notional
+        if abs(net) > self._max_net_notional:
+            return f"net notional {net:.0f} over limit {self._max_net_notional:.0f}"
+        return None
+
+    def check_orders(self, symbols: list, sides: list, qtys, prices) -> np.ndarray:
+        """Vectorized check_order for a batch of new orders, e.g. one requote pass over many symbols.
+        Each order is checked independently against the current book. Returns a boolean array, True where the order passes."""
+        count = len(symbols)
+        if self._kill_switch_reason is not None:
+            return np.zeros(count, dtype=bool)
+        slots = np.fromiter((self._slot(symbol) for symbol in symbols), dtype=np.int64, count=count)
+        signs = np.fromiter((1.0 if side == SIDE_BUY else -1.0 for side in sides), dtype=np.float64, count=count)
+        qtys = np.asarray(qtys, dtype=np.float64)
+        prices = np.asarray(prices, dtype=np.float64)
+        mids = self._last_mid[slots]
+        position = self._position[slots]
+        in_band = (mids <= 0) | (np.abs(prices - mids) <= mids * self._price_band)
+        open_per_symbol = np.fromiter((self._order_store.count_live(symbol) for symbol in symbols), dtype=np.int64, count=count)
+        orders_ok = (open_per_symbol < self._max_open_orders_per_symbol) & (self._order_store.count_live() < self._max_open_orders)
+        new_position = position + signs * qtys
+        reducing = np.abs(new_position) < np.abs(position)
+        new_notional = new_position * np.where(mids > 0, mids, prices)
+        old_notional = self._notional[slots]
+        gross = self._gross - np.abs(old_notional) + np.abs(new_notional)
+        net = self._net - old_notional + new_notional
+        limits_ok = ((np.abs(new_notional) <= self._symbol_limit[slots]) & (gross <= self._max_gross_notional)
+                     & (np.abs(net) <= self._max_net_notional))
+        return in_band & orders_ok & (reducing | limits_ok)
+
+
+class LatencyHistogram:
+    """HDR-style log-linear histogram of nanosecond values: exact below 2 * 2**sub_bucket_bits, then
+    2**sub_bucket_bits buckets per power of two (about 3% relative error with the default 5 bits).
+    record() is O(1) and allocation free; percentiles walk the buckets only when a snapshot is taken."""
+    __slots__ = ("_sub_bucket_bits", "_sub_bucket_count", "_exact_limit", "_counts", "_last_index", "count", "total", "min", "max")
+
+    def __init__(self, sub_bucket_bits: int = 5, max_value_bits: int = 42):
+        self._sub_bucket_bits = sub_bucket_bits
+        self._sub_bucket_count = 1 << sub_bucket_bits
+        self._exact_limit = 2 * self._sub_bucket_count
+        self._counts = [0] * ((max_value_bits - sub_bucket_bits + 1) * self._sub_bucket_count)
+        self._last_index = len(self._counts) - 1
+        self.count = 0
+        self.total = 0
+        self.min = 1 << max_value_bits
+        self.max = 0
+
+    def _lower_bound(self, index: int) -> int:
+        if index < self._exact_limit:
+            return index
+        shift = index // self._sub_bucket_count - 1
+        return (index - shift * self._sub_bucket_count) << shift
+
+    def record(self, value: int) -> None:
+        if value < self._exact_limit:
+            if value < 0:
+                value = 0
+            index = value
+        else:
+            shift = value.bit_length() - self._sub_bucket_bits - 1
+            index = (shift << self._sub_bucket_bits) + (value >> shift)
+            if index > self._last_index:
+                index = self._last_index
+        self._counts[index] += 1
+        self.count += 1
+        self.total += value
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, percentile: float) -> int:
+        if self.count == 0:
+            return 0
+        target = max(1, math.ceil(self.count * percentile / 100.0))
+        seen = 0
+        for index, count in enumerate(self._counts):
+            seen += count
+            if seen >= target:
+                return min(self._lower_bound(index), self.max)
+        return self.max
+
+    def summary(self) -> dict:
+        return {"count": self.count,
+                "mean_us": self.total / self.count / 1000 if self.count else 0.0,
+                "min_us": self.min / 1000 if self.count else 0.0,
+                "p50_us": self.percentile(50) / 1000,
+                "p90_us": self.percentile(90) / 1000,
+                "p99_us": self.percentile(99) / 1000,
+                "p999_us": self.percentile(99.9) / 1000,
+                "max_us": self.max / 1000}
 
 
 class SystemMonitoring():
-    pass
+    """Process-wide hot-path latency histograms, one per stage (see ALL_LATENCY_STAGES), and the event loop monitor.
+    start_loop_monitor runs a probe task that sleeps interval at a time and records how late it wakes up as
+    STAGE_LOOP_LAG, along with task and ready-callback counts. A watchdog thread notices when the probe is overdue
+    by more than slow_callback and samples what the loop thread is running: the current task's name (or its
+    coroutine's qualified name) and the innermost line of this repo's code. Every callback longer than interval
+    is caught. start_metrics_server exposes all of it in the Prometheus text format."""
+    latency_enabled = True
+    _histograms = {}
+    _loop_interval_ns = 0
+    _slow_callback_ns = 0
+    _heartbeat_ns = 0
+    _last_lag_ns = 0
+    _nr_tasks = 0
+    _nr_ready = 0
+    _stall = None  # (heartbeat_ns, name, location) sampled by the watchdog for the current stall
+    _blocked = defaultdict(lambda: [0, 0])  # name -> [stalls, total ns]
+    _monitor_task = None
+    _watchdog_stop = None
+
+    @classmethod
+    def record_latency(cls, stage: str, nanoseconds: int) -> None:
+        if cls.latency_enabled:
+            histogram = cls._histograms.get(stage)
+            if histogram is None:
+                histogram = cls._histograms[stage] = LatencyHistogram()
+            histogram.record(nanoseconds)
+
+    @classmethod
+    def latency_snapshot(cls, reset: bool = False) -> dict:
+        snapshot = {stage: histogram.summary() for stage, histogram in cls._histograms.items()}
+        if reset:
+            cls._histograms = {}
+        return snapshot
+
+    @classmethod
+    async def log_latency_summary(cls, interval: float = 60.0, reset: bool = True):
+        """Log a one-line summary per stage every interval seconds, optionally starting a fresh window each time."""
+        while True:
+            await asyncio.sleep(interval)
+            for stage, summary in cls.latency_snapshot(reset=reset).items():
+                monitor_logger.info("Latency %s: n=%s p50=%.0fus p99=%.0fus p99.9=%.0fus max=%.0fus", stage, summary["count"],
+                                    summary["p50_us"], summary["p99_us"], summary["p999_us"], summary["max_us"])
+
+    @classmethod
+    def start_loop_monitor(cls, interval: float = 0.05, slow_callback: float = 0.05) -> asyncio.Task:
+        """Start the lag probe on the running loop and the watchdog thread, once per process."""
+        if cls._monitor_task is not None and not cls._monitor_task.done():
+            return cls._monitor_task
+        loop = asyncio.get_running_loop()
+        cls._loop_interval_ns = int(interval * 1e9)
+        cls._slow_callback_ns = int(slow_callback * 1e9)
+        cls._heartbeat_ns = time.monotonic_ns()
+        cls._watchdog_stop = threading.Event()
+        watchdog = threading.Thread(target=cls._watchdog, args=(loop, threading.get_ident(), cls._watchdog_stop),
+                                    name="loop-watchdog", daemon=True)
+        watchdog.start()
+        cls._monitor_task = asyncio.create_task(cls._probe(loop), name="SystemMonitoring.loop_probe")
+        return cls._monitor_task
+
+    @classmethod
+    def stop_loop_monitor(cls) -> None:
+        if cls._monitor_task is not None:
+            cls._monitor_task.cancel()
+            cls._monitor_task = None
+        if cls._watchdog_stop is not None:
+            cls._watchdog_stop.set()
+
+    @classmethod
+    async def _probe(cls, loop: asyncio.AbstractEventLoop) -> None:
+        interval = cls._loop_interval_ns / 1e9
+        try:
+            while True:
+                due = time.monotonic_ns() + cls._loop_interval_ns
+                await asyncio.sleep(interval)
+                now = time.monotonic_ns()
+                lag = now - due
+                stall = cls._stall
+                cls._heartbeat_ns = now
+                cls._last_lag_ns = lag
+                cls.record_latency(STAGE_LOOP_LAG, lag)
+                cls._nr_tasks = len(asyncio.all_tasks(loop))
+                cls._nr_ready = len(getattr(loop, "_ready", ()))  # not exposed by uvloop
+                if stall is not None:
+                    cls._stall = None
+                    blocked = cls._blocked[stall[1]]
+                    blocked[0] += 1
+                    blocked[1] += lag
+                    monitor_logger.warning("Event loop blocked for %.1f ms in %s at %s, %s tasks", lag / 1e6, stall[1], stall[2], cls._nr_tasks)
+        finally:
+            if cls._watchdog_stop is not None:
+                cls._watchdog_stop.set()
+
+    @classmethod
+    def _watchdog(cls, loop: asyncio.AbstractEventLoop, loop_thread_id: int, stop: threading.Event) -> None:
+        period = min(cls._loop_interval_ns, cls._slow_callback_ns) / 2e9
+        while not stop.wait(period):
+            heartbeat = cls._heartbeat_ns
+            overdue = time.monotonic_ns() - heartbeat - cls._loop_interval_ns
+            if overdue > cls._slow_callback_ns and (cls._stall is None or cls._stall[0] != heartbeat):
+                name, location = cls._sample(loop, loop_thread_id)
+                cls._stall = (heartbeat, name, location)
+
+    @staticmethod
+    def _sample(loop: asyncio.AbstractEventLoop, loop_thread_id: int) -> tuple:
+        """(name, location) of what the loop thread is running, read from another thread."""
+        task = asyncio.tasks._current_tasks.get(loop)
+        if task is None:
+            name = "callback"
+        elif task.get_name().startswith("Task-"):
+            name = getattr(task.get_coro(), "__qualname__", task.get_name())
+        else:
+            name = task.get_name()
+        frame = sys._current_frames().get(loop_thread_id)
+        innermost, location = frame, None
+        while frame is not None:
+            if frame.f_code.co_filename.startswith(_SOURCE_DIR):
+                location = frame
+                break
+            frame = frame.f_back
+        location = location or innermost
+        if location is None:
+            return name, "unknown"
+        return name, f"{os.path.basename(location.f_code.co_filename)}:{location.f_lineno} {location.f_code.co_name}"
+
+    @classmethod
+    def loop_snapshot(cls) -> dict:
+        return {"lag_ms": cls._last_lag_ns / 1e6, "tasks": cls._nr_tasks, "ready_callbacks": cls._nr_ready,
+                "blocked": {name: {"count": count, "total_ms": total / 1e6} for name, (count, total) in cls._blocked.items()},
+                "rest": Client.scheduler.get_metrics()}
+
+    @classmethod
+    def metrics_text(cls) -> str:
+        """Prometheus text exposition of the latency histograms (as summaries over the current window), the loop
+        monitor and the REST request scheduler."""
+        lines = ["# HELP marketmaker_latency_seconds Hot-path latency per stage, loop_lag is the event loop lag",
+                 "# TYPE marketmaker_latency_seconds summary"]
+        for stage, histogram in list(cls._histograms.items()):
+            for quantile in (50, 90, 99, 99.9):
+                lines.append(f'marketmaker_latency_seconds{{stage="{stage}",quantile="{quantile / 100:g}"}} {histogram.percentile(quantile) / 1e9:.9f}')
+            lines.append(f'marketmaker_latency_seconds_sum{{stage="{stage}"}} {histogram.total / 1e9:.9f}')
+            lines.append(f'marketmaker_latency_seconds_count{{stage="{stage}"}} {histogram.count}')
+        for name, kind, help_text, value in (
+                ("event_loop_lag_seconds", "gauge", "Lag of the last probe wake-up", cls._last_lag_ns / 1e9),
+                ("event_loop_tasks", "gauge", "Tasks alive on the event loop", cls._nr_tasks),
+                ("event_loop_ready_callbacks", "gauge", "Callbacks waiting to run on the event loop", cls._nr_ready)):
+            lines += [f"# HELP marketmaker_{name} {help_text}", f"# TYPE marketmaker_{name} {kind}", f"marketmaker_{name} {value}"]
+        lines += ["# HELP marketmaker_event_loop_blocked_total Stalls longer than slow_callback by the task running",
+                  "# TYPE marketmaker_event_loop_blocked_total counter"]
+        blocked = list(cls._blocked.items())
+        for name, (count, _) in blocked:
+            lines.append(f'marketmaker_event_loop_blocked_total{{task="{_label(name)}"}} {count}')
+        lines += ["# HELP marketmaker_event_loop_blocked_seconds_total Time the loop stalled by the task running",
+                  "# TYPE marketmaker_event_loop_blocked_seconds_total counter"]
+        for name, (_, total) in blocked:
+            lines.append(f'marketmaker_event_loop_blocked_seconds_total{{task="{_label(name)}"}} {total / 1e9:.9f}')
+        rest = Client.scheduler.get_metrics()
+        for name, kind, help_text, value in (
+                ("rest_queue_depth", "gauge", "REST requests waiting for a rate limit token", rest["queue_depth"]),
+                ("rest_requests_total", "counter", "REST requests", rest["requests"]),
+                ("rest_queued_requests_total", "counter", "REST requests that had to wait for a token", rest["queued_requests"]),
+                ("rest_throttled_total", "counter", "429 responses", rest["throttled_responses"]),
+                ("rest_tokens", "gauge", "Rate limit tokens available", rest["tokens"])):
+            lines += [f"# HELP marketmaker_{name} {help_text}", f"# TYPE marketmaker_{name} {kind}", f"marketmaker_{name} {value}"]
+        return "\n".join(lines) + "\n"
+
+    @classmethod
+    async def start_metrics_server(cls, port: int, host: str = "127.0.0.1"):
+        """Serve metrics_text at http://host:port/metrics. Returns the aiohttp AppRunner, clean it up to stop."""
+        from aiohttp import web
+
+        async def metrics(request):
+            return web.Response(text=cls.metrics_text(), headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+        app = web.Application()
+        app.router.add_get("/metrics", metrics)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        monitor_logger.info("Serving metrics on http://%s:%s/metrics", host, port)
+        return runner
+
+
+_SOURCE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def _label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
 
 class MarketClock():
-    pass
\ No newline at end of file
+    """Regular trading sessions from the broker's calendar. /v2/clock and /v2/calendar are fetched once and the
+    calendar is cached as JSON at cache_path, so restarts within days_ahead make no request at all. Open and close
+    times are converted to ns since epoch in exchange time (early closes and holidays come with the calendar),
+    after which every check is a local lookup."""
+
+    def __init__(self, cache_path: Optional[str] = None, days_ahead: int = 30, exchange_timezone: str = "America/New_York",
+                 base_url: Optional[str] = None):
+        base_url = base_url or Client.base_url
+        self._clock_url = f"{base_url}/v2/clock"
+        self._calendar_url = f"{base_url}/v2/calendar"
+        self._cache_path = cache_path
+        self._days_ahead = days_ahead
+        self._timezone = ZoneInfo(exchange_timezone)
+        self._calendar = []
+        self._range: Optional[dict] = None
+        self._opens = np.empty(0, dtype=np.int64)
+        self._closes = np.empty(0, dtype=np.int64)
+        # Broker clock minus local clock, measured when the clock is fetched
+        self._offset_ns = 0
+
+    def _covers(self, calendar_range: Optional[dict]) -> bool:
+        """True when calendar_range runs from today to at least a week ahead, so the next open is always known."""
+        if not calendar_range:
+            return False
+        today = datetime.now(self._timezone).date()
+        horizon = (today + timedelta(days=min(7, self._days_ahead))).isoformat()
+        return calendar_range["start"] <= today.isoformat() and calendar_range["end"] >= horizon
+
+    async def load(self, force_refresh: bool = False) -> bool:
+        """Load the calendar from memory, the cache file or the API, in that order. Returns False if none had it."""
+        if not force_refresh and self._covers(self._range):
+            return True
+        if not force_refresh:
+            cached = self._read_cache()
+            if cached is not None and self._covers(cached.get("range")):
+                self._set_calendar(cached["calendar"], cached["range"])
+                return True
+        fetched = await self._fetch()
+        if fetched is None:
+            return len(self._opens) > 0
+        self._set_calendar(fetched["calendar"], fetched["range"])
+        self._write_cache(fetched)
+        return True
+
+    def _read_cache(self) -> Optional[dict]:
+        if self._cache_path is None or not os.path.exists(self._cache_path):
+            return None
+        try:
+            with open(self._cache_path, "rb") as file:
+                return _json_loads(file.read())
+        except (OSError, ValueError) as e:
+            clock_logger.warning("Ignoring unreadable calendar cache %s: %s", self._cache_path, e)
+            return None
+
+    def _write_cache(self, data: dict) -> None:
+        if self._cache_path is None:
+            return
+        # Write then rename, sharded workers may share the cache file
+        temporary_path = f"{self._cache_path}.{os.getpid()}.tmp"
+        try:
+            with open(temporary_path, "w") as file:
+                file.write(_json_dumps(data))
+            os.replace(temporary_path, self._cache_path)
+        except OSError as e:
+            clock_logger.warning("Failed to write calendar cache %s: %s", self._cache_path, e)
+
+    async def _fetch(self) -> Optional[dict]:
+        start = datetime.now(self._timezone).date()
+        calendar_range = {"start": start.isoformat(), "end": (start + timedelta(days=self._days_ahead)).isoformat()}
+        try:
+            requested_ns = time.time_ns()
+            async with Client.request("GET", self._clock_url, priority=PRIORITY_LOW) as result:
+                clock_body = await result.read()
+                received_ns = time.time_ns()
+                if result.status == 200:
+                    broker_ns = timestamp_ns(datetime.fromisoformat(_json_loads(clock_body)["timestamp"]))
+                    self._offset_ns = broker_ns - (requested_ns + received_ns) // 2
+                    if abs(self._offset_ns) > 1_000_000_000:
+                        clock_logger.warning("Local clock is %.1fs off the broker clock", -self._offset_ns / 1e9)
+                else:
+                    clock_logger.warning("Failed to get clock (Status %s): %s", result.status, clock_body.decode())
+            async with Client.request("GET", self._calendar_url, priority=PRIORITY_LOW, params=calendar_range) as result:
+                calendar_body = await result.read()
+                if result.status != 200:
+                    clock_logger.warning("Failed to get calendar (Status %s): %s", result.status, calendar_body.decode())
+                    return None
+        except Exception as e:
+            clock_logger.warning("Error loading market calendar: %s", e)
+            return None
+        calendar = [{"date": day["date"], "open": day["open"], "close": day["close"]} for day in _json_loads(calendar_body)]
+        clock_logger.info("Loaded market calendar %s to %s, %s sessions", calendar_range["start"], calendar_range["end"], len(calendar))
+        return {"range": calendar_range, "calendar": calendar}
+
+    def _session_ns(self, day: str, hours: str) -> int:
+        return timestamp_ns(datetime.fromisoformat(f"{day}T{hours}").replace(tzinfo=self._timezone))
+
+    def _set_calendar(self, calendar: list, calendar_range: dict) -> None:
+        self._calendar = sorted(calendar, key=lambda day: day["date"])
+        self._range = calendar_range
+        self._opens = np.array([self._session_ns(day["date"], day["open"]) for day in self._calendar], dtype=np.int64)
+        self._closes = np.array([self._session_ns(day["date"], day["close"]) for day in self._calendar], dtype=np.int64)
+
+    def now_ns(self) -> int:
+        """Current time on the broker clock, ns since epoch."""
+        return time.time_ns() + self._offset_ns
+
+    def _session_index(self, now: int) -> int:
+        """Index of the first session that has not closed yet at now."""
+        return int(np.searchsorted(self._closes, now, side="right"))
+
+    def get_session(self, now: Optional[int] = None) -> Optional[tuple]:
+        """(open, close) in ns since epoch of the session in progress, None while the market is closed."""
+        now = self.now_ns() if now is None else now
+        index = self._session_index(now)
+        if index < len(self._opens) and self._opens[index] <= now:
+            return int(self._opens[index]), int(self._closes[index])
+        return None
+
+    def is_open(self, now: Optional[int] = None) -> bool:
+        return self.get_session(now) is not None
+
+    def next_open(self, now: Optional[int] = None) -> Optional[int]:
+        """Open of the next session that has not started yet, None beyond the loaded calendar."""
+        now = self.now_ns() if now is None else now
+        index = int(np.searchsorted(self._opens, now, side="right"))
+        return int(self._opens[index]) if index < len(self._opens) else None
+
+    def next_close(self, now: Optional[int] = None) -> Optional[int]:
+        """Close of the session in progress, or of the next one while the market is closed."""
+        now = self.now_ns() if now is None else now
+        index = self._session_index(now)
+        return int(self._closes[index]) if index < len(self._closes) else None
+
+    async def wait_until_open(self, max_sleep: float = 3600.0) -> None:
+        """Return at once if the market is open, otherwise sleep until the next open."""
+        while not self.is_open():
+            await self.load()
+            next_open = self.next_open()
+            delay = (next_open - self.now_ns()) / 1e9 if next_open is not None else max_sleep
+            await asyncio.sleep(min(max(delay, 0.0), max_sleep))
+
+
+class TradingHoursScheduler:
+    """Drives strategies from a MarketClock. on_close runs when the market is closed (and once at startup if it is),
+    on_open at every open and on_flatten flatten_before seconds ahead of every close. Callbacks are coroutine
+    functions, each is called once per transition. Sleeps are capped at max_sleep so a suspended host or a clock
+    adjustment is caught up with on the next wake-up."""
+
+    def __init__(self, clock: MarketClock, on_open, on_close, on_flatten=None, flatten_before: float = 300.0, max_sleep: float = 600.0):
+        self._clock = clock
+        self._callbacks = {"open": on_open, "close": on_close, "flatten": on_flatten or on_close}
+        self._flatten_before_ns = int(flatten_before * 1_000_000_000)
+        self._max_sleep = max_sleep
+        self._state: Optional[str] = None
+
+    def get_state(self) -> Optional[str]:
+        """"open", "flatten" or "close", None before the first transition."""
+        return self._state
+
+    async def _transition(self, state: str) -> None:
+        if state == self._state:
+            return
+        clock_logger.info("Trading hours: %s -> %s", self._state, state)
+        self._state = state
+        try:
+            await self._callbacks[state]()
+        except Exception as e:
+            clock_logger.error("Trading hours %s callback failed: %s", state, e)
+
+    async def update(self) -> Optional[int]:
+        """Run the transition due now, if any. Returns when the next one is due, None if beyond the calendar."""
+        await self._clock.load()
+        now = self._clock.now_ns()
+        session = self._clock.get_session(now)
+        if session is None:
+            await self._transition("close")
+            return self._clock.next_open(now)
+        flatten_ns = session[1] - self._flatten_before_ns
+        if now < flatten_ns:
+            await self._transition("open")
+            return flatten_ns
+        await self._transition("flatten")
+        return session[1]
+
+    async def run(self) -> None:
+        while True:
+            timestamp = await self.update()
+            delay = (timestamp - self._clock.now_ns()) / 1e9 if timestamp is not None else self._max_sleep
+            await asyncio.sleep(min(max(delay, 0.0), self._max_sleep))
\ No newline at end of file
@@ -0,0 +1,15 @@
+from backtest import MatchingEngine
+from core import QuoteRecord, TradeRecord, NEW, CANCELED, SIDE_BUY, ORDER_TYPE_DAY, ORDER_TYPE_IOC
+
+
+def test_zero_size_touch_does_not_fill():
+    engine = MatchingEngine()
+    engine.on_quote(QuoteRecord("AAPL", 99.9, 5, 100.0, 0, 1))
+    updates = engine.submit("AAPL", 1, SIDE_BUY, 100.0, ORDER_TYPE_IOC, 2)
+    assert [update.event for update in updates] == [NEW, CANCELED]
+    assert engine.nr_fills == 0
+
+    order_id = engine.submit("AAPL", 1, SIDE_BUY, 99.95, ORDER_TYPE_DAY, 3)[0].order["id"]
+    assert engine.on_quote(QuoteRecord("AAPL", 99.8, 5, 99.9, 0, 4)) == []
+    assert engine.on_trade(TradeRecord("AAPL", 99.9, 0, 5)) == []
+    assert engine.get_order(order_id)["filled_qty"] == 0
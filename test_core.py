@@ -0,0 +1,77 @@
+from core import OrderStateStore, RiskManager, NEW, FILL, PARTIAL_FILL, CANCELED, HELD, SIDE_BUY, SIDE_SELL
+
+
+def bracket(order_id: str, side: str, price: float, status: str = "new", leg_status: str = HELD) -> dict:
+    exit_side = SIDE_SELL if side == SIDE_BUY else SIDE_BUY
+    legs = [{"id": f"{order_id}-tp", "symbol": "AAPL", "side": exit_side, "qty": "1", "status": leg_status},
+            {"id": f"{order_id}-sl", "symbol": "AAPL", "side": exit_side, "qty": "1", "status": leg_status}]
+    return {"id": order_id, "symbol": "AAPL", "side": side, "qty": "1", "limit_price": str(price), "status": status,
+            "order_class": "bracket", "legs": legs}
+
+
+def order(order_id: str, status: str, side: str = SIDE_BUY) -> dict:
+    return {"id": order_id, "symbol": "AAPL", "side": side, "qty": "2", "limit_price": "99.9", "status": status}
+
+
+def test_order_lifecycle_updates_live_counts():
+    store = OrderStateStore()
+    store.on_submitted(order("o1", "new"))
+    store.on_submitted(order("o2", "new", SIDE_SELL))
+    assert store.count_live("AAPL") == 2
+    assert [state.order_id for state in store.get_live_orders("AAPL", SIDE_SELL)] == ["o2"]
+    store.on_snapshot(order("o1", "partially_filled"))
+    assert store.get_order("o1").status == PARTIAL_FILL
+    assert store.count_live("AAPL") == 2
+    store.on_snapshot(order("o1", "filled"))
+    store.on_snapshot(order("o2", "canceled", SIDE_SELL))
+    assert store.count_live("AAPL") == 0
+    assert store.count_live() == 0
+    assert [state.order_id for state in store.get_orders(status=FILL)] == ["o1"]
+
+
+def test_terminal_orders_stay_terminal():
+    store = OrderStateStore()
+    store.on_snapshot(order("o1", "new"))
+    store.on_snapshot(order("o1", "canceled"))
+    store.on_snapshot(order("o1", "new"))  # a listing that raced the stream cancel
+    state = store.get_order("o1")
+    assert state.status == CANCELED
+    assert not state.is_live()
+    assert store.count_live("AAPL") == 0
+    assert store.get_live_orders("AAPL") == []
+    assert store.get_orders(status=NEW) == []
+
+
+def test_evicts_terminal_orders_oldest_first():
+    store = OrderStateStore(max_terminal_orders=1)
+    store.on_snapshot(order("o1", "new"))
+    store.on_snapshot(order("o2", "new"))
+    store.on_snapshot(order("o1", "canceled"))
+    store.on_snapshot(order("o2", "canceled"))
+    assert store.get_order("o1") is None
+    assert store.get_order("o2").status == CANCELED
+    assert len(store) == 1
+
+
+def test_held_legs_are_not_counted_as_live():
+    store = OrderStateStore()
+    store.on_submitted(bracket("b1", SIDE_BUY, 99.9))
+    store.on_submitted(bracket("b2", SIDE_SELL, 100.1))
+    assert store.count_live("AAPL") == 2
+    assert store.count_live() == 2
+    assert len(store.get_live_orders("AAPL")) == 6
+
+    risk_manager = RiskManager(order_store=store)
+    risk_manager.update_mid("AAPL", 100.0)
+    assert risk_manager.check_orders(["AAPL", "AAPL"], [SIDE_BUY, SIDE_SELL], [1, 1], [99.9, 100.1]).all()
+
+
+def test_released_legs_are_counted_as_live():
+    store = OrderStateStore()
+    store.on_submitted(bracket("b1", SIDE_BUY, 99.9))
+    store.on_snapshot(bracket("b1", SIDE_BUY, 99.9, status="filled", leg_status=NEW))
+    assert store.get_order("b1").status == FILL
+    assert store.count_live("AAPL") == 2
+    store.on_snapshot({"id": "b1-sl", "symbol": "AAPL", "side": SIDE_SELL, "status": "canceled"})
+    assert store.count_live("AAPL") == 1
+    assert store.count_live() == 1
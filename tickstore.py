@@ -0,0 +1,256 @@
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Optional
+
+import numpy as np
+
+from core import TRADE_HIST_DTYPE, BAR_HIST_DTYPE, timestamp_ns
+
+# Recorded data lives in {root}/{YYYYMMDD}/{kind}/{symbol}.bin, one file per UTC day, kind and symbol.
+# Each file is a headerless array of fixed-width records of the kind's dtype, so np.memmap reads it as is.
+KIND_QUOTES = "quotes"
+KIND_TRADES = "trades"
+KIND_BARS = "bars"
+KIND_TRADE_UPDATES = "trade_updates"
+
+QUOTE_RECORD_DTYPE = np.dtype([("timestamp", np.int64), ("bid_price", np.float64), ("bid_size", np.float64),
+                               ("ask_price", np.float64), ("ask_size", np.float64)])
+TRADE_RECORD_DTYPE = TRADE_HIST_DTYPE
+BAR_RECORD_DTYPE = BAR_HIST_DTYPE
+TRADE_UPDATE_RECORD_DTYPE = np.dtype([("timestamp", np.int64), ("event", "S24"), ("order_id", "S36"), ("side", "S4"),
+                                      ("price", np.float64), ("qty", np.float64), ("position_qty", np.float64),
+                                      ("filled_qty", np.float64)])
+RECORD_DTYPES = {KIND_QUOTES: QUOTE_RECORD_DTYPE, KIND_TRADES: TRADE_RECORD_DTYPE, KIND_BARS: BAR_RECORD_DTYPE,
+                 KIND_TRADE_UPDATES: TRADE_UPDATE_RECORD_DTYPE}
+
+_NS_PER_DAY = 86_400 * 1_000_000_000
+
+
+def day_of(timestamp: int) -> str:
+    """UTC YYYYMMDD of a ns timestamp."""
+    return datetime.fromtimestamp(timestamp // 1_000_000_000, tz=timezone.utc).strftime("%Y%m%d")
+
+
+def record_path(root: str, day: str, kind: str, symbol: str) -> str:
+    return os.path.join(root, day, kind, f"{symbol}.bin")
+
+
+def _float_or_nan(value) -> float:
+    return float(value) if value is not None else np.nan
+
+
+class TickRecorder:
+    """Append-only recorder for quotes, trades, bars and trade_updates. The record_* calls only build a
+    tuple and put it on a queue; a background thread batches the queue into the per-symbol files, so
+    the event loop never waits on disk. Files rotate when the UTC day of the records changes."""
+
+    def __init__(self, root: str, flush_interval: float = 1.0):
+        self._root = root
+        self._flush_interval = flush_interval
+        self._queue = queue.SimpleQueue()
+        self._thread: Optional[threading.Thread] = None
+        self._files = {}
+        self._day: Optional[str] = None
+        self._nr_records = 0
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="TickRecorder", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Write out everything queued so far and close the files."""
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+
+    def get_root(self) -> str:
+        return self._root
+
+    def get_record_count(self) -> int:
+        """Records written to disk so far."""
+        return self._nr_records
+
+    def record_quote(self, quote) -> None:
+        self._queue.put((KIND_QUOTES, quote.symbol, (timestamp_ns(quote.timestamp), quote.bid_price, quote.bid_size,
+                                                     quote.ask_price, quote.ask_size)))
+
+    def record_trade(self, trade) -> None:
+        self._queue.put((KIND_TRADES, trade.symbol, (timestamp_ns(trade.timestamp), trade.price, trade.size)))
+
+    def record_bar(self, bar) -> None:
+        self._queue.put((KIND_BARS, bar.symbol, (timestamp_ns(bar.timestamp), bar.open, bar.high, bar.low, bar.close, bar.volume)))
+
+    def record_trade_update(self, trade_update) -> None:
+        order = trade_update.order
+        timestamp = timestamp_ns(trade_update.timestamp) if trade_update.timestamp is not None else time.time_ns()
+        self._queue.put((KIND_TRADE_UPDATES, order["symbol"], (timestamp, trade_update.event, order["id"], order["side"],
+                                                               _float_or_nan(trade_update.price), _float_or_nan(trade_update.qty),
+                                                               _float_or_nan(trade_update.position_qty),
+                                                               _float_or_nan(order.get("filled_qty")))))
+
+    def _run(self) -> None:
+        stopping = False
+        days = {}  # day number since epoch -> YYYYMMDD, keeps datetime formatting off the per-record path
+        while not stopping:
+            batches = {}
+            # Sleep then drain, so each wake-up writes one large batch instead of a record at a time
+            time.sleep(self._flush_interval)
+            try:
+                while True:
+                    item = self._queue.get_nowait()
+                    if item is None:
+                        stopping = True
+                        break
+                    kind, symbol, record = item
+                    day_number = record[0] // _NS_PER_DAY
+                    day = days.get(day_number)
+                    if day is None:
+                        day = days[day_number] = day_of(record[0])
+                    batch = batches.get((day, kind, symbol))
+                    if batch is None:
+                        batch = batches[(day, kind, symbol)] = []
+                    batch.append(record)
+            except queue.Empty:
+                pass
+            try:
+                self._write(batches)
+            except Exception as e:
+                logging.error(f"TickRecorder failed to write {sum(map(len, batches.values()))} records: {e}")
+        for handle in self._files.values():
+            handle.close()
+        self._files.clear()
+
+    def _write(self, batches: dict) -> None:
+        for (day, kind, symbol), records in sorted(batches.items()):
+            if day != self._day:
+                self._rotate(day)
+            handle = self._files.get((day, kind, symbol))
+            if handle is None:
+                path = record_path(self._root, day, kind, symbol)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                handle = self._files[(day, kind, symbol)] = open(path, "ab")
+            handle.write(np.array(records, dtype=RECORD_DTYPES[kind]).tobytes())
+            handle.flush()
+            self._nr_records += len(records)
+
+    def _rotate(self, day: str) -> None:
+        """Close the files of days before day. Late records for an older day reopen its file in append mode."""
+        for key in [key for key in self._files if key[0] < day]:
+            self._files.pop(key).close()
+        if self._day is None or day > self._day:
+            self._day = day
+
+
+class HistoricalDataClient:
+    """Read side of TickRecorder. Files are opened as read-only memory maps on first use, so only the
+    pages a query touches are read from disk. Each file is in arrival order, which the searchsorted time
+    lookups take as time order per symbol. Queries within one day return zero-copy views into the map;
+    a range spanning several days is concatenated into a new array."""
+
+    def __init__(self, root: str):
+        self._root = root
+        self._maps = {}
+
+    def get_days(self) -> list:
+        """Recorded days, YYYYMMDD, oldest first."""
+        if not os.path.isdir(self._root):
+            return []
+        return sorted(day for day in os.listdir(self._root) if len(day) == 8 and day.isdigit())
+
+    def get_symbols(self, kind: str, day: Optional[str] = None) -> list:
+        days = [day] if day is not None else self.get_days()
+        symbols = set()
+        for day in days:
+            directory = os.path.join(self._root, day, kind)
+            if os.path.isdir(directory):
+                symbols.update(name[:-4] for name in os.listdir(directory) if name.endswith(".bin"))
+        return sorted(symbols)
+
+    def _open(self, day: str, kind: str, symbol: str) -> Optional[np.ndarray]:
+        key = (day, kind, symbol)
+        records = self._maps.get(key)
+        if records is None:
+            path = record_path(self._root, day, kind, symbol)
+            dtype = RECORD_DTYPES[kind]
+            # Ignore a trailing partial record the recorder may still be writing
+            nr_records = os.path.getsize(path) // dtype.itemsize if os.path.exists(path) else 0
+            if nr_records == 0:
+                return None
+            records = np.memmap(path, dtype=dtype, mode="r", shape=(nr_records,))
+            # Today's file keeps growing, so only cache maps of finished days
+            if day != day_of(time.time_ns()):
+                self._maps[key] = records
+        return records
+
+    def query(self, kind: str, symbol: str, start: Optional[int] = None, end: Optional[int] = None) -> np.ndarray:
+        """Records of kind for symbol with start <= timestamp < end (ns since epoch, None for unbounded)."""
+        days = self.get_days()
+        if start is not None:
+            days = [day for day in days if day >= day_of(start)]
+        if end is not None:
+            days = [day for day in days if day <= day_of(end - 1)]
+        parts = []
+        for day in days:
+            records = self._open(day, kind, symbol)
+            if records is None:
+                continue
+            timestamps = records["timestamp"]
+            first = int(np.searchsorted(timestamps, start, side="left")) if start is not None else 0
+            last = int(np.searchsorted(timestamps, end, side="left")) if end is not None else len(records)
+            if last > first:
+                parts.append(records[first:last])
+        if not parts:
+            return np.empty(0, dtype=RECORD_DTYPES[kind])
+        return parts[0] if len(parts) == 1 else np.concatenate(parts)
+
+    def last(self, kind: str, symbol: str, n: int, before: Optional[int] = None) -> np.ndarray:
+        """The latest n records of kind for symbol with timestamp < before, oldest first."""
+        parts, remaining = [], n
+        for day in reversed(self.get_days()):
+            if remaining == 0:
+                break
+            if before is not None and day > day_of(before - 1):
+                continue
+            records = self._open(day, kind, symbol)
+            if records is None:
+                continue
+            last = int(np.searchsorted(records["timestamp"], before, side="left")) if before is not None else len(records)
+            first = max(0, last - remaining)
+            if last > first:
+                parts.append(records[first:last])
+                remaining -= last - first
+        if not parts:
+            return np.empty(0, dtype=RECORD_DTYPES[kind])
+        return parts[0] if len(parts) == 1 else np.concatenate(parts[::-1])
+
+    def get_quotes(self, symbol: str, start: Optional[int] = None, end: Optional[int] = None) -> np.ndarray:
+        return self.query(KIND_QUOTES, symbol, start, end)
+
+    def get_trades(self, symbol: str, start: Optional[int] = None, end: Optional[int] = None) -> np.ndarray:
+        return self.query(KIND_TRADES, symbol, start, end)
+
+    def get_bars(self, symbol: str, start: Optional[int] = None, end: Optional[int] = None) -> np.ndarray:
+        return self.query(KIND_BARS, symbol, start, end)
+
+    def get_trade_updates(self, symbol: str, start: Optional[int] = None, end: Optional[int] = None) -> np.ndarray:
+        return self.query(KIND_TRADE_UPDATES, symbol, start, end)
+
+    def get_last_quotes(self, symbol: str, n: int, before: Optional[int] = None) -> np.ndarray:
+        return self.last(KIND_QUOTES, symbol, n, before)
+
+    def get_last_trades(self, symbol: str, n: int, before: Optional[int] = None) -> np.ndarray:
+        return self.last(KIND_TRADES, symbol, n, before)
+
+    def get_last_bars(self, symbol: str, n: int, before: Optional[int] = None) -> np.ndarray:
+        return self.last(KIND_BARS, symbol, n, before)
+
+    def close(self) -> None:
+        self._maps.clear()